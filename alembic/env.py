@@ -53,7 +53,8 @@ def run_migrations_online():
     and associate a connection with the context.
 
     """
-    connectable = engine_from_config(
+    # or the engine passed in by the caller, as in tests/test_migrations.py
+    connectable = config.attributes.get('engine') or engine_from_config(
         config.get_section(config.config_ini_section),
         prefix='sqlalchemy.',
         poolclass=pool.NullPool)
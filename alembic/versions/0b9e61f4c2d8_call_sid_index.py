@@ -0,0 +1,24 @@
+"""call sid index
+
+Revision ID: 0b9e61f4c2d8
+Revises: e5b0c3d8a6f1
+Create Date: 2026-10-18 13:05:51.690214
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = '0b9e61f4c2d8'
+down_revision = 'e5b0c3d8a6f1'
+branch_labels = None
+depends_on = None
+
+from alembic import op
+import sqlalchemy as sa
+
+
+def upgrade():
+    op.create_index('ix_calls_call_id', 'calls', ['call_id'], unique=False)
+
+
+def downgrade():
+    op.drop_index('ix_calls_call_id', table_name='calls')
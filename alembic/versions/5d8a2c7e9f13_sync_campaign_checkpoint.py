@@ -0,0 +1,26 @@
+"""sync campaign checkpoint
+
+Revision ID: 5d8a2c7e9f13
+Revises: 0b9e61f4c2d8
+Create Date: 2026-10-18 13:48:02.531907
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = '5d8a2c7e9f13'
+down_revision = '0b9e61f4c2d8'
+branch_labels = None
+depends_on = None
+
+from alembic import op
+import sqlalchemy as sa
+
+
+def upgrade():
+    with op.batch_alter_table('sync_campaign', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('last_call_id', sa.Integer(), nullable=True))
+
+
+def downgrade():
+    with op.batch_alter_table('sync_campaign', schema=None) as batch_op:
+        batch_op.drop_column('last_call_id')
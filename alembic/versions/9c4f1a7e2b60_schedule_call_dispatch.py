@@ -0,0 +1,28 @@
+"""schedule call location and dispatch index
+
+Revision ID: 9c4f1a7e2b60
+Revises: 5d8a2c7e9f13
+Create Date: 2026-10-18 14:31:17.402816
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = '9c4f1a7e2b60'
+down_revision = '5d8a2c7e9f13'
+branch_labels = None
+depends_on = None
+
+from alembic import op
+import sqlalchemy as sa
+
+
+def upgrade():
+    with op.batch_alter_table('schedule_call', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('location', sa.String(length=255), nullable=True))
+    op.create_index('ix_schedule_call_subscribed_time', 'schedule_call', ['subscribed', 'time_to_call'], unique=False)
+
+
+def downgrade():
+    op.drop_index('ix_schedule_call_subscribed_time', table_name='schedule_call')
+    with op.batch_alter_table('schedule_call', schema=None) as batch_op:
+        batch_op.drop_column('location')
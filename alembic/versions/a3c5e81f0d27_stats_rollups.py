@@ -0,0 +1,66 @@
+"""stats rollup tables
+
+Revision ID: a3c5e81f0d27
+Revises: 4f2d9aae4765
+Create Date: 2026-10-18 10:12:41.302518
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = 'a3c5e81f0d27'
+down_revision = '4f2d9aae4765'
+branch_labels = None
+depends_on = None
+
+from alembic import op
+import sqlalchemy as sa
+
+
+def upgrade():
+    op.create_table('stats_call_rollup',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('hour', sa.DateTime(), nullable=False),
+    sa.Column('campaign_id', sa.Integer(), nullable=False),
+    sa.Column('target_id', sa.Integer(), nullable=True),
+    sa.Column('status', sa.String(length=25), nullable=False),
+    sa.Column('count', sa.Integer(), nullable=False),
+    sa.Column('duration', sa.Integer(), nullable=False),
+    sa.ForeignKeyConstraint(['campaign_id'], ['campaign_campaign.id'], ),
+    sa.ForeignKeyConstraint(['target_id'], ['campaign_target.id'], ),
+    sa.PrimaryKeyConstraint('id'),
+    sa.UniqueConstraint('campaign_id', 'hour', 'target_id', 'status', name='stats_call_rollup_bucket')
+    )
+    op.create_table('stats_session_rollup',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('hour', sa.DateTime(), nullable=False),
+    sa.Column('campaign_id', sa.Integer(), nullable=False),
+    sa.Column('count', sa.Integer(), nullable=False),
+    sa.Column('queue_delay_count', sa.Integer(), nullable=False),
+    sa.Column('queue_delay_seconds', sa.Float(), nullable=False),
+    sa.ForeignKeyConstraint(['campaign_id'], ['campaign_campaign.id'], ),
+    sa.PrimaryKeyConstraint('id'),
+    sa.UniqueConstraint('campaign_id', 'hour', name='stats_session_rollup_bucket')
+    )
+    op.create_table('stats_session_calls_rollup',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('campaign_id', sa.Integer(), nullable=False),
+    sa.Column('calls_completed', sa.Integer(), nullable=False),
+    sa.Column('sessions', sa.Integer(), nullable=False),
+    sa.ForeignKeyConstraint(['campaign_id'], ['campaign_campaign.id'], ),
+    sa.PrimaryKeyConstraint('id'),
+    sa.UniqueConstraint('campaign_id', 'calls_completed', name='stats_session_calls_rollup_bucket')
+    )
+    op.create_table('stats_rollup_watermark',
+    sa.Column('name', sa.String(length=40), nullable=False),
+    sa.Column('last_id', sa.Integer(), nullable=False),
+    sa.Column('updated', sa.DateTime(), nullable=True),
+    sa.PrimaryKeyConstraint('name')
+    )
+    # existing calls are rolled up by `python manager.py rollupstats`
+
+
+def downgrade():
+    op.drop_table('stats_rollup_watermark')
+    op.drop_table('stats_session_calls_rollup')
+    op.drop_table('stats_session_rollup')
+    op.drop_table('stats_call_rollup')
@@ -0,0 +1,32 @@
+"""call and session indexes
+
+Revision ID: c7d2e4b19a35
+Revises: a3c5e81f0d27
+Create Date: 2026-10-18 11:02:17.418332
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = 'c7d2e4b19a35'
+down_revision = 'a3c5e81f0d27'
+branch_labels = None
+depends_on = None
+
+from alembic import op
+import sqlalchemy as sa
+
+
+def upgrade():
+    op.create_index('ix_calls_campaign_status_timestamp', 'calls', ['campaign_id', 'status', 'timestamp'], unique=False)
+    op.create_index('ix_calls_status_timestamp', 'calls', ['status', 'timestamp'], unique=False)
+    op.create_index('ix_calls_session_status', 'calls', ['session_id', 'status'], unique=False)
+    op.create_index('ix_calls_session_campaign_timestamp', 'calls_session', ['campaign_id', 'timestamp'], unique=False)
+    op.create_index('ix_calls_session_phone_hash', 'calls_session', ['phone_hash'], unique=False)
+
+
+def downgrade():
+    op.drop_index('ix_calls_session_phone_hash', table_name='calls_session')
+    op.drop_index('ix_calls_session_campaign_timestamp', table_name='calls_session')
+    op.drop_index('ix_calls_session_status', table_name='calls')
+    op.drop_index('ix_calls_status_timestamp', table_name='calls')
+    op.drop_index('ix_calls_campaign_status_timestamp', table_name='calls')
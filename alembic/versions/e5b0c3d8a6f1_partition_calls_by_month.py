@@ -0,0 +1,154 @@
+"""partition calls and sessions by month
+
+Revision ID: e5b0c3d8a6f1
+Revises: c7d2e4b19a35
+Create Date: 2026-10-18 12:20:44.107251
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = 'e5b0c3d8a6f1'
+down_revision = 'c7d2e4b19a35'
+branch_labels = None
+depends_on = None
+
+from datetime import datetime
+
+from alembic import op
+import sqlalchemy as sa
+
+# postgres 11 added primary keys and default partitions on partitioned tables
+MINIMUM_VERSION = 110000
+MONTHS_AHEAD = 2
+
+INDEXES = {
+    'calls': [
+        ('ix_calls_campaign_status_timestamp', ['campaign_id', 'status', 'timestamp']),
+        ('ix_calls_status_timestamp', ['status', 'timestamp']),
+        ('ix_calls_session_status', ['session_id', 'status']),
+    ],
+    'calls_session': [
+        ('ix_calls_session_campaign_timestamp', ['campaign_id', 'timestamp']),
+        ('ix_calls_session_phone_hash', ['phone_hash']),
+    ],
+}
+
+# foreign keys to these tables, which postgres can't keep once they are partitioned
+FOREIGN_KEYS = [
+    ('calls', 'session_id', 'calls_session'),
+    ('sync_call', 'call_id', 'calls'),
+]
+
+# foreign keys from these tables, which CREATE TABLE ... LIKE doesn't copy, added again to the new tables
+TABLE_FOREIGN_KEYS = {
+    'calls': [('campaign_id', 'campaign_campaign'), ('target_id', 'campaign_target')],
+    'calls_session': [('campaign_id', 'campaign_campaign')],
+}
+
+
+def add_months(month, n):
+    months = month.year * 12 + month.month - 1 + n
+    return datetime(months // 12, months % 12 + 1, 1)
+
+
+def bound(month):
+    return "'{:%Y-%m-%d} 00:00:00+00'".format(month)
+
+
+def can_partition():
+    bind = op.get_bind()
+    if bind.dialect.name != 'postgresql':
+        return False
+    if bind.dialect.server_version_info < (11,):
+        print 'postgres 11 or later is needed to partition calls, skipping'
+        return False
+    return True
+
+
+def drop_foreign_keys():
+    inspector = sa.inspect(op.get_bind())
+    for (table, column, referred) in FOREIGN_KEYS:
+        for fk in inspector.get_foreign_keys(table):
+            if fk['referred_table'] == referred and fk['constrained_columns'] == [column]:
+                op.drop_constraint(fk['name'], table, type_='foreignkey')
+
+
+def create_table_foreign_keys(table):
+    for (column, referred) in TABLE_FOREIGN_KEYS[table]:
+        op.create_foreign_key(None, table, referred, [column], ['id'])
+
+
+def partition_table(table):
+    bind = op.get_bind()
+    old = table + '_unpartitioned'
+
+    for (name, columns) in INDEXES[table]:
+        op.drop_index(name, table_name=table)
+    op.rename_table(table, old)
+    op.execute('ALTER TABLE {} DROP CONSTRAINT {}_pkey'.format(old, table))
+
+    first = bind.execute('SELECT min(timestamp) FROM {}'.format(old)).scalar()
+    op.execute('CREATE TABLE {} (LIKE {} INCLUDING DEFAULTS) PARTITION BY RANGE (timestamp)'.format(table, old))
+    op.execute('ALTER SEQUENCE {0}_id_seq OWNED BY {0}.id'.format(table))
+    op.execute('ALTER TABLE {} ADD PRIMARY KEY (id, timestamp)'.format(table))
+    op.execute('CREATE TABLE {0}_default PARTITION OF {0} DEFAULT'.format(table))
+
+    now = datetime.utcnow()
+    month = datetime((first or now).year, (first or now).month, 1)
+    last = add_months(datetime(now.year, now.month, 1), MONTHS_AHEAD)
+    while month <= last:
+        op.execute('CREATE TABLE {table}_y{month:%Y}m{month:%m} PARTITION OF {table} '
+                   'FOR VALUES FROM ({start}) TO ({end})'.format(
+                       table=table, month=month, start=bound(month), end=bound(add_months(month, 1))))
+        month = add_months(month, 1)
+
+    # rows without a timestamp can't be in the primary key, file them under the epoch
+    op.execute("UPDATE {} SET timestamp = '1970-01-01 00:00:00+00' WHERE timestamp IS NULL".format(old))
+    op.execute('INSERT INTO {} SELECT * FROM {}'.format(table, old))
+    op.drop_table(old)
+
+    for (name, columns) in INDEXES[table]:
+        op.create_index(name, table, columns, unique=False)
+    create_table_foreign_keys(table)
+
+
+def unpartition_table(table):
+    old = table + '_partitioned'
+
+    for (name, columns) in INDEXES[table]:
+        op.drop_index(name, table_name=table)
+    op.rename_table(table, old)
+    op.execute('ALTER TABLE {} DROP CONSTRAINT {}_pkey'.format(old, table))
+
+    op.execute('CREATE TABLE {} (LIKE {} INCLUDING DEFAULTS)'.format(table, old))
+    op.execute('ALTER SEQUENCE {0}_id_seq OWNED BY {0}.id'.format(table))
+    op.execute('INSERT INTO {} SELECT * FROM {}'.format(table, old))
+    op.execute('DROP TABLE {} CASCADE'.format(old))
+    op.execute('ALTER TABLE {} ADD PRIMARY KEY (id)'.format(table))
+    op.alter_column(table, 'timestamp', nullable=True)
+
+    for (name, columns) in INDEXES[table]:
+        op.create_index(name, table, columns, unique=False)
+    create_table_foreign_keys(table)
+
+
+def upgrade():
+    if not can_partition():
+        return
+
+    drop_foreign_keys()
+    partition_table('calls_session')
+    partition_table('calls')
+
+
+def downgrade():
+    if not can_partition():
+        return
+    bind = op.get_bind()
+    if not bind.execute("SELECT 1 FROM pg_partitioned_table WHERE partrelid = to_regclass('calls')").scalar():
+        return
+
+    unpartition_table('calls')
+    unpartition_table('calls_session')
+    for (table, column, referred) in FOREIGN_KEYS:
+        op.create_foreign_key(None, table, referred, [column], ['id'])
@@ -0,0 +1,169 @@
+"""
+Compiled blocklist, checked on every call.
+
+Rather than load and match every Blocklist row for each /call/create and
+scheduled call, active blocks are compiled into sets of IP addresses, phone
+hashes and e164 numbers, so a check is a few dict lookups. Blocks that expire
+are kept in a heap by expiry time, and dropped as their time passes.
+
+The index is kept in-process and rebuilt when the version token in the shared
+cache changes. Call invalidate_blocklist after committing changes to blocks.
+
+Hits are counted in the shared cache instead of the database, and written to
+Blocklist.hits in batches by flush_blocklist_hits, queued at most once every
+BLOCKLIST_FLUSH_INTERVAL seconds, and run before the admin system page lists hits.
+"""
+
+import calendar
+import hashlib
+import heapq
+import time
+from uuid import uuid4
+
+from flask import current_app
+from sqlalchemy_utils.types import phone_number
+
+from ..extensions import db, cache, rq
+from .models import Blocklist
+
+KEY_VERSION = 'admin:blocklist:version'
+KEY_HITS = 'admin:blocklist:{block_id}:hits'
+KEY_HIT_PHONE = 'admin:blocklist:{block_id}:phone'
+KEY_FLUSH = 'admin:blocklist:flush'
+
+_index = None
+
+
+class BlocklistIndex(object):
+    """Active blocks, indexed by the value they match on"""
+
+    def __init__(self, blocks, version=None):
+        self.version = version
+        self.ips = {}
+        self.phone_hashes = {}
+        self.phones = {}
+        self._expiry = []
+
+        now = time.time()
+        for b in blocks:
+            expires_at = b.expires_at()
+            if expires_at:
+                expires_at = calendar.timegm(expires_at.utctimetuple())
+                if expires_at < now:
+                    continue
+                self._expiry.append((expires_at, b.id))
+
+            # same precedence as Blocklist.match
+            if b.ip_address:
+                self.ips.setdefault(b.ip_address, set()).add(b.id)
+            elif b.phone_hash:
+                self.phone_hashes.setdefault(b.phone_hash, set()).add(b.id)
+            elif b.phone_number:
+                self.phones.setdefault(b.phone_number.e164, set()).add(b.id)
+        heapq.heapify(self._expiry)
+        self._expired = set()
+
+    def _expire(self):
+        now = time.time()
+        while self._expiry and self._expiry[0][0] < now:
+            self._expired.add(heapq.heappop(self._expiry)[1])
+
+    def match(self, user_phone, user_ip, user_country='US'):
+        "Returns set of ids of active blocks matching this phone or IP address"
+        self._expire()
+
+        matched = set()
+        if user_ip and user_ip in self.ips:
+            matched.update(self.ips[user_ip])
+        if user_phone and self.phone_hashes:
+            phone_hash = hashlib.sha256(unicode(user_phone)).hexdigest()
+            matched.update(self.phone_hashes.get(phone_hash, ()))
+        if user_phone and self.phones:
+            e164 = normalize_phone(user_phone, user_country)
+            matched.update(self.phones.get(e164, ()))
+        return matched - self._expired
+
+
+def normalize_phone(user_phone, user_country='US'):
+    if isinstance(user_phone, phone_number.PhoneNumber):
+        return user_phone.e164
+    try:
+        return phone_number.PhoneNumber(user_phone, user_country).e164
+    except phone_number.phonenumbers.NumberParseException:
+        return None
+
+
+def get_blocklist_index():
+    "Returns the current BlocklistIndex, rebuilt when blocks have changed"
+    global _index
+
+    version = cache.get(KEY_VERSION)
+    if not version:
+        version = uuid4().hex
+        if not cache.add(KEY_VERSION, version):
+            version = cache.get(KEY_VERSION)
+
+    if _index is None or _index.version != version:
+        _index = BlocklistIndex(Blocklist.query.all(), version)
+    return _index
+
+
+def invalidate_blocklist():
+    """
+    Marks the blocklist index as stale in every worker.
+    Call after committing changes to Blocklist rows.
+    """
+    global _index
+    cache.set(KEY_VERSION, uuid4().hex)
+    _index = None
+
+
+def record_hits(block_ids, user_phone):
+    "Counts hits in the shared cache, and queues a flush to the database"
+    for block_id in block_ids:
+        cache.cache.inc(KEY_HITS.format(block_id=block_id))
+        if user_phone:
+            # remember the first phone number to hit a block, as Blocklist.user_blocked did
+            cache.add(KEY_HIT_PHONE.format(block_id=block_id), unicode(user_phone))
+
+    interval = current_app.config.get('BLOCKLIST_FLUSH_INTERVAL')
+    if interval and cache.add(KEY_FLUSH, True, timeout=interval):
+        flush_blocklist_hits.queue()
+
+
+@rq.job
+def flush_blocklist_hits():
+    """
+    Adds hits counted since the last flush to Blocklist.hits, in one transaction.
+    Returns number of hits written.
+    """
+    block_ids = [block_id for (block_id,) in db.session.query(Blocklist.id)]
+    if not block_ids:
+        return 0
+
+    hit_keys = [KEY_HITS.format(block_id=block_id) for block_id in block_ids]
+    phone_keys = [KEY_HIT_PHONE.format(block_id=block_id) for block_id in block_ids]
+    counts = cache.get_many(*hit_keys)
+    phones = cache.get_many(*phone_keys)
+
+    flushed = {}
+    for (block_id, key, count, phone) in zip(block_ids, hit_keys, counts, phones):
+        if not count:
+            continue
+        Blocklist.query.filter_by(id=block_id).update(
+            {Blocklist.hits: db.func.coalesce(Blocklist.hits, 0) + count},
+            synchronize_session=False)
+        if phone:
+            Blocklist.query.filter_by(id=block_id, phone_number=None).update(
+                {Blocklist.phone_number: phone},
+                synchronize_session=False)
+        flushed[key] = count
+    if not flushed:
+        return 0
+    db.session.commit()
+
+    # subtract what we wrote, hits counted in the meantime stay for the next flush
+    for (key, count) in flushed.items():
+        cache.cache.dec(key, count)
+    cache.delete_many(*phone_keys)
+    return sum(flushed.values())
@@ -33,15 +33,18 @@ class Blocklist(db.Model):
             return  self.ip_address
 
 
+    def expires_at(self):
+        if not self.expires:
+            return None
+        if self.timestamp.tzinfo is None:
+            # sqlite doesn't store timezones in the database
+            # reset it manually
+            return self.timestamp.replace(tzinfo=pytz.utc) + self.expires
+        return self.timestamp + self.expires
+
     def is_active(self):
         if self.expires:
-            try:
-                return utc_now() <= (self.timestamp + self.expires)
-            except TypeError:
-                # sqlite doesn't store timezones in the database
-                # reset it manually
-                aware_timestamp = self.timestamp.replace(tzinfo=pytz.utc)
-                return utc_now() <= (aware_timestamp + self.expires)
+            return utc_now() <= self.expires_at()
         else:
             return True
 
@@ -65,22 +68,12 @@ class Blocklist(db.Model):
     def user_blocked(cls, user_phone, user_ip, user_country='US'):
         """
         Takes a phone number and/or IP address, check it against blocklist
+        Hits are counted in the cache, and saved by flush_blocklist_hits
         """
-        active_blocks = cls.active_blocks()
-        if not active_blocks:
-            # exit early if no blocks active
-            return False
-
-        matched = False
-        for b in active_blocks:
-            if b.match(user_phone, user_ip, user_country):
-                if not b.phone_number:
-                    b.phone_number = user_phone
-                matched = True
-                b.hits += 1
-                db.session.add(b)
+        from .blocklist import get_blocklist_index, record_hits
 
+        matched = get_blocklist_index().match(user_phone, user_ip, user_country)
         if matched:
-            db.session.commit()
-        return matched
+            record_hits(matched, user_phone)
+        return bool(matched)
 
@@ -8,9 +8,12 @@ from ..extensions import db, cache
 from sqlalchemy.sql import func, desc
 
 from .models import Blocklist
+from .blocklist import invalidate_blocklist, flush_blocklist_hits
 from .forms import BlocklistForm
 
-from ..campaign.models import TwilioPhoneNumber, Campaign
+from ..campaign.models import TwilioPhoneNumber, Campaign, CampaignPhoneNumber
+from ..campaign.snapshot import invalidate_campaign_snapshot
+from ..political_data.geocode import geocode_cache
 from ..call.models import Call
 from ..sync.models import SyncCampaign
 from ..campaign.constants import STATUS_PAUSED
@@ -102,6 +105,8 @@ def system():
 
     political_data_cache = {'US': cache.get('political_data:us'),
                             'CA': cache.get('political_data:ca')}
+    # write buffered hit counts before showing them
+    flush_blocklist_hits()
     blocked = Blocklist.query.order_by(Blocklist.timestamp.desc()).all()
     if not political_data_cache['US']:
         flash(_("US Political Data not yet loaded. Run > python manager.py loadpoliticaldata") , 'warning')
@@ -112,6 +117,7 @@ def system():
                            admin_api_key=admin_api_key,
                            crm_sync_campaigns=crm_sync_campaigns,
                            political_data_cache=political_data_cache,
+                           geocode_stats=geocode_cache.stats,
                            blocked=blocked)
 
 
@@ -134,6 +140,7 @@ def blocklist(blocklist_id=None):
 
         db.session.add(blocklist)
         db.session.commit()
+        invalidate_blocklist()
 
         flash('Blocklist updated.', 'success')
         return redirect(url_for('admin.system'))
@@ -178,10 +185,15 @@ def twilio_resync():
         TwilioPhoneNumber.number.notin_([n.phone_number for n in twilio_numbers]))
     # and remove them
     # TODO, check if delete will cascade to campaign
+    affected_campaigns = set()
     for num in stale_numbers.all():
         deleted_numbers.append(str(num.number))
+        affected_campaigns.update(c.campaign_id for c in
+            CampaignPhoneNumber.query.filter_by(phone_id=num.id))
         db.session.delete(num)
     db.session.commit()
+    for campaign_id in affected_campaigns:
+        invalidate_campaign_snapshot(campaign_id)
 
     if new_numbers:
         flash(_("Added Twilio Number: ") + ', '.join(new_numbers), 'success')
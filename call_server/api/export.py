@@ -0,0 +1,97 @@
+"""
+Streaming export of calls and sessions for a campaign, as CSV or NDJSON.
+
+Rows are read with a server-side cursor in batches of yield_per, with target
+names joined in the same query, and written out one line at a time, so an
+export of any size runs in constant memory.
+"""
+
+import csv
+import json
+from cStringIO import StringIO
+from datetime import datetime, timedelta
+
+from ..extensions import db
+from ..campaign.models import Target
+from ..call.models import Call, Session
+
+BATCH_SIZE = 1000
+
+EXPORT_COLUMNS = {
+    'calls': [
+        ('id', Call.id),
+        ('timestamp', Call.timestamp),
+        ('session_id', Call.session_id),
+        ('campaign_id', Call.campaign_id),
+        ('target_id', Call.target_id),
+        ('target_uid', Target.uid),
+        ('target_title', Target.title),
+        ('target_name', Target.name),
+        ('call_id', Call.call_id),
+        ('status', Call.status),
+        ('duration', Call.duration),
+    ],
+    'sessions': [
+        ('id', Session.id),
+        ('timestamp', Session.timestamp),
+        ('campaign_id', Session.campaign_id),
+        ('phone_hash', Session.phone_hash),
+        ('location', Session.location),
+        ('referral_code', Session.referral_code),
+        ('from_number', Session.from_number),
+        ('direction', Session.direction),
+        ('status', Session.status),
+        ('duration', Session.duration),
+        ('queue_delay', Session.queue_delay),
+    ],
+}
+EXPORT_FORMATS = {
+    'csv': 'text/csv',
+    'ndjson': 'application/x-ndjson',
+}
+
+
+def export_query(kind, campaign_id, start=None, end=None):
+    "Query for the export rows of kind ('calls' or 'sessions'), in id order"
+    model = Call if kind == 'calls' else Session
+    query = db.session.query(*[column for (name, column) in EXPORT_COLUMNS[kind]])
+    if kind == 'calls':
+        query = query.outerjoin(Target, Call.target_id == Target.id)
+    query = query.filter(model.campaign_id == campaign_id)
+    if start:
+        query = query.filter(model.timestamp >= start)
+    if end:
+        query = query.filter(model.timestamp <= end)
+    return (query.order_by(model.id)
+        .execution_options(stream_results=True)
+        .yield_per(BATCH_SIZE))
+
+
+def export_value(value):
+    if isinstance(value, datetime):
+        return value.isoformat()
+    if isinstance(value, timedelta):
+        return value.total_seconds()
+    return value
+
+
+def _csv_line(writer, buf, values):
+    writer.writerow([v.encode('utf-8') if isinstance(v, unicode) else v for v in values])
+    line = buf.getvalue()
+    buf.seek(0)
+    buf.truncate()
+    return line
+
+
+def export_lines(kind, rows, fmt='csv'):
+    "Generator of output lines for rows, with a header for csv"
+    names = [name for (name, column) in EXPORT_COLUMNS[kind]]
+    if fmt == 'csv':
+        buf = StringIO()
+        writer = csv.writer(buf)
+        yield _csv_line(writer, buf, names)
+        for row in rows:
+            yield _csv_line(writer, buf, [export_value(v) for v in row])
+    else:
+        for row in rows:
+            yield json.dumps(dict(zip(names, [export_value(v) for v in row]))) + '\n'
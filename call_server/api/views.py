@@ -3,7 +3,7 @@ from datetime import datetime, timedelta
 import dateutil
 
 import twilio.twiml
-from flask import Blueprint, Response, current_app, render_template, abort, request, jsonify
+from flask import Blueprint, Response, current_app, render_template, abort, request, jsonify, stream_with_context
 
 from sqlalchemy.sql import func, extract, distinct, cast, join
 
@@ -16,8 +16,15 @@ from ..extensions import csrf, cors, rest, db, cache, talisman, CALLPOWER_CSP
 from ..campaign.models import Campaign, Target, AudioRecording
 from ..political_data.adapters import adapt_by_key, UnitedStatesData
 from ..call.models import Call, Session
+from ..call import vault
+from ..call.dialer import dialer_metrics
+from ..admin.blocklist import normalize_phone
 from ..schedule.models import ScheduleCall
 from ..call.constants import TWILIO_CALL_STATUS
+from ..stats.models import CallRollup, SessionRollup, SessionCallsRollup
+from ..stats.jobs import refresh_stats_rollups, hour_bucket, naive_utc
+from ..stats.counters import get_campaign_counts
+from .export import export_query, export_lines, EXPORT_FORMATS
 
 
 api = Blueprint('api', __name__, url_prefix='/api')
@@ -70,68 +77,119 @@ def campaign_list():
         data[campaign.id] = campaign.name
     return jsonify({'count': len(data), 'objects': data})
 
-# overall campaigns call by date
-@api.route('/campaign/date_calls.json', methods=['GET'])
-@api_key_or_auth_required
-def campaigns_overall():
+def parse_date_range():
+    "Returns (startDate, endDate) from request values, either may be None"
     start = request.values.get('start')
     end = request.values.get('end')
-    timespan = request.values.get('timespan', 'day')
-
-    if timespan not in API_TIMESPANS.keys():
-        abort(400, 'timespan should be one of %s' % ','.join(API_TIMESPANS))
-    else:
-        timespan_strf, timespan_to_char = API_TIMESPANS[timespan]
-
-    timestamp_to_char = func.to_char(Call.timestamp, timespan_to_char).label(timespan)
-
-    query = (
-        db.session.query(
-            func.min(Call.timestamp.label('date')),
-            Call.campaign_id,
-            timestamp_to_char,
-            func.count(distinct(Call.id)).label('calls_count')
-        )
-        .group_by(Call.campaign_id)
-        .group_by(timestamp_to_char)
-        .order_by(timespan)
-    )
-
-    completed_query = db.session.query(
-        Call.timestamp, Call.id
-    ).filter_by(
-        status='completed'
-    )
+    startDate = endDate = None
 
     if start:
         try:
             startDate = dateutil.parser.parse(start)
         except ValueError:
             abort(400, 'start should be in isostring format')
-        query = query.filter(Call.timestamp >= startDate)
-        completed_query = completed_query.filter(Call.timestamp >= startDate)
 
     if end:
         try:
             endDate = dateutil.parser.parse(end)
-            if start:
-                if endDate < startDate:
-                    abort(400, 'end should be after start')
-                if endDate == startDate:
-                    endDate = startDate + timedelta(days=1)
         except ValueError:
             abort(400, 'end should be in isostring format')
+        if startDate:
+            if endDate < startDate:
+                abort(400, 'end should be after start')
+            if endDate == startDate:
+                endDate = startDate + timedelta(days=1)
+
+    return startDate, endDate
+
+
+def filter_hours(query, startDate, endDate):
+    "Limit a rollup query to the hours between startDate and endDate"
+    if startDate:
+        query = query.filter(CallRollup.hour >= hour_bucket(startDate))
+    if endDate:
+        query = query.filter(CallRollup.hour <= naive_utc(endDate))
+    return query
+
+
+def histogram_median(histogram):
+    "Median of a sorted list of (value, count) pairs"
+    total = sum(count for (value, count) in histogram)
+    if not total:
+        return None
+    middle = [(total - 1) / 2, total / 2]
+    values = []
+    seen = 0
+    for (value, count) in histogram:
+        for position in middle:
+            if seen <= position < seen + count:
+                values.append(value)
+        seen += count
+    return sum(values) / float(len(values))
+
+
+def calls_by_minute(query, startDate, endDate):
+    "Calls grouped by minute, finer than the hourly rollups, so counted from the calls table"
+    timestamp_to_char = func.to_char(Call.timestamp, API_TIMESPANS['minute'][1]).label('minute')
+    query = (
+        query.add_columns(
+            func.min(Call.timestamp.label('date')),
+            timestamp_to_char,
+            Call.status,
+            func.count(distinct(Call.id)).label('calls_count'))
+        .group_by(timestamp_to_char)
+        .group_by(Call.status)
+        .order_by('minute')
+    )
+    if startDate:
+        query = query.filter(Call.timestamp >= startDate)
+    if endDate:
         query = query.filter(Call.timestamp <= endDate)
-        completed_query = completed_query.filter(Call.timestamp <= endDate)
+    return query
+
+
+# overall campaigns call by date
+@api.route('/campaign/date_calls.json', methods=['GET'])
+@api_key_or_auth_required
+def campaigns_overall():
+    timespan = request.values.get('timespan', 'day')
+
+    if timespan not in API_TIMESPANS.keys():
+        abort(400, 'timespan should be one of %s' % ','.join(API_TIMESPANS))
+    else:
+        timespan_strf, timespan_to_char = API_TIMESPANS[timespan]
 
-    dates = defaultdict(dict)
-    for (date, campaign_id, timespan, count) in query.all():
+    startDate, endDate = parse_date_range()
+
+    if timespan == 'minute':
+        query = calls_by_minute(db.session.query(Call.campaign_id).group_by(Call.campaign_id),
+            startDate, endDate)
+        rows = [(date, campaign_id, status, count) for (campaign_id, date, minute, status, count) in query]
+    else:
+        refresh_stats_rollups()
+        query = (
+            db.session.query(
+                CallRollup.hour,
+                CallRollup.campaign_id,
+                CallRollup.status,
+                func.sum(CallRollup.count)
+            )
+            .group_by(CallRollup.hour, CallRollup.campaign_id, CallRollup.status)
+            .order_by(CallRollup.hour)
+        )
+        rows = filter_hours(query, startDate, endDate).all()
+
+    dates = defaultdict(lambda: defaultdict(int))
+    calls_completed = 0
+    for (date, campaign_id, status, count) in rows:
         date_string = date.strftime(timespan_strf)
-        dates[date_string][int(campaign_id)] = count
+        dates[date_string][int(campaign_id)] += count
+        if status == 'completed':
+            calls_completed += count
     sorted_dates = OrderedDict(sorted(dates.items()))
 
     meta = {
-        'calls_completed': completed_query.count()
+        'calls_completed': calls_completed
     }
 
     return jsonify({'meta': meta,'objects': sorted_dates})
@@ -142,78 +200,68 @@ def campaigns_overall():
 @api_key_or_auth_required
 def campaign_stats(campaign_id):
     campaign = Campaign.query.filter_by(id=campaign_id).first_or_404()
+    refresh_stats_rollups()
 
     # number of sessions started in campaign
     # total count and average queue_delay
-    sessions_started, queue_avg_timedelta = db.session.query(
-        func.count(Session.id).label('count'),
-        func.avg(Session.queue_delay).label('queue_avg')
+    sessions_started, queue_delay_count, queue_delay_seconds = db.session.query(
+        func.sum(SessionRollup.count),
+        func.sum(SessionRollup.queue_delay_count),
+        func.sum(SessionRollup.queue_delay_seconds)
     ).filter_by(
         campaign_id=campaign.id
-    ).all()[0]
-    if isinstance(queue_avg_timedelta, timedelta):
-        queue_avg_seconds = queue_avg_timedelta.total_seconds()
+    ).one()
+    if queue_delay_count:
+        queue_avg_seconds = queue_delay_seconds / queue_delay_count
     else:
         queue_avg_seconds = ''
 
-    # number of sessions with at least one completed call in campaign
-    sessions_completed = (db.session.query(func.count(Session.id.distinct()))
-        .select_from(join(Session, Call))
-        .filter(Call.campaign_id==campaign.id,
-            Call.status=='completed'
-        )
-    ).scalar()
-
-    # number of calls completed in campaign
-    calls_completed = db.session.query(
-        Call.timestamp, Call.id
-    ).filter_by(
-        campaign_id=campaign.id,
-        status='completed'
-    )
-
-    # get completed calls per session in campaign
-    calls_per_session = db.session.query(
-        func.count(Call.id.distinct()).label('call_count'),
+    # sessions by number of completed calls, for sessions with at least one
+    calls_per_session_histogram = db.session.query(
+        SessionCallsRollup.calls_completed,
+        SessionCallsRollup.sessions
     ).filter(
-        Call.campaign_id == campaign.id,
-        Call.status == 'completed',
-        Call.session_id != None
-    ).group_by(
-        Call.session_id
-    )
-    calls_per_session_avg = db.session.query(
-        func.avg(calls_per_session.subquery().columns.call_count),
-    )
-    # use this one weird trick to calculate the median
-    # https://stackoverflow.com/a/27826044
-    calls_per_session_med = db.session.query(
-        func.percentile_cont(0.5).within_group(
-            calls_per_session.subquery().columns.call_count.desc()
-        )
-    )
-    # calls_session_list = [int(n[0]) for n in calls_session_grouped.all()]
+        SessionCallsRollup.campaign_id == campaign.id,
+        SessionCallsRollup.calls_completed > 0,
+        SessionCallsRollup.sessions > 0
+    ).order_by(SessionCallsRollup.calls_completed).all()
+
+    sessions_completed = sum(sessions for (calls, sessions) in calls_per_session_histogram)
+    if sessions_completed:
+        calls_per_session_avg = sum(calls * sessions for (calls, sessions) in calls_per_session_histogram) \
+            / float(sessions_completed)
+    else:
+        calls_per_session_avg = 0
     calls_per_session = {
-        'avg': '%.2f' % (calls_per_session_avg.scalar() or 0),
-        'med': calls_per_session_med.scalar() or '?'
+        'avg': '%.2f' % calls_per_session_avg,
+        'med': histogram_median(calls_per_session_histogram) or '?'
     }
 
+    # number of calls completed in campaign, and the hours of the first and last
+    calls_completed, first_hour, last_hour = db.session.query(
+        func.sum(CallRollup.count),
+        func.min(CallRollup.hour),
+        func.max(CallRollup.hour)
+    ).filter(
+        CallRollup.campaign_id == campaign.id,
+        CallRollup.status == 'completed',
+        CallRollup.count > 0
+    ).one()
+
     data = {
         'id': campaign.id,
         'name': campaign.name,
-        'sessions_started': sessions_started,
+        'sessions_started': sessions_started or 0,
         'queue_avg_seconds': queue_avg_seconds,
         'sessions_completed': sessions_completed,
         'calls_per_session': calls_per_session,
-        'calls_completed': calls_completed.count()
+        'calls_completed': calls_completed or 0
     }
 
     if data['calls_completed']:
-        first_call_completed = calls_completed.first()
-        last_call_completed = calls_completed.order_by(Call.timestamp.desc()).first()
         data.update({
-            'date_start': datetime.strftime(first_call_completed[0], '%Y-%m-%d'),
-            'date_end': datetime.strftime(last_call_completed[0] + timedelta(days=1), '%Y-%m-%d'),
+            'date_start': datetime.strftime(first_hour, '%Y-%m-%d'),
+            'date_end': datetime.strftime(last_hour + timedelta(days=1), '%Y-%m-%d'),
         })
 
     return jsonify(data)
@@ -223,8 +271,6 @@ def campaign_stats(campaign_id):
 @api.route('/campaign/<int:campaign_id>/date_calls.json', methods=['GET'])
 @api_key_or_auth_required
 def campaign_date_calls(campaign_id):
-    start = request.values.get('start')
-    end = request.values.get('end')
     timespan = request.values.get('timespan', 'day')
 
     if timespan not in API_TIMESPANS.keys():
@@ -233,48 +279,32 @@ def campaign_date_calls(campaign_id):
         timespan_strf, timespan_to_char = API_TIMESPANS[timespan]
 
     campaign = Campaign.query.filter_by(id=campaign_id).first_or_404()
-    timestamp_to_char = func.to_char(Call.timestamp, timespan_to_char).label(timespan)
+    startDate, endDate = parse_date_range()
 
-    query = (
-        db.session.query(
-            func.min(Call.timestamp.label('date')),
-            timestamp_to_char,
-            Call.status,
-            func.count(distinct(Call.id)).label('calls_count')
+    if timespan == 'minute':
+        query = calls_by_minute(db.session.query().filter(Call.campaign_id == int(campaign.id)),
+            startDate, endDate)
+        rows = [(date, status, count) for (date, minute, status, count) in query]
+    else:
+        refresh_stats_rollups()
+        query = (
+            db.session.query(
+                CallRollup.hour,
+                CallRollup.status,
+                func.sum(CallRollup.count)
+            )
+            .filter(CallRollup.campaign_id == int(campaign.id))
+            .group_by(CallRollup.hour, CallRollup.status)
+            .order_by(CallRollup.hour)
         )
-        .filter(Call.campaign_id == int(campaign.id))
-        .group_by(timestamp_to_char)
-        .order_by(timespan)
-        .group_by(Call.status)
-    )
-
-    if start:
-        try:
-            startDate = dateutil.parser.parse(start)
-        except ValueError:
-            abort(400, 'start should be in isostring format')
-        query = query.filter(Call.timestamp >= startDate)
-
-    if end:
-        try:
-            endDate = dateutil.parser.parse(end)
-            if start:
-                if endDate < startDate:
-                    abort(400, 'end should be after start')
-                if endDate == startDate:
-                    endDate = startDate + timedelta(days=1)
-        except ValueError:
-            abort(400, 'end should be in isostring format')
-        query = query.filter(Call.timestamp <= endDate)
-
-    dates = defaultdict(dict)
+        rows = filter_hours(query, startDate, endDate).all()
 
-    for (date, timespan, call_status, count) in query.all():
+    dates = defaultdict(lambda: defaultdict(int))
+    for (date, call_status, count) in rows:
         # combine status values by date
-        for status in TWILIO_CALL_STATUS:
-            if call_status == status:
-                date_string = date.strftime(timespan_strf)
-                dates[date_string][status] = count
+        if call_status in TWILIO_CALL_STATUS:
+            date_string = date.strftime(timespan_strf)
+            dates[date_string][call_status] += count
     sorted_dates = OrderedDict(sorted(dates.items()))
     return jsonify({'objects': sorted_dates})
 
@@ -283,45 +313,32 @@ def campaign_date_calls(campaign_id):
 @api.route('/campaign/<int:campaign_id>/target_calls.json', methods=['GET'])
 @api_key_or_auth_required
 def campaign_target_calls(campaign_id):
-    start = request.values.get('start')
-    end = request.values.get('end')
-
     campaign = Campaign.query.filter_by(id=campaign_id).first_or_404()
+    startDate, endDate = parse_date_range()
+    refresh_stats_rollups()
 
-    query_call_targets = (
+    query_target_status = (
         db.session.query(
             Target.title,
             Target.name,
-            Target.uid
-        ).join(Call)
-        .filter(Call.campaign_id == int(campaign.id))
+            Target.uid,
+            CallRollup.status,
+            func.sum(CallRollup.count)
+        ).join(CallRollup, CallRollup.target_id == Target.id)
+        .filter(CallRollup.campaign_id == int(campaign.id))
         .group_by(Target.title)
         .group_by(Target.name)
         .group_by(Target.uid)
+        .group_by(CallRollup.status)
     )
-
-    if start:
-        try:
-            startDate = dateutil.parser.parse(start)
-        except ValueError:
-            abort(400, 'start should be in isostring format')
-        query_call_targets = query_call_targets.filter(Call.timestamp >= startDate)
-
-    if end:
-        try:
-            endDate = dateutil.parser.parse(end)
-            if endDate < startDate:
-                abort(400, 'end should be after start')
-            if endDate == startDate:
-                endDate = startDate + timedelta(days=1)
-        except ValueError:
-            abort(400, 'end should be in isostring format')
-        query_call_targets = query_call_targets.filter(Call.timestamp <= endDate)
+    query_target_status = filter_hours(query_target_status, startDate, endDate).all()
 
     targets = defaultdict(dict)
     political_data = campaign.get_campaign_data().data_provider
 
-    for (target_title, target_name, target_uid) in query_call_targets:
+    call_targets = OrderedDict(((target_title, target_name, target_uid), True)
+        for (target_title, target_name, target_uid, call_status, count) in query_target_status)
+    for (target_title, target_name, target_uid) in call_targets:
         # get more target_data from political_data cache
         try:
             target_data = political_data.cache_get(target_uid)[0]
@@ -368,10 +385,7 @@ def campaign_target_calls(campaign_id):
             targets[target_uid]['name'] = target_name
             targets[target_uid]['district'] = target_uid
 
-    # query calls to count status
-    query_target_status = query_call_targets.group_by(Call.status).with_entities(Call.status, Target.uid, func.Count(Call.id))
-
-    for (call_status, target_uid, count) in query_target_status:
+    for (target_title, target_name, target_uid, call_status, count) in query_target_status:
         if call_status in TWILIO_CALL_STATUS:
             # combine calls status for each target
             targets[target_uid][call_status] = targets.get(target_uid, {}).get(call_status, 0) + count
@@ -379,6 +393,21 @@ def campaign_target_calls(campaign_id):
     return jsonify({'objects': targets})
 
 
+# streaming export of calls or sessions for a campaign, as csv or ndjson
+# optionally filtered by start and end
+@api.route('/campaign/<int:campaign_id>/<any(calls, sessions):kind>.<any(csv, ndjson):fmt>', methods=['GET'])
+@api_key_or_auth_required
+def campaign_export(campaign_id, kind, fmt):
+    campaign = Campaign.query.filter_by(id=campaign_id).first_or_404()
+    startDate, endDate = parse_date_range()
+
+    rows = export_query(kind, campaign.id, startDate, endDate)
+    filename = 'campaign-%d-%s.%s' % (campaign.id, kind, fmt)
+    return Response(stream_with_context(export_lines(kind, rows, fmt)),
+        mimetype=EXPORT_FORMATS[fmt],
+        headers={'Content-Disposition': 'attachment; filename=%s' % filename})
+
+
 # returns twilio call sids made to a particular phone number
 # searches phone_hash if available, otherwise the twilio api
 @api.route('/twilio/calls/to/<phone>/', methods=['GET'])
@@ -388,9 +417,14 @@ def call_sids_for_number(phone):
     if current_app.config['LOG_PHONE_NUMBERS']:
         phone_hash = Session.hash_phone(str(phone))
         sessions = db.session.query(Session.id).filter_by(phone_hash=phone_hash).subquery()
+    else:
+        # not logged, but recent sessions may be in the phone vault
+        sessions = vault.get_sessions(normalize_phone(phone) or phone)
+
+    if current_app.config['LOG_PHONE_NUMBERS'] or sessions:
         calls = db.session.query(Call.call_id).filter(Call.session_id.in_(sessions)).distinct()
         calls_id_list = [c.call_id for c in calls.all()]
-    
+
     else:
         # not stored locally, need to hit twilio for calls matching to_
         twilio = current_app.config['TWILIO_CLIENT']
@@ -400,6 +434,13 @@ def call_sids_for_number(phone):
     return jsonify({'objects': calls_id_list})
 
 
+# outbound dialer queue depth and wait times, in seconds
+@api.route('/dialer.json', methods=['GET'])
+@api_key_or_auth_required
+def dialer():
+    return jsonify(dialer_metrics())
+
+
 # returns information for twilio calls with parent_call_sid
 @api.route('/twilio/calls/info/<sid>/', methods=['GET'])
 @api_key_or_auth_required
@@ -470,37 +511,15 @@ def campaign_embed_code(campaign_id):
 
 
 # simple call count per campaign as json
-# make accessible crossdomain, and cache for 10 min
+# make accessible crossdomain, served from live counters and cached briefly
 @api.route('/campaign/<int:campaign_id>/count.json', methods=['GET'])
-@cache.cached(timeout=600)
+@cache.cached(timeout=10)
 def campaign_count(campaign_id):
-    campaign = Campaign.query.filter_by(id=campaign_id).first_or_404()
-
-    # number of calls completed in campaign
-    calls_completed = db.session.query(
-        func.Count(Call.id)
-    ).filter_by(
-        campaign_id=campaign.id,
-        status='completed'
-    )
+    if not db.session.query(Campaign.id).filter_by(id=campaign_id).scalar():
+        abort(404)
 
-    # list of sessions with at least two completed calls
-    # grouped by referral_code, include count
-    referrers = db.session.query(
-        Session.referral_code,
-        func.Count(Call.id)
-    ).join(Call).filter(
-        Call.campaign_id==campaign.id,
-        Call.status=='completed'
-    ).group_by(Session.referral_code)\
-    .having(func.count(Call.id) > 2)
-
-    return jsonify({
-        'completed': calls_completed.scalar(),
-        'last_24h': calls_completed.filter(Call.timestamp >= datetime.now() - timedelta(hours=24)).scalar(),
-        'last_week': calls_completed.filter(Call.timestamp >= datetime.now() - timedelta(days=7)).scalar(),
-        'referral_codes': dict(referrers)
-    })
+    # completed calls, last 24h and week, and referral codes with more than two
+    return jsonify(get_campaign_counts(campaign_id))
 
 # route for twilio to get twiml response
 # must be publicly accessible to post
@@ -0,0 +1,266 @@
+"""
+Write-behind logging of calls and session status, from the Twilio webhooks.
+
+Webhooks append a small event to a list in redis and return, and
+flush_call_log writes queued events to the database in batches: calls with
+one executemany insert, session status with one executemany update. A slow
+database then delays the call log, not the TwiML response Twilio is waiting
+on. Sessions are still inserted as calls start, since their id is needed
+right away.
+
+Twilio retries webhooks that time out, so calls are only inserted once for
+each CallSid and target.
+
+One flush runs at a time, so batches are committed in the order they were
+queued. A batch that fails is put back for the next run, and after
+MAX_ATTEMPTS its events are written one at a time, with the ones that still
+fail moved to a dead-letter list, so they don't hold up the call log.
+
+Without a redis cache, or with CALL_LOG_WRITE_BEHIND off, events are written
+as they are logged.
+"""
+
+import cPickle as pickle
+import hashlib
+from datetime import datetime, timedelta
+
+from flask import current_app
+from sqlalchemy import bindparam
+from sqlalchemy.sql import desc
+from sqlalchemy.exc import SQLAlchemyError
+
+from ..extensions import db, cache, rq
+from ..stats.jobs import naive_utc
+from .models import Call, Session
+
+KEY_EVENTS = 'call:log:events'
+KEY_QUEUED = 'call:log:queued'
+KEY_FLUSHING = 'call:log:flushing'
+KEY_ATTEMPTS = 'call:log:attempts:{batch}'
+KEY_DEAD_LETTER = 'call:log:dead_letter'
+BATCH_SIZE = 1000
+MAX_ATTEMPTS = 3
+FLUSHING_TIMEOUT = 60*5  # refreshed for each batch, expires if the job dies
+QUEUED_TIMEOUT = 60*5  # to queue another flush if a queued one never runs
+ATTEMPTS_TIMEOUT = 60*60*24
+RETRY_WINDOW = timedelta(days=1)  # how long after a call Twilio may retry its webhook
+
+
+def _redis():
+    if not current_app.config.get('CALL_LOG_WRITE_BEHIND'):
+        return None
+    return getattr(cache.cache, '_client', None)
+
+
+def _key(key):
+    return (getattr(cache.cache, 'key_prefix', None) or '') + key
+
+
+def log_event(kind, **data):
+    "Queue an event for the call log, or write it now without redis"
+    data['timestamp'] = datetime.utcnow()
+    redis = _redis()
+    if redis:
+        redis.rpush(_key(KEY_EVENTS), pickle.dumps((kind, data), pickle.HIGHEST_PROTOCOL))
+        # the job clears this flag before it starts reading, so no event is left behind
+        if cache.add(KEY_QUEUED, True, timeout=QUEUED_TIMEOUT):
+            flush_call_log.queue()
+        return
+
+    try:
+        write_events([(kind, data)])
+    except SQLAlchemyError:
+        db.session.rollback()
+        current_app.logger.error('Failed to log %s:' % kind, exc_info=True)
+
+
+def log_call(session_id, campaign_id, target_id, call_id, status, duration):
+    log_event('call', session_id=session_id, campaign_id=campaign_id, target_id=target_id,
+        call_id=call_id, status=status, duration=duration)
+
+
+def log_session_ringing(session_id):
+    log_event('ringing', session_id=session_id)
+
+
+def log_session_status(session_id, status, duration):
+    log_event('status', session_id=session_id, status=status, duration=duration)
+
+
+def log_inbound_status(phone_hash, campaign_id, location, status, duration):
+    log_event('inbound_status', phone_hash=phone_hash, campaign_id=campaign_id, location=location,
+        status=status, duration=duration)
+
+
+def _int(value):
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def insert_calls(events):
+    "Insert calls not already logged for their CallSid and target"
+    sids = set(e['call_id'] for e in events if e['call_id'])
+    logged = set()
+    if sids:
+        earliest = min(e['timestamp'] for e in events) - RETRY_WINDOW
+        logged = set(db.session.query(Call.call_id, Call.target_id).filter(
+            Call.call_id.in_(sids),
+            Call.timestamp >= earliest))
+
+    rows = []
+    for e in events:
+        key = (e['call_id'], e['target_id'])
+        if e['call_id'] and key in logged:
+            continue
+        logged.add(key)
+        rows.append({
+            'timestamp': e['timestamp'],
+            'session_id': e['session_id'],
+            'campaign_id': e['campaign_id'],
+            'target_id': e['target_id'],
+            'call_id': e['call_id'],
+            'status': e['status'],
+            'duration': _int(e['duration']) or 0,
+        })
+    if rows:
+        db.session.execute(Call.__table__.insert(), rows)
+    return len(rows)
+
+
+def update_sessions(ringing, statuses):
+    "Set queue delay on first ringing, and the latest status and duration"
+    table = Session.__table__
+    # webhooks pass session ids as the request's strings
+    ringing = [dict(e, session_id=_int(e['session_id'])) for e in ringing]
+    statuses = [dict(e, session_id=_int(e['session_id'])) for e in statuses]
+    if ringing:
+        started = dict(db.session.query(Session.id, Session.timestamp).filter(
+            Session.id.in_(set(e['session_id'] for e in ringing)),
+            Session.queue_delay == None))
+        delays = {}
+        for e in ringing:
+            if e['session_id'] in started and e['session_id'] not in delays:
+                delays[e['session_id']] = e['timestamp'] - naive_utc(started[e['session_id']])
+        if delays:
+            db.session.execute(table.update()
+                .where(table.c.id == bindparam('session_id'))
+                .values(queue_delay=bindparam('queue_delay')),
+                [{'session_id': k, 'queue_delay': v} for (k, v) in delays.items()])
+
+    # events are in order, so the last status for each session wins
+    latest = dict((e['session_id'], e) for e in statuses)
+    if latest:
+        db.session.execute(table.update()
+            .where(table.c.id == bindparam('session_id'))
+            .values(status=bindparam('status'), duration=bindparam('duration')),
+            [{'session_id': k, 'status': e['status'], 'duration': _int(e['duration'])}
+                for (k, e) in latest.items()])
+
+
+def update_inbound(events):
+    "Update the most recent open inbound session for each caller"
+    for e in events:
+        call_session = Session.query.filter_by(
+            phone_hash=e['phone_hash'],
+            status='initiated',
+            direction='inbound',
+            campaign_id=e['campaign_id'],
+            location=e['location']
+        ).order_by(desc(Session.timestamp)).first()
+        if call_session:
+            call_session.status = e['status']
+            call_session.duration = _int(e['duration'])
+
+
+def write_events(events):
+    """
+    Write a batch of (kind, data) events in one transaction
+    Returns number of calls inserted
+    """
+    by_kind = {'call': [], 'ringing': [], 'status': [], 'inbound_status': []}
+    for (kind, data) in events:
+        by_kind[kind].append(data)
+
+    # calls first, they may be in the same batch as their session's status
+    inserted = insert_calls(by_kind['call']) if by_kind['call'] else 0
+    update_sessions(by_kind['ringing'], by_kind['status'])
+    update_inbound(by_kind['inbound_status'])
+    db.session.commit()
+    return inserted
+
+
+def write_each(raw):
+    """
+    Write pickled events one at a time
+    Returns list of the ones that couldn't be written
+    """
+    failed = []
+    for r in raw:
+        try:
+            write_events([pickle.loads(r)])
+        except Exception:
+            db.session.rollback()
+            current_app.logger.error('Failed to write call log event', exc_info=True)
+            failed.append(r)
+    return failed
+
+
+@rq.job
+def flush_call_log(batch_size=BATCH_SIZE):
+    """
+    Write all queued call log events to the database, unless another flush is running
+    Returns number of events written
+    """
+    redis = _redis()
+    if not redis:
+        return 0
+    # cleared before taking the lock, so a busy run lets the next event queue a flush,
+    # and the running flush checks for events left behind as it finishes
+    cache.delete(KEY_QUEUED)
+    if not cache.add(KEY_FLUSHING, True, timeout=FLUSHING_TIMEOUT):
+        return 0
+    try:
+        written = flush_batches(redis, batch_size)
+    finally:
+        cache.delete(KEY_FLUSHING)
+
+    # events queued while this flush was finishing were left to it, flush them now
+    if redis.llen(_key(KEY_EVENTS)):
+        cache.set(KEY_QUEUED, True, timeout=QUEUED_TIMEOUT)
+        flush_call_log.queue()
+    return written
+
+
+def flush_batches(redis, batch_size):
+    written = 0
+    while True:
+        cache.set(KEY_FLUSHING, True, timeout=FLUSHING_TIMEOUT)
+        pipe = redis.pipeline()
+        pipe.lrange(_key(KEY_EVENTS), 0, batch_size - 1)
+        pipe.ltrim(_key(KEY_EVENTS), batch_size, -1)
+        (raw, _) = pipe.execute()
+        if not raw:
+            return written
+
+        try:
+            write_events([pickle.loads(r) for r in raw])
+            written += len(raw)
+        except Exception:
+            db.session.rollback()
+            # counted by the first event, which stays at the front while the batch fails
+            attempts_key = _key(KEY_ATTEMPTS.format(batch=hashlib.sha1(raw[0]).hexdigest()))
+            attempts = redis.incr(attempts_key)
+            redis.expire(attempts_key, ATTEMPTS_TIMEOUT)
+            if attempts < MAX_ATTEMPTS:
+                # put the batch back at the front, for the next run
+                redis.lpush(_key(KEY_EVENTS), *reversed(raw))
+                raise
+
+            failed = write_each(raw)
+            if failed:
+                current_app.logger.error('Moved %d call log events to %s' % (len(failed), KEY_DEAD_LETTER))
+                redis.rpush(_key(KEY_DEAD_LETTER), *failed)
+            redis.delete(attempts_key)
+            written += len(raw) - len(failed)
@@ -0,0 +1,229 @@
+"""
+Outbound dialer queue, paced to Twilio's calls per second limits.
+
+The create view, and the scheduled call dispatcher, push calls onto a list
+in redis and return. run_dialer pops them in order and places each one once
+token buckets for the whole account, and for the number it is placed from,
+have room, so a spike of callers waits in the queue instead of being
+refused by Twilio, or holding up a web worker. Requests to Twilio are made
+on a pool of DIALER_WORKERS threads.
+
+One dialer runs at a time. It takes KEY_RUNNING with a token of its own
+when it starts, with SET NX, and exits if another dialer holds it, so their
+token buckets never pace calls at once. It refreshes only its own token, and
+runs until the queue is empty, or for RUN_TIME_LIMIT seconds, well inside its
+rq timeout, and then queues another dialer for the calls left. Queue depth
+and wait times are kept for dialer_metrics.
+
+Without a redis cache, or with DIALER_QUEUE off, calls are placed during
+the request as before.
+"""
+
+import cPickle as pickle
+import time
+import uuid
+from multiprocessing.pool import ThreadPool
+
+from flask import current_app
+from twilio.base.exceptions import TwilioRestException
+
+from ..extensions import cache, rq
+from .call_log import log_session_status
+from .decorators import stripANSI
+from .outbound import dial
+
+KEY_QUEUE = 'call:dialer:queue'
+KEY_RUNNING = 'call:dialer:running'
+KEY_QUEUED = 'call:dialer:queued'
+KEY_DIALED = 'call:dialer:dialed'
+KEY_WAIT_MS = 'call:dialer:wait_ms'
+KEY_LAST_WAIT = 'call:dialer:last_wait'
+RUNNING_TIMEOUT = 60  # seconds, for another dialer to start if this one dies
+QUEUED_TIMEOUT = 60*5  # seconds, to queue another dialer if a queued one never starts
+RUN_TIME_LIMIT = 60*2  # seconds a dialer runs, before leaving the rest of the queue to the next one
+
+# refresh or release KEYS[1] only if it still holds this dialer's token
+REFRESH_RUNNING = """
+if redis.call('get', KEYS[1]) == ARGV[1] then return redis.call('expire', KEYS[1], ARGV[2]) end
+return 0
+"""
+RELEASE_RUNNING = """
+if redis.call('get', KEYS[1]) == ARGV[1] then return redis.call('del', KEYS[1]) end
+return 0
+"""
+
+
+class TokenBucket(object):
+    """Allows rate events a second, in bursts of up to burst"""
+
+    def __init__(self, rate, burst=None, now=None):
+        self.rate = float(rate)
+        self.burst = burst or max(1, rate)
+        self.tokens = self.burst
+        self.updated = now if now is not None else time.time()
+
+    def _refill(self, now):
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait(self, now):
+        "Seconds until a token is available"
+        self._refill(now)
+        if self.tokens >= 1:
+            return 0
+        return (1 - self.tokens) / self.rate
+
+    def take(self, now):
+        self._refill(now)
+        self.tokens -= 1
+
+
+class Pacer(object):
+    """Token buckets for the Twilio account, and for each number calls are placed from"""
+
+    def __init__(self, account_cps, number_cps, now=None):
+        self.account = TokenBucket(account_cps, now=now)
+        self.number_cps = number_cps
+        self.numbers = {}
+
+    def _number(self, from_number, now):
+        if from_number not in self.numbers:
+            self.numbers[from_number] = TokenBucket(self.number_cps, now=now)
+        return self.numbers[from_number]
+
+    def wait(self, from_number, now):
+        "Seconds until a call can be placed from from_number"
+        return max(self.account.wait(now), self._number(from_number, now).wait(now))
+
+    def take(self, from_number, now):
+        self.account.take(now)
+        self._number(from_number, now).take(now)
+
+
+def _redis():
+    if not current_app.config.get('DIALER_QUEUE'):
+        return None
+    return getattr(cache.cache, '_client', None)
+
+
+def _key(key):
+    return (getattr(cache.cache, 'key_prefix', None) or '') + key
+
+
+def enabled():
+    return _redis() is not None
+
+
+def place_call(call):
+    """
+    Place a call, from a dict of session_id, params, user_phone, from_number and record
+    Returns False if Twilio couldn't place it
+    """
+    try:
+        twilio_call = dial(call['params'], call['user_phone'], call['from_number'], record=call.get('record', False))
+        return twilio_call.status != 'failed'
+    except TwilioRestException, err:
+        current_app.logger.error('unable to place call for session %s: %s' % (call['session_id'], stripANSI(err.msg)))
+        return False
+
+
+def queue_call(call):
+    """
+    Queue a call to be placed by the dialer, takes the same dict as place_call
+    Returns its position in the queue, and estimated seconds until it is placed
+    """
+    redis = _redis()
+    call = dict(call, queued_at=time.time())
+    position = redis.rpush(_key(KEY_QUEUE), pickle.dumps(call, pickle.HIGHEST_PROTOCOL))
+    # a running dialer takes it, or checks the queue again as it stops
+    if not redis.exists(_key(KEY_RUNNING)) and cache.add(KEY_QUEUED, True, timeout=QUEUED_TIMEOUT):
+        run_dialer.queue()
+    return (position, position / float(current_app.config.get('DIALER_ACCOUNT_CPS', 1)))
+
+
+def _dial_queued(app, call):
+    # workers need their own app context, for config and url_for
+    with app.app_context():
+        if not place_call(call):
+            log_session_status(call['session_id'], 'failed', 0)
+
+
+def record_wait(seconds):
+    cache.cache.inc(KEY_DIALED)
+    cache.cache.inc(KEY_WAIT_MS, int(seconds * 1000))
+    cache.set(KEY_LAST_WAIT, seconds, timeout=0)
+
+
+@rq.job(timeout=RUN_TIME_LIMIT + 60)
+def run_dialer():
+    """
+    Place queued calls, paced by the account and number token buckets, until the queue is empty
+    or RUN_TIME_LIMIT, then queue another dialer for the rest
+    Returns number of calls placed, or 0 if another dialer is running
+    """
+    redis = _redis()
+    if not redis:
+        return 0
+    cache.delete(KEY_QUEUED)
+    token = uuid.uuid4().hex
+    if not redis.set(_key(KEY_RUNNING), token, nx=True, ex=RUNNING_TIMEOUT):
+        return 0
+
+    app = current_app._get_current_object()
+    pacer = Pacer(app.config.get('DIALER_ACCOUNT_CPS', 1), app.config.get('DIALER_NUMBER_CPS', 1))
+    pool = ThreadPool(app.config.get('DIALER_WORKERS', 8))
+    deadline = time.time() + RUN_TIME_LIMIT
+    dialed = 0
+    try:
+        while time.time() < deadline:
+            if not redis.eval(REFRESH_RUNNING, 1, _key(KEY_RUNNING), token, RUNNING_TIMEOUT):
+                current_app.logger.error('dialer lost %s to another dialer, stopping' % KEY_RUNNING)
+                return dialed
+            raw = redis.lpop(_key(KEY_QUEUE))
+            if raw is None:
+                redis.eval(RELEASE_RUNNING, 1, _key(KEY_RUNNING), token)
+                # a call queued just before the flag was cleared didn't start a dialer
+                if redis.llen(_key(KEY_QUEUE)) and redis.set(_key(KEY_RUNNING), token, nx=True, ex=RUNNING_TIMEOUT):
+                    continue
+                return dialed
+
+            call = pickle.loads(raw)
+            delay = pacer.wait(call['from_number'], time.time())
+            if delay:
+                time.sleep(delay)
+            now = time.time()
+            pacer.take(call['from_number'], now)
+            record_wait(now - call['queued_at'])
+            pool.apply_async(_dial_queued, (app, call))
+            dialed += 1
+    finally:
+        pool.close()
+        pool.join()
+        redis.eval(RELEASE_RUNNING, 1, _key(KEY_RUNNING), token)
+
+    # out of time, the next dialer carries on once this one has released the flag
+    if cache.add(KEY_QUEUED, True, timeout=QUEUED_TIMEOUT):
+        run_dialer.queue()
+    return dialed
+
+
+def dialer_metrics():
+    "Queue depth, how long the oldest queued call has waited, and the average and last wait in seconds"
+    redis = _redis()
+    depth = 0
+    oldest_wait = 0
+    if redis:
+        depth = redis.llen(_key(KEY_QUEUE))
+        head = redis.lindex(_key(KEY_QUEUE), 0)
+        if head:
+            oldest_wait = time.time() - pickle.loads(head)['queued_at']
+
+    (dialed, wait_ms, last_wait) = cache.get_many(KEY_DIALED, KEY_WAIT_MS, KEY_LAST_WAIT)
+    return {
+        'enabled': bool(redis),
+        'depth': depth,
+        'oldest_wait': oldest_wait,
+        'dialed': dialed or 0,
+        'average_wait': (wait_ms / 1000.0 / dialed) if dialed else 0,
+        'last_wait': last_wait or 0,
+    }
@@ -11,7 +11,7 @@ class Call(db.Model):
     __tablename__ = 'calls'
 
     id = db.Column(db.Integer, primary_key=True)
-    timestamp = db.Column(db.DateTime(timezone=True))
+    timestamp = db.Column(db.DateTime(timezone=True))  # partitioned by month on postgres, see partitions.py
 
     # session
     session_id = db.Column(db.ForeignKey('calls_session.id'))
@@ -30,6 +30,17 @@ class Call(db.Model):
     status = db.Column(db.String(25))     # twilio call status
     duration = db.Column(db.Integer)      # twilio call time in seconds
 
+    __table_args__ = (
+        # campaign stats and counts, by status over a date range
+        db.Index('ix_calls_campaign_status_timestamp', 'campaign_id', 'status', 'timestamp'),
+        # admin dashboard, completed calls across campaigns by date
+        db.Index('ix_calls_status_timestamp', 'status', 'timestamp'),
+        # calls in a session, for lookups by phone and the stats rollups
+        db.Index('ix_calls_session_status', 'session_id', 'status'),
+        # twilio call sid, to skip retried webhooks when logging calls
+        db.Index('ix_calls_call_id', 'call_id'),
+    )
+
     def __init__(self, session_id, campaign_id, target_id, call_id=None, status='unknown', duration=0):
         self.timestamp = datetime.utcnow()
         self.session_id = session_id
@@ -52,14 +63,14 @@ class Session(db.Model):
     __tablename__ = 'calls_session'
 
     id = db.Column(db.Integer, primary_key=True)
-    timestamp = db.Column(db.DateTime(timezone=True))
+    timestamp = db.Column(db.DateTime(timezone=True))  # partitioned by month on postgres, see partitions.py
 
     # campaign
     campaign_id = db.Column(db.ForeignKey('campaign_campaign.id'))
     campaign = db.relationship('Campaign')
 
     # user attributes
-    phone_hash = db.Column(db.String(64), nullable=True)  # hashed phone number (optional)
+    phone_hash = db.Column(db.String(64), nullable=True, index=True)  # hashed phone number (optional)
     location = db.Column(db.String(STRING_LEN))  # provided location
     referral_code = db.Column(db.String(64), nullable=True) # (optional)
 
@@ -72,6 +83,10 @@ class Session(db.Model):
     direction = db.Column(db.String(25))    # (inbound, outbound)
     queue_delay = db.Column(db.Interval)  # difference between timestamp and ringing event
 
+    __table_args__ = (
+        db.Index('ix_calls_session_campaign_timestamp', 'campaign_id', 'timestamp'),
+    )
+
     @classmethod
     def hash_phone(cls, number):
         """
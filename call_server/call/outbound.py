@@ -0,0 +1,41 @@
+"""
+Placing outbound calls to users, for the create view and the scheduled call dispatcher.
+"""
+
+from flask import current_app, url_for
+
+from .models import Session
+
+
+def start_session(campaign, user_phone, location, from_number, referral_code=None):
+    "Session for an outbound call, added to the db session for the caller to commit"
+    call_session_data = {
+        'campaign_id': campaign.id,
+        'location': location,
+        'from_number': from_number,
+        'direction': 'outbound'
+    }
+    if current_app.config['LOG_PHONE_NUMBERS']:
+        call_session_data['phone_number'] = user_phone
+        # user phone numbers are hashed by the init method
+        # but some installations may not want to log at all
+
+    call_session = Session(**call_session_data)
+    if referral_code:
+        call_session.referral_code = referral_code[:64]
+    return call_session
+
+
+def dial(params, user_phone, from_number, record=False):
+    """
+    Ask Twilio to call the user, who is connected to the campaign when they answer
+    Params must include sessionId. Raises TwilioRestException
+    """
+    return current_app.config['TWILIO_CLIENT'].calls.create(
+        to=user_phone,
+        from_=from_number,
+        url=url_for('call.connection', _external=True, **params),
+        timeout=current_app.config['TWILIO_TIMEOUT'],
+        status_callback=url_for("call.status_callback", _external=True, **params),
+        status_callback_event=['ringing','completed'],
+        record=record)
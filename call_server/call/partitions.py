@@ -0,0 +1,142 @@
+"""
+Monthly partitions of the calls and calls_session tables, on postgres.
+
+The partitioning migration turns both tables into range partitioned tables on
+timestamp, with one partition per calendar month in UTC and a default
+partition for anything outside them. Queries filtered by a date range then
+only read the months they cover.
+
+create_partitions adds partitions for the coming months, moving any rows that
+already landed in the default partition. archive_partitions detaches months
+older than a cutoff, writes each to a gzipped CSV and drops it. The hourly
+stats rollups keep their totals.
+
+On other databases, or before the migration has run, these do nothing.
+"""
+
+import gzip
+import os
+import re
+from datetime import datetime
+
+from flask import current_app
+
+from ..extensions import db, rq
+
+PARTITIONED_TABLES = ('calls', 'calls_session')
+MONTHS_AHEAD = 2
+PARTITION_NAME = re.compile(r'^(?P<table>\w+)_y(?P<year>\d{4})m(?P<month>\d{2})$')
+
+
+def month_start(timestamp):
+    return datetime(timestamp.year, timestamp.month, 1)
+
+
+def add_months(month, n):
+    "First of the month, n months after month"
+    months = month.year * 12 + month.month - 1 + n
+    return datetime(months // 12, months % 12 + 1, 1)
+
+
+def partition_name(table, month):
+    return '{}_y{:04d}m{:02d}'.format(table, month.year, month.month)
+
+
+def _bound(month):
+    return "'{:%Y-%m-%d} 00:00:00+00'".format(month)
+
+
+def is_partitioned(table='calls'):
+    if db.engine.dialect.name != 'postgresql':
+        return False
+    return bool(db.session.execute(
+        "SELECT 1 FROM pg_partitioned_table WHERE partrelid = to_regclass(:table)",
+        {'table': table}).scalar())
+
+
+def list_partitions(table):
+    "Returns list of (month, partition name) for a table, oldest first, without the default"
+    rows = db.session.execute(
+        "SELECT c.relname FROM pg_inherits i JOIN pg_class c ON c.oid = i.inhrelid "
+        "WHERE i.inhparent = to_regclass(:table)", {'table': table})
+    partitions = []
+    for (name,) in rows:
+        match = PARTITION_NAME.match(name)
+        if match and match.group('table') == table:
+            partitions.append((datetime(int(match.group('year')), int(match.group('month')), 1), name))
+    return sorted(partitions)
+
+
+def create_partition(table, month):
+    """
+    Adds the partition of table for month, moving its rows out of the default partition
+    Returns False if it already exists
+    """
+    name = partition_name(table, month)
+    if db.session.execute("SELECT to_regclass(:name)", {'name': name}).scalar():
+        return False
+
+    start, end = _bound(month), _bound(add_months(month, 1))
+    db.session.execute('CREATE TABLE {} (LIKE {} INCLUDING DEFAULTS INCLUDING CONSTRAINTS)'.format(name, table))
+    db.session.execute(
+        'WITH moved AS (DELETE FROM {table}_default WHERE timestamp >= {start} AND timestamp < {end} RETURNING *) '
+        'INSERT INTO {name} SELECT * FROM moved'.format(table=table, name=name, start=start, end=end))
+    db.session.execute('ALTER TABLE {} ATTACH PARTITION {} FOR VALUES FROM ({}) TO ({})'.format(
+        table, name, start, end))
+    db.session.commit()
+    return True
+
+
+@rq.job
+def create_partitions(months_ahead=MONTHS_AHEAD):
+    """
+    Make sure partitions exist from this month through months_ahead
+    Returns list of partitions created
+    """
+    created = []
+    if not is_partitioned():
+        return created
+
+    this_month = month_start(datetime.utcnow())
+    for table in PARTITIONED_TABLES:
+        for n in range(months_ahead + 1):
+            month = add_months(this_month, n)
+            if create_partition(table, month):
+                created.append(partition_name(table, month))
+    return created
+
+
+def archive_partitions(before, directory):
+    """
+    Detach partitions for months before the month of `before`, save each to
+    directory as gzipped CSV and drop it
+    Returns list of files written
+    """
+    archived = []
+    if not is_partitioned():
+        return archived
+    if not os.path.isdir(directory):
+        os.makedirs(directory)
+
+    cutoff = month_start(before)
+    for table in PARTITIONED_TABLES:
+        for (month, name) in list_partitions(table):
+            if month >= cutoff:
+                continue
+
+            db.session.execute('ALTER TABLE {} DETACH PARTITION {}'.format(table, name))
+            db.session.commit()
+
+            path = os.path.join(directory, name + '.csv.gz')
+            connection = db.engine.raw_connection()
+            try:
+                with gzip.open(path, 'wb') as out:
+                    connection.cursor().copy_expert('COPY {} TO STDOUT WITH CSV HEADER'.format(name), out)
+            finally:
+                connection.close()
+
+            db.session.execute('DROP TABLE {}'.format(name))
+            db.session.commit()
+            current_app.logger.info('archived %s to %s' % (name, path))
+            archived.append(path)
+    return archived
@@ -0,0 +1,138 @@
+"""
+Server-side call plans for outbound call sessions.
+
+Once make_calls has located and ordered the targets for a caller, everything
+the rest of the call needs is resolved into a CallPlan: which office to dial
+for each target, the numbers in e164, and the names to read out. The plan is
+stored once per Session in the shared cache, so the make_single and complete
+webhooks only carry sessionId and call_index, and each hop is a single cache
+read instead of re-parsing and re-resolving the whole target list.
+"""
+
+import random
+
+from sqlalchemy_utils.types.phone_number import PhoneNumber, phonenumbers
+
+from ..extensions import db, cache
+from .models import Session
+from ..campaign.constants import TARGET_OFFICE_DISTRICT, TARGET_OFFICE_BUSY
+from ..campaign.snapshot import resolve_targets
+
+KEY_PLAN = 'call:session:{session_id}:plan'
+PLAN_TIMEOUT = 60*60*6  # longer than any realistic call session
+
+
+class PlannedCall(object):
+    """One target to dial, with the office already picked"""
+
+    def __init__(self, target, office=None):
+        self.target_key = target.uid
+        self.target_id = target.id
+        self.title = target.title
+        self.name = target.name
+
+        if office:
+            number = office.number
+            self.location = office.name
+            # use voice-readable short name instead of full address
+            self.office_type = office.type
+        else:
+            number = target.number
+            self.location = target.location or 'capitol'
+            self.office_type = 'main'
+
+        if number:
+            self.phone = number.e164
+            self.extension = number.extension
+        else:
+            self.phone = None
+            self.extension = None
+
+    def __unicode__(self):
+        return self.target_key
+
+
+class CallPlan(object):
+    """Everything needed to connect a caller to their targets, in order"""
+
+    def __init__(self, session_id, campaign, user_phone, user_country, user_location, calls,
+                 referral_code=None):
+        self.session_id = session_id
+        self.campaign_id = campaign.id
+        self.user_phone = user_phone
+        self.user_country = user_country
+        self.user_location = user_location
+        self.calls = calls
+        self.referral_code = referral_code
+
+    def __len__(self):
+        return len(self.calls)
+
+    def __getitem__(self, i):
+        return self.calls[i]
+
+    def is_last(self, i):
+        return i >= len(self.calls) - 1
+
+    def url_params(self, call_index):
+        "Params for the next webhook in the call flow"
+        if self.session_id:
+            return {'sessionId': self.session_id, 'call_index': call_index}
+        # without a session there is nowhere to store the plan, pass the targets along instead
+        return {
+            'campaignId': self.campaign_id,
+            'userPhone': self.user_phone,
+            'userCountry': self.user_country,
+            'userLocation': self.user_location,
+            'targetIds': [c.target_key for c in self.calls],
+            'call_index': call_index
+        }
+
+
+def pick_office(target, campaign):
+    if not target.offices:
+        return None
+    if campaign.target_offices == TARGET_OFFICE_DISTRICT:
+        return random.choice(target.offices)
+    elif campaign.target_offices == TARGET_OFFICE_BUSY:
+        # TODO keep track of which ones we have tried
+        return random.choice(target.offices)
+    #elif campaign.target_offices == TARGET_OFFICE_CLOSEST:
+    #   return find_closest(target.offices, user_location)
+    return None
+
+
+def caller_id(user_phone, user_country):
+    try:
+        return PhoneNumber(user_phone, user_country).e164
+    except phonenumbers.NumberParseException:
+        # press onward, but we may not be able to actually dial
+        return user_phone
+
+
+def build_call_plan(params, campaign):
+    """
+    Resolve targets, offices and numbers for params['targetIds'] into a CallPlan
+    """
+    targets = resolve_targets(params['targetIds'])
+    calls = [PlannedCall(target, pick_office(target, campaign)) for target in targets]
+    referral_code = None
+    if params['sessionId']:
+        referral_code = db.session.query(Session.referral_code).filter_by(id=params['sessionId']).scalar()
+    return CallPlan(params['sessionId'], campaign,
+        user_phone=caller_id(params['userPhone'], params['userCountry']),
+        user_country=params['userCountry'],
+        user_location=params['userLocation'],
+        calls=calls,
+        referral_code=referral_code)
+
+
+def save_call_plan(plan):
+    cache.set(KEY_PLAN.format(session_id=plan.session_id), plan, timeout=PLAN_TIMEOUT)
+
+
+def get_call_plan(session_id):
+    "Returns the stored CallPlan for a session, or None if it has expired"
+    if not session_id:
+        return None
+    return cache.get(KEY_PLAN.format(session_id=session_id))
@@ -0,0 +1,115 @@
+"""
+Precompiled campaign messages for TwiML responses.
+
+Each webhook in the call flow plays or says a few campaign messages. They
+only change when the campaign does, so we compile them once per campaign
+snapshot version: the TTS language is checked against TWILIO_TTS_LANGUAGES,
+templates are parsed, file urls resolved, and messages without any tags are
+rendered up front. At request time only the per-caller variables are filled in.
+"""
+
+import pystache
+
+from flask import current_app
+
+from .constants import TWILIO_TTS_LANGUAGES
+
+DEFAULT_VOICE = 'alice'
+
+# in-process compiled messages, keyed by campaign id
+_compiled = {}
+
+_renderer = pystache.Renderer()
+
+
+def tts_language(lang):
+    "Closest language Twilio can speak for a locale"
+    if lang in TWILIO_TTS_LANGUAGES:
+        return lang
+    if lang and '-' in lang:
+        return lang.split('-')[0]
+    return 'en'
+
+
+class CompiledMessage(object):
+    """A campaign message, ready to append to a TwiML response"""
+
+    def __init__(self, key, audio, lang, voice=DEFAULT_VOICE):
+        self.key = key
+        self.lang = lang
+        self.voice = voice
+        self.url = None
+        self.template = None
+        self.text = None
+
+        if getattr(audio, 'text_to_speech', None):
+            self._compile(audio.text_to_speech)
+        elif getattr(audio, 'url', None):
+            self.url = audio.url
+        elif getattr(audio, 'file_storage', None) and audio.file_storage.fp is not None:
+            self.url = audio.file_url()
+        elif isinstance(audio, basestring):
+            self._compile(audio)
+        elif audio:
+            current_app.logger.error('Unknown audio type %s for %s' % (type(audio), key))
+
+    def _compile(self, text):
+        try:
+            template = pystache.parse(unicode(text))
+        except pystache.common.PystacheError:
+            current_app.logger.error('Unable to parse pystache template %s' % text)
+            self.text = text
+            return
+
+        if all(isinstance(node, basestring) for node in template._parse_tree):
+            # nothing to fill in, render once
+            self.text = _renderer.render(template)
+        else:
+            self.template = template
+
+    def render(self, **kwargs):
+        if self.template is not None:
+            return _renderer.render(self.template, kwargs)
+        return self.text
+
+    def append_to(self, r, **kwargs):
+        "Play or say this message on TwiML response or verb r"
+        if self.url:
+            r.play(self.url)
+        elif self.text is not None or self.template is not None:
+            r.say(self.render(**kwargs), voice=self.voice, language=self.lang)
+        else:
+            r.say('Error: no recording defined')
+            current_app.logger.error('Missing audio recording %s' % self.key)
+            current_app.logger.error(kwargs)
+
+
+class CampaignMessages(object):
+    """Compiled messages for one version of a campaign snapshot"""
+
+    def __init__(self, campaign):
+        self.campaign = campaign
+        self.version = campaign.version
+        self.lang = tts_language(campaign.language_code)
+        self._messages = {}
+
+    def get(self, key):
+        message = self._messages.get(key)
+        if message is None:
+            message = self._messages[key] = CompiledMessage(key, self.campaign.audio(key), self.lang)
+        return message
+
+    def append(self, r, key, **kwargs):
+        "Play or say campaign message key on TwiML response or verb r"
+        self.get(key).append_to(r, **kwargs)
+
+
+def campaign_messages(campaign):
+    """
+    Returns CampaignMessages for a CampaignSnapshot
+    Recompiled when the snapshot version changes
+    """
+    messages = _compiled.get(campaign.id)
+    if messages is None or messages.version != campaign.version:
+        messages = _compiled[campaign.id] = CampaignMessages(campaign)
+    return messages
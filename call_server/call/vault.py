@@ -0,0 +1,133 @@
+"""
+Optional vault of callers' phone numbers, so CRM sync doesn't have to ask Twilio.
+
+Only a hash of the phone is kept with each Session. With PHONE_VAULT_KEY
+set, and the cryptography package installed, the number is also encrypted
+with Fernet and kept in the cache for PHONE_VAULT_TTL seconds, keyed by
+session. CRM sync reads numbers from here instead of fetching each call from
+Twilio, and purges them once the session's calls are synced.
+
+Sessions are also listed under a keyed hash of the number, for
+call_sids_for_number when LOG_PHONE_NUMBERS is off. With a redis cache the
+list is a set, so sessions from the same number at once are all kept, and
+sessions are removed from it when their phone is purged.
+"""
+
+import hashlib
+import hmac
+import logging
+
+from flask import current_app
+
+from ..extensions import cache
+
+log = logging.getLogger(__name__)
+
+try:
+    from cryptography.fernet import Fernet, InvalidToken
+except ImportError:
+    Fernet = None
+
+KEY_PHONE = 'call:vault:session:{session_id}'
+KEY_SESSIONS = 'call:vault:phone:{phone_key}'
+
+
+def _fernet():
+    key = current_app.config.get('PHONE_VAULT_KEY')
+    if not key:
+        return None
+    if Fernet is None:
+        log.warning('install cryptography to use PHONE_VAULT_KEY')
+        return None
+    return Fernet(str(key))
+
+
+def enabled():
+    return _fernet() is not None
+
+
+def phone_key(phone):
+    "Keyed hash of phone, so numbers can't be recovered from the cache keys"
+    return hmac.new(str(current_app.config['PHONE_VAULT_KEY']), str(phone), hashlib.sha256).hexdigest()
+
+
+def _redis():
+    return getattr(cache.cache, '_client', None)
+
+
+def _key(key):
+    return (getattr(cache.cache, 'key_prefix', None) or '') + key
+
+
+def store_phone(session_id, phone):
+    fernet = _fernet()
+    if not fernet or not session_id or not phone:
+        return
+    timeout = current_app.config.get('PHONE_VAULT_TTL')
+    cache.set(KEY_PHONE.format(session_id=session_id), fernet.encrypt(str(phone)), timeout=timeout)
+
+    sessions_key = KEY_SESSIONS.format(phone_key=phone_key(phone))
+    redis = _redis()
+    if redis:
+        pipe = redis.pipeline()
+        pipe.sadd(_key(sessions_key), session_id)
+        if timeout:
+            pipe.expire(_key(sessions_key), timeout)
+        pipe.execute()
+    else:
+        sessions = cache.get(sessions_key) or []
+        cache.set(sessions_key, sessions + [session_id], timeout=timeout)
+
+
+def get_phones(session_ids):
+    "Returns dict of session id to phone, for sessions in the vault"
+    fernet = _fernet()
+    if not fernet or not session_ids:
+        return {}
+    session_ids = list(session_ids)
+    tokens = cache.get_many(*[KEY_PHONE.format(session_id=s) for s in session_ids])
+    phones = {}
+    for (session_id, token) in zip(session_ids, tokens):
+        if not token:
+            continue
+        try:
+            phones[session_id] = fernet.decrypt(token)
+        except InvalidToken:
+            # encrypted with a previous key
+            continue
+    return phones
+
+
+def get_sessions(phone):
+    "Returns list of session ids in the vault for phone"
+    if not enabled():
+        return []
+    sessions_key = KEY_SESSIONS.format(phone_key=phone_key(phone))
+    redis = _redis()
+    if redis:
+        return sorted(int(s) for s in redis.smembers(_key(sessions_key)))
+    return cache.get(sessions_key) or []
+
+
+def purge_phones(session_ids):
+    "Remove the phones of sessions from the vault, and the sessions from their phone's list"
+    if not enabled() or not session_ids:
+        return
+    phones = get_phones(session_ids)
+    cache.delete_many(*[KEY_PHONE.format(session_id=s) for s in session_ids])
+
+    redis = _redis()
+    pipe = redis.pipeline() if redis else None
+    for (session_id, phone) in phones.items():
+        sessions_key = KEY_SESSIONS.format(phone_key=phone_key(phone))
+        if pipe:
+            pipe.srem(_key(sessions_key), session_id)
+            continue
+        sessions = [s for s in cache.get(sessions_key) or [] if s != session_id]
+        if sessions:
+            cache.set(sessions_key, sessions, timeout=current_app.config.get('PHONE_VAULT_TTL'))
+        else:
+            cache.delete(sessions_key)
+    if pipe:
+        pipe.execute()
+
@@ -1,29 +1,31 @@
 import random
-import pystache
 from twilio.twiml.voice_response import VoiceResponse, Gather, Dial
 from sqlalchemy_utils.types.phone_number import PhoneNumber, phonenumbers
 
 from flask import abort, Blueprint, request, url_for, current_app
 from flask_jsonpify import jsonify
 from twilio.base.exceptions import TwilioRestException
-from sqlalchemy.sql import desc
-from sqlalchemy.exc import SQLAlchemyError
-from datetime import datetime
 
 from ..extensions import csrf, cors, db, limiter
 
-from .models import Call, Session
-from .constants import TWILIO_TTS_LANGUAGES
+from .models import Session
+from .plan import build_call_plan, save_call_plan, get_call_plan
+from .call_log import log_call, log_session_ringing, log_session_status, log_inbound_status
+from .twiml import campaign_messages
+from .outbound import start_session, dial
+from . import vault, dialer
 from ..campaign.constants import (LOCATION_POSTAL, LOCATION_DISTRICT,
-    SEGMENT_BY_LOCATION, SEGMENT_BY_CUSTOM,
-    TARGET_OFFICE_DISTRICT, TARGET_OFFICE_BUSY)
-from ..campaign.models import Campaign, Target
+    SEGMENT_BY_LOCATION, SEGMENT_BY_CUSTOM)
+from ..campaign.models import Campaign
+from ..campaign.snapshot import get_campaign_snapshot
 from ..political_data.lookup import locate_targets, validate_location
 from ..political_data.geocode import LocationError
 from ..schedule.models import ScheduleCall
 from ..schedule.views import schedule_created, schedule_deleted
 from ..admin.models import Blocklist
 from ..admin.views import admin_phone
+from ..stats.jobs import queue_stats_rollups
+from ..stats.counters import count_completed_call
 
 from .decorators import abortJSON, stripANSI
 
@@ -39,40 +41,6 @@ def rate_limit_from_config():
     return current_app.config.get("CALL_RATE_LIMIT")
 
 
-def play_or_say(r, audio, voice='alice', lang='en-US', **kwargs):
-    """
-    Take twilio response and play or say message from an AudioRecording
-    Can use mustache templates to render keyword arguments
-    """
-
-    if audio:
-        # check to ensure lang is in list of valid locales
-        if lang not in TWILIO_TTS_LANGUAGES:
-            if '-' in lang:
-                lang, country = lang.split('-')
-            else:
-                lang = 'en'
-
-        if (hasattr(audio, 'text_to_speech') and audio.text_to_speech):
-            msg = pystache.render(audio.text_to_speech, kwargs)
-            r.say(msg, voice=voice, language=lang)
-        elif (hasattr(audio, 'file_storage') and (audio.file_storage.fp is not None)):
-            r.play(audio.file_url())
-        elif type(audio) == str:
-            try:
-                msg = pystache.render(audio, kwargs)
-                r.say(msg, voice=voice, language=lang)
-            except pystache.common.PystacheError:
-                current_app.logger.error('Unable to render pystache template %s' % audio)
-                r.say(audio, voice=voice, language=lang)
-        else:
-            current_app.logger.error('Unknown audio type %s' % type(audio))
-    else:
-        r.say('Error: no recording defined')
-        current_app.logger.error('Missing audio recording')
-        current_app.logger.error(kwargs)
-
-
 def parse_params(r, inbound=False):
     """
     Rehydrate objects from the parameter list.
@@ -104,12 +72,13 @@ def parse_params(r, inbound=False):
     if not params['userLocation'] and r.values.get('zipcode', None):
         params['userLocation'] = r.values.get('zipcode')
 
-    # lookup campaign by ID
+    # lookup campaign by ID, from snapshot cache
     if params['campaignId'].isdigit():
-        campaign = Campaign.query.get(params['campaignId'])
+        campaign = get_campaign_snapshot(int(params['campaignId']))
     else:
         # fallback to name for legacy call-congress compatibility
-        campaign = Campaign.query.filter_by(name=params['campaignId']).first()
+        campaign_id = db.session.query(Campaign.id).filter_by(name=params['campaignId']).scalar()
+        campaign = get_campaign_snapshot(campaign_id) if campaign_id else None
     if not campaign:
         abort(400, 'invalid campaignId %(campaignId)s' % params)
 
@@ -123,6 +92,30 @@ def parse_params(r, inbound=False):
     return params, campaign
 
 
+def parse_plan(r):
+    """
+    Load the CallPlan for this session, and the campaign it belongs to.
+    Requests that still carry targetIds, from calls started before plans were stored,
+    build their plan from the params instead.
+    """
+    if r.values.getlist('targetIds'):
+        params, campaign = parse_params(r)
+        plan = build_call_plan(params, campaign)
+        if plan.session_id:
+            save_call_plan(plan)
+        return plan, campaign
+
+    plan = get_call_plan(r.values.get('sessionId'))
+    if not plan:
+        abort(400, 'no call plan for session %s' % r.values.get('sessionId'))
+
+    campaign = get_campaign_snapshot(plan.campaign_id)
+    if not campaign:
+        abort(400, 'invalid campaignId %s' % plan.campaign_id)
+
+    return plan, campaign
+
+
 def parse_target(key):
     """
     Split target key into (uid, prefix)
@@ -146,16 +139,17 @@ def intro_wait_human(params, campaign):
     Play intro message, and wait for key press to ensure we have a human on the line.
     Then, redirect to _make_calls.
     """
+    messages = campaign_messages(campaign)
     resp = VoiceResponse()
 
-    play_or_say(resp, campaign.audio('msg_intro'))
+    messages.append(resp, 'msg_intro')
 
     action = url_for("call._make_calls", **params)
 
     # wait for user keypress, in case we connected to voicemail
     # give up after 10 seconds
     g = Gather(num_digits=1, method="POST", timeout=10, action=action)
-    play_or_say(g, campaign.audio('msg_intro_confirm'), lang=campaign.language_code)
+    messages.append(g, 'msg_intro_confirm')
     resp.append(g)
 
     return str(resp)
@@ -166,14 +160,14 @@ def intro_location_gather(params, campaign):
     If specified, play msg_intro_location audio. Otherwise, standard msg_intro.
     Then, return location_gather.
     """
+    messages = campaign_messages(campaign)
     resp = VoiceResponse()
 
     if campaign.audio('msg_intro_location'):
-        play_or_say(resp, campaign.audio('msg_intro_location'),
-                    organization=current_app.config.get('INSTALLED_ORG', ''),
-                    lang=campaign.language_code)
+        messages.append(resp, 'msg_intro_location',
+            organization=current_app.config.get('INSTALLED_ORG', ''))
     else:
-        play_or_say(resp, campaign.audio('msg_intro'), lang=campaign.language_code)
+        messages.append(resp, 'msg_intro')
 
     return location_gather(resp, params, campaign)
 
@@ -184,13 +178,14 @@ def location_gather(resp, params, campaign):
     Then, redirect to location_parse
     If no response, replay then hang up
     """
+    messages = campaign_messages(campaign)
     g = Gather(num_digits=5, timeout=5, method="POST", action=url_for("call.location_parse", **params))
-    play_or_say(g, campaign.audio('msg_location'), lang=campaign.language_code)
+    messages.append(g, 'msg_location')
     resp.append(g)
     # didn't get a response
-    play_or_say(resp, campaign.audio('msg_unparsed_location'), lang=campaign.language_code)
+    messages.append(resp, 'msg_unparsed_location')
     resp.append(g) # try second gather
-    play_or_say(resp, campaign.audio('msg_goodbye'), lang=campaign.language_code)
+    messages.append(resp, 'msg_goodbye')
     # if no response, hang up
 
     return str(resp)
@@ -202,6 +197,7 @@ def make_calls(params, campaign):
     Performs target lookup, shuffling, and limiting to maximum.
     Plays msg_call_block_intro, then redirects to make_single call.
     """
+    messages = campaign_messages(campaign)
     resp = VoiceResponse()
 
     if not params['targetIds']:
@@ -228,23 +224,27 @@ def make_calls(params, campaign):
         pass
 
     if not params['targetIds']:
-        play_or_say(resp, campaign.audio('msg_invalid_location'),
-            location=params['userLocation'],
-            lang=campaign.language_code)
+        messages.append(resp, 'msg_invalid_location',
+            location=params['userLocation'])
         resp.hangup()
+        return str(resp)
 
     # limit calls to maximum number
     if campaign.call_maximum:
         params['targetIds'] = params['targetIds'][:campaign.call_maximum]
 
-    n_targets = len(params['targetIds'])
+    # resolve targets, offices and numbers once, and store them for the rest of the session
+    plan = build_call_plan(params, campaign)
+    if plan.session_id:
+        save_call_plan(plan)
+
+    n_targets = len(plan)
 
-    play_or_say(resp, campaign.audio('msg_call_block_intro'),
-                n_targets=n_targets,
-                many=n_targets > 1,
-                lang=campaign.language_code)
+    messages.append(resp, 'msg_call_block_intro',
+        n_targets=n_targets,
+        many=n_targets > 1)
 
-    resp.redirect(url_for('call.make_single', call_index=0, **params))
+    resp.redirect(url_for('call.make_single', **plan.url_params(0)))
 
     return str(resp)
 
@@ -255,14 +255,15 @@ def schedule_prompt(params, campaign):
     if not params or not campaign:
         abort(400)
 
+    messages = campaign_messages(campaign)
     resp = VoiceResponse()
     g = Gather(num_digits=1, timeout=3, method="POST", action=url_for("call.schedule_parse", **params))
     
     existing_schedule = ScheduleCall.query.filter_by(campaign_id=campaign.id, phone_number=params['userPhone']).first()
     if existing_schedule and existing_schedule.subscribed:
-        play_or_say(g, campaign.audio('msg_alter_schedule'), lang=campaign.language_code)
+        messages.append(g, 'msg_alter_schedule')
     else:
-        play_or_say(g, campaign.audio('msg_prompt_schedule'), lang=campaign.language_code)
+        messages.append(g, 'msg_prompt_schedule')
     
     resp.append(g)
 
@@ -294,7 +295,7 @@ def incoming():
 
     if campaign.status == 'archived':
         resp = VoiceResponse()
-        play_or_say(resp, campaign.audio('msg_campaign_complete'))
+        campaign_messages(campaign).append(resp, 'msg_campaign_complete')
         return str(resp)
 
     # pull user phone from Twilio incoming request
@@ -317,6 +318,7 @@ def incoming():
     db.session.commit()
 
     params['sessionId'] = call_session.id
+    vault.store_phone(call_session.id, params['userPhone'])
 
     if campaign.segment_by == SEGMENT_BY_LOCATION and campaign.locate_by in [LOCATION_POSTAL, LOCATION_DISTRICT]:
         return intro_location_gather(params, campaign)
@@ -392,51 +394,45 @@ def create():
         }
 
     # start call session for user
-    try:
-        from_number = random.choice(phone_numbers)
+    from_number = random.choice(phone_numbers)
 
-        call_session_data = {
-            'campaign_id': campaign.id,
-            'location': params['userLocation'],
+    call_session = start_session(campaign, params['userPhone'], params['userLocation'], from_number,
+        referral_code=request.values.get('ref'))
+    db.session.add(call_session)
+    db.session.commit()
+
+    params['sessionId'] = call_session.id
+    vault.store_phone(call_session.id, userPhone)
+
+    if campaign.embed:
+        script = campaign.embed.get('script')
+        redirect = campaign.embed.get('redirect')
+    else:
+        script = ''
+        redirect = ''
+
+    if dialer.enabled():
+        # placed by the dialer, as fast as twilio allows
+        (position, eta) = dialer.queue_call({
+            'session_id': call_session.id,
+            'params': params,
+            'user_phone': userPhone,
             'from_number': from_number,
-            'direction': 'outbound'
-        }
-        if current_app.config['LOG_PHONE_NUMBERS']:
-            call_session_data['phone_number'] = params['userPhone']
-            # user phone numbers are hashed by the init method
-            # but some installations may not want to log at all
-
-        call_session = Session(**call_session_data)
-        if 'ref' in request.values:
-            call_session.referral_code = request.values.get('ref')[:64]
-        db.session.add(call_session)
-        db.session.commit()
+            'record': request.values.get('record', False)
+        })
+        return jsonify(campaign=campaign.status, call='queued', position=position, eta=eta,
+            script=script, redirect=redirect, fromNumber=from_number, targets=target_response)
 
-        params['sessionId'] = call_session.id
-
-        # initiate outbound call
-        call = current_app.config['TWILIO_CLIENT'].calls.create(
-            to=userPhone,
-            from_=from_number,
-            url=url_for('call.connection', _external=True, **params),
-            timeout=current_app.config['TWILIO_TIMEOUT'],
-            status_callback=url_for("call.status_callback", _external=True, **params),
-            status_callback_event=['ringing','completed'],
-            record=request.values.get('record', False))
-
-        if campaign.embed:
-            script = campaign.embed.get('script')
-            redirect = campaign.embed.get('redirect')
-        else:
-            script = ''
-            redirect = ''
-        result = jsonify(campaign=campaign.status, call=call.status, script=script, redirect=redirect,
-            fromNumber=from_number, targets=target_response)
-        result.status_code = 200 if call.status != 'failed' else 500
+    # initiate outbound call
+    try:
+        call = dial(params, userPhone, from_number, record=request.values.get('record', False))
     except TwilioRestException, err:
         twilio_error = stripANSI(err.msg)
         abort(400, twilio_error)
 
+    result = jsonify(campaign=campaign.status, call=call.status, script=script, redirect=redirect,
+        fromNumber=from_number, targets=target_response)
+    result.status_code = 200 if call.status != 'failed' else 500
     return result
 
 
@@ -484,8 +480,7 @@ def location_parse():
 
     if not valid_location:
         resp = VoiceResponse()
-        play_or_say(resp, campaign.audio('msg_invalid_location'),
-            lang=campaign.language_code)
+        campaign_messages(campaign).append(resp, 'msg_invalid_location')
 
         return location_gather(resp, params, campaign)
 
@@ -514,22 +509,21 @@ def schedule_parse():
         abort(400)
 
     schedule_choice = request.values.get('Digits', '')
+    messages = campaign_messages(campaign)
 
     if current_app.debug:
         current_app.logger.debug(u'entered = {}'.format(schedule_choice))
 
     if schedule_choice == "1":
         # schedule a call at this time every day
-        play_or_say(resp, campaign.audio('msg_schedule_start'),
-            lang=campaign.language_code)
+        messages.append(resp, 'msg_schedule_start')
         schedule_created.send(ScheduleCall,
             campaign_id=campaign.id,
             phone=params['userPhone'],
             location=params['userLocation'])
     elif schedule_choice == "9":
         # user wishes to opt out
-        play_or_say(resp, campaign.audio('msg_schedule_stop'),
-            lang=campaign.language_code)
+        messages.append(resp, 'msg_schedule_stop')
         schedule_deleted.send(ScheduleCall,
             campaign_id=campaign.id,
             phone=params['userPhone'])
@@ -561,86 +555,41 @@ def _make_calls():
 
 @call.route('/make_single', methods=call_methods)
 def make_single():
-    params, campaign = parse_params(request)
-
-    if not params or not campaign:
-        abort(400)
+    plan, campaign = parse_plan(request)
+    messages = campaign_messages(campaign)
 
     i = int(request.values.get('call_index', 0))
-    params['call_index'] = i
-
-    (uid, prefix) = parse_target(params['targetIds'][i])
-    (current_target, created) = Target.get_or_create(uid, prefix)
-    if created:
-        # save Target to database
-        db.session.add(current_target)
-        db.session.commit()
+    current_call = plan[i]
 
     resp = VoiceResponse()
 
-    if not current_target.number:
-        play_or_say(resp, campaign.audio('msg_invalid_location'),
-            lang=campaign.language_code)
-        current_app.logger.error("No number found for target %s" % current_target)
+    if not current_call.phone:
+        messages.append(resp, 'msg_invalid_location')
+        current_app.logger.error("No number found for target %s" % current_call.target_key)
         # weird, but move on to the next call
-        params['call_index'] = i + 1
-        resp.redirect(url_for('call.make_single', **params))
-        return str(resp)
-
-    if current_target.offices:
-        if campaign.target_offices == TARGET_OFFICE_DISTRICT:
-            office = random.choice(current_target.offices)
-            target_phone = office.number
-        elif campaign.target_offices == TARGET_OFFICE_BUSY:
-            # TODO keep track of which ones we have tried
-            undialed_offices = current_target.offices
-            # then pick a random one
-            office = random.choice(undialed_offices)
-            target_phone = office.number
-        #elif campaign.target_offices == TARGET_OFFICE_CLOSEST:
-        #   office = find_closest(current_target.offices, params['userLocation'])
-        #   target_phone = office.phone
+        if plan.is_last(i):
+            messages.append(resp, 'msg_final_thanks')
         else:
-            office = None
-            target_phone = current_target.number
-    else:
-        office = None
-        target_phone = current_target.number
+            resp.redirect(url_for('call.make_single', **plan.url_params(i + 1)))
+        return str(resp)
 
-    if office:
-        office_location = office.name
-        # use voice-readable short name instead of full address
-        office_type = office.type
-    else:
-        office_location = current_target.location or 'capitol'
-        office_type = 'main'
-        
-    play_or_say(resp, campaign.audio('msg_target_intro'),
-        title=current_target.title,
-        name=current_target.name,
-        location=office_location,
-        office_type=office_type,
-        lang=campaign.language_code)
+    messages.append(resp, 'msg_target_intro',
+        title=current_call.title,
+        name=current_call.name,
+        location=current_call.location,
+        office_type=current_call.office_type)
 
     if current_app.debug:
         current_app.logger.debug(u'Call #{}, {} ({}) from {} in call.make_single()'.format(
-            i, current_target.name, target_phone.e164, params['userPhone']))
-
-    try:
-        parsed = PhoneNumber(params['userPhone'], params['userCountry'])
-        userPhone = parsed.e164
-    except phonenumbers.NumberParseException:
-        current_app.logger.error('Unable to parse %(userPhone)s for %(userCountry)s' % params)
-        # press onward, but we may not be able to actually dial
-        userPhone = params['userPhone']
+            i, current_call.name, current_call.phone, plan.user_phone))
 
     # sending a twiml.Number to dial init will not nest properly
     # have to add it after creation
-    d = Dial(None, caller_id=userPhone,
+    d = Dial(None, caller_id=plan.user_phone,
               time_limit=current_app.config['TWILIO_TIME_LIMIT'],
               timeout=current_app.config['TWILIO_TIMEOUT'], hangup_on_star=True,
-              action=url_for('call.complete', **params)) \
-        .number(target_phone.e164, sendDigits=target_phone.extension)
+              action=url_for('call.complete', **plan.url_params(i))) \
+        .number(current_call.phone, sendDigits=current_call.extension)
     resp.append(d)
 
     return str(resp)
@@ -648,55 +597,45 @@ def make_single():
 
 @call.route('/complete', methods=call_methods)
 def complete():
-    params, campaign = parse_params(request)
-    i = int(request.values.get('call_index', 0))
+    plan, campaign = parse_plan(request)
+    messages = campaign_messages(campaign)
 
-    if not params or not campaign:
-        abort(400)
+    i = int(request.values.get('call_index', 0))
+    current_call = plan[i]
 
-    (uid, prefix) = parse_target(params['targetIds'][i])
-    (current_target, created) = Target.get_or_create(uid, prefix)
     call_data = {
-        'session_id': params['sessionId'],
+        'session_id': plan.session_id,
         'campaign_id': campaign.id,
-        'target_id': current_target.id,
+        'target_id': current_call.target_id,
         'call_id': request.values.get('CallSid', None),
         'status': request.values.get('DialCallStatus', 'unknown'),
         'duration': request.values.get('DialCallDuration', 0)
     }
-
-    try:
-        db.session.add(Call(**call_data))
-        db.session.commit()
-    except SQLAlchemyError:
-        current_app.logger.error('Failed to log call:', exc_info=True)
+    log_call(**call_data)
+    if call_data['status'] == 'completed':
+        count_completed_call(campaign.id, getattr(plan, 'referral_code', None),
+            call_id=call_data['call_id'], target_id=call_data['target_id'])
+    queue_stats_rollups()
 
     resp = VoiceResponse()
 
     if call_data['status'] == 'busy':
-        play_or_say(resp, campaign.audio('msg_target_busy'),
-            title=current_target.title,
-            name=current_target.name,
-            lang=campaign.language_code)
+        messages.append(resp, 'msg_target_busy',
+            title=current_call.title,
+            name=current_call.name)
 
     # TODO if district offices, try another office number
 
-    i = int(request.values.get('call_index', 0))
-
-    if i == len(params['targetIds']) - 1:
+    if plan.is_last(i):
         # thank you for calling message
-        play_or_say(resp, campaign.audio('msg_final_thanks'),
-            lang=campaign.language_code)
+        messages.append(resp, 'msg_final_thanks')
     else:
         # call the next target
-        params['call_index'] = i + 1  # increment the call counter
-        calls_left = len(params['targetIds']) - i - 1
+        calls_left = len(plan) - i - 1
 
-        play_or_say(resp, campaign.audio('msg_between_calls'),
-            calls_left=calls_left,
-            lang=campaign.language_code)
+        messages.append(resp, 'msg_between_calls', calls_left=calls_left)
 
-        resp.redirect(url_for('call.make_single', **params))
+        resp.redirect(url_for('call.make_single', **plan.url_params(i + 1)))
 
     return str(resp)
 
@@ -719,19 +658,14 @@ def status_callback():
 
     if request.values.get('CallStatus') == 'ringing':
         # update call_session with time interval calculated in Twilio queue
-        call_session = Session.query.get(request.values.get('sessionId'))
-        call_session.queue_delay = datetime.utcnow() - call_session.timestamp
-        db.session.add(call_session)
-        db.session.commit()
+        log_session_ringing(params['sessionId'])
 
     # CallDuration only present when call is complete
     # update call_session with status, duration
     if request.values.get('CallDuration'):
-        call_session = Session.query.get(request.values.get('sessionId'))
-        call_session.status = request.values.get('CallStatus', 'unknown')
-        call_session.duration = request.values.get('CallDuration', None)
-        db.session.add(call_session)
-        db.session.commit()
+        log_session_status(params['sessionId'],
+            request.values.get('CallStatus', 'unknown'),
+            request.values.get('CallDuration', None))
 
     return jsonify({
         'phoneNumber': request.values.get('To', ''),
@@ -749,32 +683,15 @@ def status_inbound():
     if not params:
         abort(400)
 
-    # find call_session from number with direction inbound that is not complete
-    # if there's more than one, get the most recent one
+    # update call_session from number with direction inbound that is not complete
+    # if there's more than one, the most recent one
     user_phone = request.values.get('From', '')
-    phone_hash = Session.hash_phone(user_phone)
-    call_session = Session.query.filter_by(
-        phone_hash=phone_hash,
-        status='initiated',
-        direction='inbound',
-        campaign_id=campaign.id,
-        location=params['userLocation']
-    ).order_by(desc(Session.timestamp)).first()
-    if call_session:
-        call_session.status = request.values.get('CallStatus', 'unknown')
-        call_session.duration = request.values.get('CallDuration', None)
-        db.session.add(call_session)
-        db.session.commit()
+    log_inbound_status(Session.hash_phone(user_phone), campaign.id, params['userLocation'],
+        request.values.get('CallStatus', 'unknown'),
+        request.values.get('CallDuration', None))
 
-        return jsonify({
-            'phoneNumber': request.values.get('From', ''),
-            'callStatus': call_session.status,
-            'campaignId': params['campaignId']
-        })
-    else:
-        return jsonify({
-            'phoneNumber': request.values.get('From', ''),
-            'callStatus': 'unknown',
-            'message': 'unable to find CallSession matching campaign, location, and phone',
-            'campaignId': params['campaignId']
-        })
+    return jsonify({
+        'phoneNumber': user_phone,
+        'callStatus': request.values.get('CallStatus', 'unknown'),
+        'campaignId': params['campaignId']
+    })
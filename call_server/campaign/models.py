@@ -1,4 +1,5 @@
 from datetime import datetime
+from collections import OrderedDict
 
 from flask import current_app, url_for
 from sqlalchemy_utils.types import phone_number, JSONType
@@ -6,7 +7,7 @@ from flask_store.sqla import FlaskStoreType
 from sqlalchemy import UniqueConstraint
 
 from ..extensions import db, cache
-from ..political_data import get_country_data, check_political_data_cache
+from ..political_data import get_country_data, check_political_data_cache_many
 from .constants import (STRING_LEN, TWILIO_SID_LENGTH, LANGUAGE_CHOICES,
                         CAMPAIGN_STATUS, STATUS_PAUSED,
                         SEGMENT_BY_CHOICES, LOCATION_CHOICES, INCLUDE_SPECIAL_CHOCIES, TARGET_OFFICE_CHOICES)
@@ -214,6 +215,17 @@ class CampaignPhoneNumber(db.Model):
     phone_id = db.Column(db.Integer, db.ForeignKey('campaign_phone.id'), unique=False)
 
 
+def value_changed(current, new):
+    "Compare a model value to political data, which has phone numbers as strings"
+    if isinstance(current, phone_number.PhoneNumber) and isinstance(new, basestring):
+        try:
+            # parse with the PhoneNumberType default region
+            return current.e164 != phone_number.PhoneNumber(new, 'US').e164
+        except phone_number.phonenumbers.NumberParseException:
+            return True
+    return current != new
+
+
 class Target(db.Model):
     __tablename__ = 'campaign_target'
 
@@ -241,54 +253,81 @@ class Target(db.Model):
             key = '%s:%s' % (prefix, uid)
         else:
             key = uid
-        t = Target.query.filter(Target.uid == key) \
-            .order_by(Target.id.desc()).first()
-        created = False
-
-        data = check_political_data_cache(key, cache)
-        offices = data.pop('offices')
-
-        if not t:
-            # create target object
-            t = Target(**data)
-            db.session.add(t)
-            created = True
-        elif data:
-            if t.uid == data.get('uid'):
-                # check for updated data, only on full cache key match
-                check_attrs = ['location', 'number']
-                for a in check_attrs:
-                    new_val = data.get(a)
-                    if new_val and getattr(t, a) != new_val:
-                        setattr(t, a, new_val)
-                        created = True
-        
-        if offices:
-            existing_target_office_uids = [o.uid for o in t.offices]
-            # need to check against existing offices, because the underlying data may have been updated
-
-            for office in offices:
-                if office.get('uid') in existing_target_office_uids:
-                    # existing office, check to update the location and type
-                    o = TargetOffice.query.filter_by(target_id=t.id, uid=office.get('uid')).first()
-                    check_attrs = ['name', 'type', 'address', 'number']
+        return cls.get_or_create_many([key], cache=cache)[0]
+
+    @classmethod
+    def get_or_create_many(cls, keys, cache=cache):
+        """
+        Resolve a list of target keys in one pass,
+        with one query, one political data cache read, and at most one commit.
+        Creates or updates targets and offices to match the political data.
+        Returns list of (target, created) in the same order as keys
+        """
+        unique_keys = list(OrderedDict.fromkeys(keys))
+        if not unique_keys:
+            return []
+
+        existing = {}
+        query = Target.query.filter(Target.uid.in_(unique_keys)) \
+            .options(db.joinedload(Target.offices)) \
+            .order_by(Target.id)
+        for t in query:
+            # last one wins, so we use the most recently created
+            existing[t.uid] = t
+
+        political_data = check_political_data_cache_many(unique_keys, cache)
+
+        resolved = {}
+        for key in unique_keys:
+            t = existing.get(key)
+            created = False
+
+            data = political_data[key]
+            offices = data.pop('offices')
+
+            if not t:
+                # create target object
+                t = Target(**data)
+                db.session.add(t)
+                created = True
+            elif data:
+                if t.uid == data.get('uid'):
+                    # check for updated data, only on full cache key match
+                    check_attrs = ['location', 'number']
                     for a in check_attrs:
-                        if getattr(o, a) != office.get(a):
-                            setattr(o, a, office.get(a))
-                            db.session.add(o)
+                        new_val = data.get(a)
+                        if new_val and value_changed(getattr(t, a), new_val):
+                            setattr(t, a, new_val)
                             created = True
-                else:
-                     # create new office object, link to target
-                    o = TargetOffice(**office)
-                    o.target = t
-                    db.session.add(o)
-                    created = True
 
-        if created:
+            if offices:
+                existing_target_offices = dict((o.uid, o) for o in t.offices)
+                # need to check against existing offices, because the underlying data may have been updated
+
+                for office in offices:
+                    if office.get('uid') in existing_target_offices:
+                        # existing office, check to update the location and type
+                        o = existing_target_offices[office.get('uid')]
+                        check_attrs = ['name', 'type', 'address', 'number']
+                        for a in check_attrs:
+                            if value_changed(getattr(o, a), office.get(a)):
+                                setattr(o, a, office.get(a))
+                                db.session.add(o)
+                                created = True
+                    else:
+                         # create new office object, link to target
+                        o = TargetOffice(**office)
+                        o.target = t
+                        db.session.add(o)
+                        created = True
+
+            resolved[key] = (t, created)
+
+        if any(created for (t, created) in resolved.values()):
             # save to db
             db.session.commit()
 
-        return t, created
+        return [resolved[key] for key in keys]
 
 
 class TargetOffice(db.Model):
@@ -0,0 +1,227 @@
+"""
+Read-only, versioned copies of campaigns for the TwiML call flow.
+
+Every Twilio webhook needs the campaign configuration, the selected audio
+recordings, phone numbers and target set. Rather than hit the database on
+each hop, we build a CampaignSnapshot once per campaign version, and keep it
+in-process and in the shared cache.
+
+The current version of each campaign is a random token stored in the cache.
+Admin views call invalidate_campaign_snapshot after saving a campaign, which
+sets a new token, so every worker rebuilds on its next request.
+"""
+
+from copy import deepcopy
+from uuid import uuid4
+
+from flask import current_app
+from sqlalchemy_utils.types import phone_number
+
+from ..extensions import db, cache
+from ..political_data import get_country_data, political_data_version
+from .constants import CAMPAIGN_STATUS
+from .models import Campaign, CampaignAudioRecording, Target
+
+KEY_VERSION = 'campaign:{campaign_id}:version'
+KEY_SNAPSHOT = 'campaign:{campaign_id}:snapshot:{version}'
+SNAPSHOT_TIMEOUT = 60*60*24  # rebuild at least daily, even if nothing changes
+
+# in-process snapshots, keyed by campaign id
+_snapshots = {}
+
+# in-process target snapshots, keyed by target key, valid for one political data version
+_targets = {}
+_targets_version = None
+
+
+class FrozenError(AttributeError):
+    pass
+
+
+class AudioSnapshot(object):
+    """Selected AudioRecording for a campaign, with its file url resolved"""
+
+    def __init__(self, recording):
+        self.key = recording.key
+        self.version = recording.version
+        self.text_to_speech = recording.text_to_speech
+        self.url = recording.file_url()
+
+    def file_url(self):
+        return self.url
+
+    def __unicode__(self):
+        return "%s v%s" % (self.key, self.version)
+
+
+class OfficeSnapshot(object):
+    """TargetOffice fields needed to dial"""
+
+    def __init__(self, office):
+        self.id = office.id
+        self.uid = office.uid
+        self.name = office.name
+        self.type = office.type
+        self.number = office.number
+
+    def phone_number(self):
+        return self.number.e164
+
+
+class TargetSnapshot(object):
+    """Target fields needed to display and dial"""
+
+    def __init__(self, target):
+        self.id = target.id
+        self.uid = target.uid
+        self.title = target.title
+        self.name = target.name
+        self.district = target.district
+        self.location = target.location
+        self.number = target.number
+        self.offices = [OfficeSnapshot(o) for o in target.offices]
+
+    def __unicode__(self):
+        return self.uid
+
+    def full_name(self):
+        return u'{} {}'.format(self.title, self.name)
+
+    def phone_number(self):
+        return self.number.e164
+
+
+class CampaignSnapshot(object):
+    """
+    Duck-types the parts of Campaign used by the call flow and political_data.lookup
+    Attributes cannot be changed once built.
+    """
+
+    FIELDS = ['id', 'name', 'country_code', 'campaign_type', 'campaign_state',
+              'campaign_subtype', 'campaign_language', 'segment_by', 'locate_by',
+              'include_special', 'target_ordering', 'target_shuffle_chamber',
+              'target_offices', 'call_maximum', 'allow_call_in', 'allow_intl_calls',
+              'prompt_schedule', 'status_code']
+
+    def __init__(self, campaign, version):
+        for field in self.FIELDS:
+            setattr(self, field, getattr(campaign, field))
+        self.version = version
+        self.embed = deepcopy(campaign.embed)
+        self.language_code = campaign.language_code
+        self.target_set = [TargetSnapshot(t) for t in campaign.target_set]
+        self._phone_numbers = [n.number for n in campaign.phone_number_set]
+        self._targets_display = campaign.targets_display()
+
+        self._audio = {}
+        selected = campaign._audio_query().options(db.joinedload(CampaignAudioRecording.recording))
+        for r in selected.all():
+            self._audio[r.recording.key] = AudioSnapshot(r.recording)
+
+        self._frozen = True
+
+    def __setattr__(self, name, value):
+        if self.__dict__.get('_frozen'):
+            raise FrozenError('CampaignSnapshot is read-only, edit the Campaign instead')
+        super(CampaignSnapshot, self).__setattr__(name, value)
+
+    def __unicode__(self):
+        return self.name
+
+    @property
+    def status(self):
+        return CAMPAIGN_STATUS.get(self.status_code, '')
+
+    def audio(self, key):
+        return self.audio_or_default(key)[0]
+
+    def has_audio(self, key='msg_intro'):
+        return not self.audio_or_default(key)[1]
+
+    def audio_or_default(self, key):
+        "Returns tuple (audio snapshot or default message, is default message)"
+        if key in self._audio:
+            return (self._audio[key], False)
+        else:
+            return (current_app.config.CAMPAIGN_MESSAGE_DEFAULTS.get(key), True)
+
+    def phone_numbers(self, region_code=None):
+        "Phone numbers for this campaign, can be limited to a specified region code (ISO-2)"
+        if region_code and not self.allow_intl_calls:
+            country_code = phone_number.phonenumbers.country_code_for_region(region_code.upper())
+            return [n.e164 for n in self._phone_numbers if n.country_code == country_code]
+        else:
+            return [n.e164 for n in self._phone_numbers]
+
+    def targets_display(self):
+        return self._targets_display
+
+    def get_country_data(self, cache=cache):
+        return get_country_data(self.country_code, cache=cache, api_cache='localmem')
+
+    def get_campaign_data(self, cache=cache):
+        country_data = self.get_country_data(cache)
+        return country_data.get_campaign_type(self.campaign_type)
+
+
+def get_campaign_snapshot(campaign_id):
+    """
+    Returns the current CampaignSnapshot for campaign_id, or None if it does not exist.
+    Costs one cache read when the in-process copy is current.
+    """
+    version_key = KEY_VERSION.format(campaign_id=campaign_id)
+    version = cache.get(version_key)
+
+    if version:
+        snapshot = _snapshots.get(campaign_id)
+        if snapshot and snapshot.version == version:
+            return snapshot
+
+        snapshot = cache.get(KEY_SNAPSHOT.format(campaign_id=campaign_id, version=version))
+        if snapshot:
+            _snapshots[campaign_id] = snapshot
+            return snapshot
+    else:
+        # first worker to get here picks the version
+        version = uuid4().hex
+        if not cache.add(version_key, version):
+            version = cache.get(version_key)
+
+    campaign = Campaign.query.get(campaign_id)
+    if not campaign:
+        return None
+
+    snapshot = CampaignSnapshot(campaign, version)
+    cache.set(KEY_SNAPSHOT.format(campaign_id=campaign_id, version=version), snapshot,
+              timeout=SNAPSHOT_TIMEOUT)
+    _snapshots[campaign_id] = snapshot
+    return snapshot
+
+
+def invalidate_campaign_snapshot(campaign_id):
+    """
+    Marks the snapshot for campaign_id as stale in every worker.
+    Call after committing changes to the campaign or its related objects.
+    """
+    cache.set(KEY_VERSION.format(campaign_id=campaign_id), uuid4().hex)
+    _snapshots.pop(campaign_id, None)
+
+
+def resolve_targets(keys):
+    """
+    Returns list of TargetSnapshots for target keys, in order.
+    Memoized per political data version, so known targets skip the database and cache.
+    Unknown targets are created or updated together with Target.get_or_create_many
+    """
+    global _targets, _targets_version
+
+    version = political_data_version()
+    if version != _targets_version:
+        _targets = {}
+        _targets_version = version
+
+    missing = [key for key in keys if key not in _targets]
+    if missing:
+        for (key, (target, created)) in zip(missing, Target.get_or_create_many(missing)):
+            _targets[key] = TargetSnapshot(target)
+    return [_targets[key] for key in keys]
@@ -12,13 +12,14 @@ from sqlalchemy.sql import func, desc
 from twilio.jwt.client import ClientCapabilityToken
 
 from ..extensions import db
-from ..political_data import COUNTRY_CHOICES
+from ..political_data import COUNTRY_CHOICES, bump_political_data_version
 from ..utils import choice_items, choice_keys, choice_values_flat, duplicate_object
 
 from .constants import EMPTY_CHOICES, STATUS_LIVE
 from .models import (Campaign, Target, CampaignTarget,
                      AudioRecording, CampaignAudioRecording,
                      TwilioPhoneNumber)
+from .snapshot import invalidate_campaign_snapshot
 from ..call.models import Call
 from ..sync.models import SyncCampaign
 from ..schedule.models import ScheduleCall
@@ -85,6 +86,7 @@ def country_type(campaign_id=None):
             campaign.campaign_language = campaign_language
             db.session.add(campaign)
             db.session.commit()
+            invalidate_campaign_snapshot(campaign.id)
             return redirect(
                 url_for('campaign.form', campaign_id=campaign.id)
             )
@@ -176,6 +178,9 @@ def form(country_code=None, campaign_type=None, campaign_id=None, campaign_langu
         setattr(campaign, 'target_set', target_list)
         db.session.add(campaign)
         db.session.commit()
+        if target_list:
+            # targets may have been edited, so resolve them again on the next call
+            bump_political_data_version()
 
         # if allow_call_in, set call_in_allowed on phone_number_set
         if campaign.allow_call_in:
@@ -185,6 +190,8 @@ def form(country_code=None, campaign_type=None, campaign_id=None, campaign_langu
             db.session.commit()
         # TODO, allow_call_in on just one number?
 
+        invalidate_campaign_snapshot(campaign.id)
+
         if edit:
             flash('Campaign updated.', 'success')
         else:
@@ -259,6 +266,7 @@ def audio(campaign_id):
 
         db.session.add(campaign)
         db.session.commit()
+        invalidate_campaign_snapshot(campaign.id)
 
         flash('Campaign audio updated.', 'success')
         return redirect(url_for('campaign.launch', campaign_id=campaign.id))
@@ -330,6 +338,7 @@ def upload_recording(campaign_id):
 
         db.session.add(campaignRecording)
         db.session.commit()
+        invalidate_campaign_snapshot(campaign.id)
 
         message = "Audio recording uploaded"
         return jsonify({'success': True, 'message': message,
@@ -359,6 +368,7 @@ def select_recording(campaign_id, recording_id):
 
     db.session.add(campaignRecording)
     db.session.commit()
+    invalidate_campaign_snapshot(campaign.id)
 
     message = "Audio recording selected"
     return jsonify({'success': True, 'message': message,
@@ -376,6 +386,7 @@ def hide_recording(campaign_id, recording_id):
     db.session.add(recording)
     db.session.add(campaignAudio)
     db.session.commit()
+    invalidate_campaign_snapshot(campaign_id)
 
     message = "Audio recording hidden"
     return jsonify({'success': True, 'message': message,
@@ -434,6 +445,7 @@ def launch(campaign_id):
             db.session.add(sync_campaign)
         
         db.session.commit()
+        invalidate_campaign_snapshot(campaign.id)
 
         flash('Campaign launched!', 'success')
         return redirect(url_for('campaign.index'))
@@ -480,6 +492,7 @@ def status(campaign_id):
         form.populate_obj(campaign)        
         db.session.add(campaign)
         db.session.commit()
+        invalidate_campaign_snapshot(campaign.id)
 
         if campaign.status in ['paused', 'archived']:
             # stop recurring outgoing calls
@@ -24,6 +24,9 @@ class DefaultConfig(object):
     CACHE_TYPE = 'simple'
     CACHE_THRESHOLD = 100000  # because we're caching political data
     CACHE_DEFAULT_TIMEOUT = 60*60*24*365*2  # there's no infinite timeout, so default to 2 year election cycle
+    # format of political data records in a redis cache, 'pickle' or 'redis_hash'
+    # run loadpoliticaldata after changing it
+    POLITICAL_DATA_STORAGE = os.environ.get('POLITICAL_DATA_STORAGE', 'pickle')
 
     CSRF_ENABLED = False
 
@@ -48,6 +51,32 @@ class DefaultConfig(object):
     # limit string must match notation like "[count] [per|/] [n (optional)] [second|minute|hour|day|month|year]""
     # from https://flask-limiter.readthedocs.io/en/stable/#rate-limit-string-notation
 
+    # seconds between queued jobs to save blocklist hit counts
+    # set to None to only save them when the admin system page is viewed
+    BLOCKLIST_FLUSH_INTERVAL = 60
+
+    # seconds between queued jobs to update call statistics rollups
+    # set to None to only queue them when statistics are requested
+    STATS_ROLLUP_INTERVAL = 60*5
+
+    # queue calls and session status from the twilio webhooks in redis, to be saved by a job
+    # set to False to save them during the request
+    CALL_LOG_WRITE_BEHIND = True
+
+    # concurrent requests to twilio while placing the scheduled calls due each minute
+    SCHEDULE_DISPATCH_WORKERS = 16
+    # register the dispatcher's cron job as callers subscribe, and from the old per-subscriber jobs
+    SCHEDULE_DISPATCH_CRON = True
+
+    # queue outbound calls in redis, to be placed by a job as fast as twilio allows
+    # set to False to place them during the request
+    DIALER_QUEUE = True
+    # twilio calls per second limits, for the account and for each number
+    DIALER_ACCOUNT_CPS = 1
+    DIALER_NUMBER_CPS = 1
+    # concurrent requests to twilio from the dialer
+    DIALER_WORKERS = 8
+
     SECRET_KEY = os.environ.get('SECRET_KEY')
 
     GEOCODE_API_KEY = os.environ.get('GEOCODE_API_KEY')
@@ -57,9 +86,18 @@ class DefaultConfig(object):
 
     LOG_PHONE_NUMBERS = True
 
+    # Fernet key to keep callers' numbers encrypted in the cache until their calls are synced to the CRM
+    # requires the cryptography package, generate with cryptography.fernet.Fernet.generate_key()
+    PHONE_VAULT_KEY = os.environ.get('PHONE_VAULT_KEY')
+    PHONE_VAULT_TTL = 60*60*24*7  # seconds
+
     MAIL_SERVER = 'localhost'
 
     CRM_INTEGRATION = os.environ.get('CRM_INTEGRATION')
+    # concurrent requests to twilio and the CRM while syncing calls
+    CRM_SYNC_WORKERS = 8
+    # seconds a sync run may take, before leaving the rest for the next hourly run
+    CRM_SYNC_TIME_LIMIT = 50*60
     if CRM_INTEGRATION == 'ActionKit':
         ACTIONKIT_DOMAIN = os.environ.get('ACTIONKIT_DOMAIN')
         ACTIONKIT_USER = os.environ.get('ACTIONKIT_USER')
@@ -180,3 +218,8 @@ class TestingConfig(DefaultConfig):
     SQLALCHEMY_DATABASE_URI = 'sqlite://'  # keep testing db in memory
     CACHE_TYPE = 'simple'
     CACHE_NO_NULL_WARNING = True
+    BLOCKLIST_FLUSH_INTERVAL = None  # tests flush hits themselves
+    STATS_ROLLUP_INTERVAL = None
+    CALL_LOG_WRITE_BEHIND = False
+    DIALER_QUEUE = False
+    SCHEDULE_DISPATCH_CRON = False
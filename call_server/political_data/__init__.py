@@ -31,10 +31,15 @@ class NoDataProviderError(Exception):
 
 
 def load_data(cache):
+    """
+    Load data for each country into a new version, activated once it passes its checks
+    Raises PoliticalDataError, leaving the active version in place, if one fails
+    """
     n = 0
     for country_code in COUNTRY_DATA.keys():
         country_data = get_country_data(country_code, cache=cache)
-        n += country_data.load_data()
+        n += country_data.load_version()
+    bump_political_data_version(cache)
     return n
 
 def get_country_data(country_code, **kwargs):
@@ -63,4 +68,5 @@ def _get_data_provider_class(country_code):
 
 # import this at the end, because it depends on get_country_data above
 from .views import political_data
-from .data_cache import check_political_data_cache
+from .data_cache import (check_political_data_cache, check_political_data_cache_many,
+    political_data_version, bump_political_data_version, reload_political_data, refresh_state_legislators)
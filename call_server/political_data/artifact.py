@@ -0,0 +1,88 @@
+"""
+Preprocessed political data, cached next to the source files it is built from.
+
+Parsing the congress-legislators YAML takes most of the time loadpoliticaldata
+spends. The parsed and trimmed data is pickled to an artifact file, with a
+hash of the sources, and loaded from there until a source file changes.
+
+File format: two pickles, a header of (magic, format version, source hash)
+and then the data, so a stale artifact is detected without unpickling it.
+"""
+
+import cPickle as pickle
+import hashlib
+import os
+import tempfile
+
+import logging
+log = logging.getLogger(__name__)
+
+ARTIFACT_DIR = 'call_server/political_data/data'
+
+MAGIC = 'CPPD'
+FORMAT_VERSION = 1
+
+
+def artifact_path(name, directory=ARTIFACT_DIR):
+    return os.path.join(directory, name + '.pickle')
+
+
+def source_hash(sources):
+    "Hash of the contents of source files, in order"
+    digest = hashlib.sha1()
+    for path in sources:
+        with open(path, 'rb') as f:
+            for chunk in iter(lambda: f.read(1 << 16), ''):
+                digest.update(chunk)
+    return digest.hexdigest()
+
+
+def read_artifact(path, expected_hash):
+    "Returns the data in an artifact built from sources with expected_hash, or None"
+    try:
+        with open(path, 'rb') as f:
+            header = pickle.load(f)
+            if header != (MAGIC, FORMAT_VERSION, expected_hash):
+                return None
+            return pickle.load(f)
+    except (IOError, EOFError, pickle.UnpicklingError, ValueError):
+        return None
+
+
+def write_artifact(path, sources_hash, data):
+    """
+    Write data to an artifact for sources with sources_hash
+    The file is written next to the destination and renamed, so readers never see a partial artifact.
+    """
+    directory = os.path.dirname(os.path.abspath(path))
+    fd, tmp_path = tempfile.mkstemp(dir=directory, suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            pickle.dump((MAGIC, FORMAT_VERSION, sources_hash), f, pickle.HIGHEST_PROTOCOL)
+            pickle.dump(data, f, pickle.HIGHEST_PROTOCOL)
+        os.chmod(tmp_path, 0644)
+        os.rename(tmp_path, path)
+    except:
+        os.unlink(tmp_path)
+        raise
+
+
+def load_artifact(name, sources, build, directory=ARTIFACT_DIR, rebuild=False):
+    """
+    Returns data built from sources, from the artifact if they haven't changed since it was written
+    Otherwise calls build() and writes its result to the artifact
+    """
+    path = artifact_path(name, directory)
+    sources_hash = source_hash(sources)
+    if not rebuild:
+        data = read_artifact(path, sources_hash)
+        if data is not None:
+            return data
+
+    log.info('building %s from %s' % (path, ', '.join(sources)))
+    data = build()
+    try:
+        write_artifact(path, sources_hash, data)
+    except (IOError, OSError), e:
+        log.warning('unable to write %s: %s' % (path, e))
+    return data
@@ -0,0 +1,156 @@
+"""
+Offline point in polygon lookups for electoral district boundaries.
+
+A BoundaryIndex holds the polygons of a boundary set, with a grid of cells
+of CELL_SIZE degrees listing the boundaries whose bounding box overlaps
+each cell. A lookup checks the boundaries in the point's cell against their
+bounding boxes, then ray casts against their rings, so multipolygons and
+holes are handled by the even-odd rule.
+
+Indexes are built from boundary files, either a GeoJSON FeatureCollection or
+a Represent API simple_shape listing, and kept in an artifact until the file
+changes. Each process loads an index once, and reloads it if the file is
+replaced.
+"""
+
+import json
+import math
+import os
+
+from .artifact import load_artifact
+
+import logging
+log = logging.getLogger(__name__)
+
+CELL_SIZE = 0.5  # degrees
+
+
+def read_features(path):
+    """
+    Yields (properties, geometry) for each boundary in a file
+    as a GeoJSON FeatureCollection, or a Represent API list of boundaries with simple_shape
+    """
+    with open(path) as f:
+        data = json.load(f)
+    if 'features' in data:
+        for feature in data['features']:
+            yield (feature['properties'], feature['geometry'])
+    else:
+        for obj in data['objects']:
+            geometry = obj.pop('simple_shape', None) or obj.pop('shape')
+            yield (obj, geometry)
+
+
+def geometry_rings(geometry):
+    "Rings of a Polygon or MultiPolygon, as tuples of (longitude, latitude)"
+    if geometry['type'] == 'Polygon':
+        polygons = [geometry['coordinates']]
+    elif geometry['type'] == 'MultiPolygon':
+        polygons = geometry['coordinates']
+    else:
+        raise ValueError('unsupported boundary geometry %s' % geometry['type'])
+    return [tuple((float(p[0]), float(p[1])) for p in ring) for polygon in polygons for ring in polygon]
+
+
+def point_in_rings(x, y, rings):
+    "Even-odd rule, so a point in a hole of a polygon is outside it"
+    inside = False
+    for ring in rings:
+        (x1, y1) = ring[-1]
+        for (x2, y2) in ring:
+            if (y1 > y) != (y2 > y) and x < (x2 - x1) * (y - y1) / (y2 - y1) + x1:
+                inside = not inside
+            (x1, y1) = (x2, y2)
+    return inside
+
+
+class BoundaryIndex(object):
+    """Boundaries with their bounding boxes and rings, and a grid of cells to the boundaries overlapping them"""
+
+    def __init__(self, cell_size=CELL_SIZE):
+        self.cell_size = cell_size
+        self.keys = []
+        self.names = {}
+        self._bboxes = []
+        self._rings = []
+        self._grid = {}
+
+    @classmethod
+    def build(cls, boundaries, cell_size=CELL_SIZE):
+        "Build index from an iterable of (key, name, geometry)"
+        index = cls(cell_size)
+        for (key, name, geometry) in boundaries:
+            index.add(key, name, geometry)
+        return index
+
+    def __len__(self):
+        return len(self.keys)
+
+    def _cell(self, x, y):
+        return (int(math.floor(x / self.cell_size)), int(math.floor(y / self.cell_size)))
+
+    def add(self, key, name, geometry):
+        rings = [ring for ring in geometry_rings(geometry) if len(ring) > 2]
+        if not rings:
+            return
+        xs = [x for ring in rings for (x, y) in ring]
+        ys = [y for ring in rings for (x, y) in ring]
+        bbox = (min(xs), min(ys), max(xs), max(ys))
+
+        i = len(self.keys)
+        self.keys.append(key)
+        self.names[key] = name
+        self._bboxes.append(bbox)
+        self._rings.append(rings)
+
+        (x_min, y_min) = self._cell(bbox[0], bbox[1])
+        (x_max, y_max) = self._cell(bbox[2], bbox[3])
+        for cx in range(x_min, x_max + 1):
+            for cy in range(y_min, y_max + 1):
+                self._grid.setdefault((cx, cy), []).append(i)
+
+    def lookup(self, latitude, longitude):
+        "Keys of the boundaries containing a point, in the order they were added"
+        (x, y) = (float(longitude), float(latitude))
+        keys = []
+        for i in self._grid.get(self._cell(x, y), []):
+            (x_min, y_min, x_max, y_max) = self._bboxes[i]
+            if x_min <= x <= x_max and y_min <= y <= y_max and point_in_rings(x, y, self._rings[i]):
+                keys.append(self.keys[i])
+        return keys
+
+
+def load_boundary_index(name, path, describe, rebuild=False, cell_size=CELL_SIZE):
+    """
+    Returns BoundaryIndex for a boundary file, from the artifact called name next to it if the file hasn't changed
+    describe(properties) returns the (key, name) of a boundary
+    """
+    def build():
+        return BoundaryIndex.build((describe(properties) + (geometry,)
+                                    for (properties, geometry) in read_features(path)), cell_size)
+    return load_artifact(name, [path], build, directory=os.path.dirname(path), rebuild=rebuild)
+
+
+# loaded once per process, and reloaded when the boundary file is replaced
+_indexes = {}
+
+
+def get_boundary_index(name, path, describe, cell_size=CELL_SIZE):
+    """
+    Returns the shared BoundaryIndex for a boundary file in this process, or None if it isn't available
+    """
+    try:
+        mtime = os.stat(path).st_mtime
+    except OSError:
+        return None
+
+    cached = _indexes.get(path)
+    if cached is None or cached[0] != mtime:
+        try:
+            index = load_boundary_index(name, path, describe, cell_size=cell_size)
+        except (IOError, ValueError, KeyError), e:
+            # not retried until the file is replaced
+            log.error('unable to load boundaries from %s: %s' % (path, e))
+            index = None
+        cached = _indexes[path] = (mtime, index)
+    return cached[1]
@@ -1,13 +1,75 @@
-from flask import current_app
+from flask import current_app, has_app_context
 from flask_babel import gettext as _
 import werkzeug.contrib.cache
 import pickle
+import re
+
+from ..search import SearchIndex, fold
+from ..record_store import RecordStore, is_record_list
+
+KEY_ACTIVE_VERSION = 'political_data:{country_code}:active'
+KEY_LAST_VERSION = 'political_data:{country_code}:last_version'
+KEY_VERSIONS = 'political_data:{country_code}:versions'
+KEY_MANIFEST = 'political_data:{country_code}:v{version}:keys'
+KEEP_VERSIONS = 2  # the active version, and the one before for requests still reading it
+
+VERSIONED_KEY = re.compile(r'^\w+:v\d+:')
+
+
+class PoliticalDataError(Exception):
+    def __init__(self, message):
+        self.message = message
+
+
+def versioned_key(key, version, prefixes):
+    """
+    Key in the namespace of a loaded version, for keys starting with one of prefixes
+    eg us:house:CA:13 in version 3 is us:v3:house:CA:13
+    """
+    if not version or not any(key.startswith(p) for p in prefixes):
+        return key
+    (namespace, rest) = key.split(':', 1)
+    return '{}:v{}:{}'.format(namespace, version, rest)
+
+
+def unversioned_key(key):
+    "Key without the namespace of a loaded version, eg us:v3:house:CA:13 is us:house:CA:13"
+    return VERSIONED_KEY.sub(lambda m: m.group(0).split(':')[0] + ':', key)
+
+
+def active_version(cache, country_code):
+    "Version of loaded data to read, or 0 for data loaded before versions"
+    return cache.get(KEY_ACTIVE_VERSION.format(country_code=country_code)) or 0
+
+
+# loaded, but not versioned
+POLITICAL_DATA_PREFIXES = ('political_data:', 'ca:opennorth:')
+
+
+def is_political_data_key(key):
+    "Loaded political data, its versions and status"
+    return key.startswith(POLITICAL_DATA_PREFIXES) or bool(VERSIONED_KEY.match(key))
+
 
 class DataProvider(object):
     country_name = None
     campaign_types = []
 
     SORTED_SETS = []
+    SEARCH_FIELDS = []
+    KEY_SEARCH_INDEX = 'political_data:{country_code}:search'
+
+    # prefixes of keys written by load_data, which are kept in a namespace for each version
+    VERSIONED_KEYS = []
+    # prefixes of keys holding lists of records, which can be kept as redis hashes
+    RECORD_KEYS = []
+    # checks on a new version before it is activated
+    MINIMUM_RECORDS = 0
+    MINIMUM_FRACTION = 0.9  # of the records in the active version
+
+    _version = None
+    _loaded_keys = None
+    _store = None
 
     def __init__(self, **kwargs):
         pass
@@ -18,6 +80,117 @@ class DataProvider(object):
         """
         raise NotImplementedError()
 
+    def smoke_test(self):
+        """
+        Checks a lookup against newly loaded data
+        @return  True if it can be activated
+        """
+        return True
+
+    @property
+    def version(self):
+        """
+        Version of loaded data this provider reads, resolved once for its lifetime
+        so a request doesn't see a mix of versions
+        """
+        if self._version is None:
+            self._version = active_version(self._cache, self.country_code)
+        return self._version
+
+    def _key(self, key):
+        if not any(key.startswith(p) for p in self.VERSIONED_KEYS):
+            return key
+        return versioned_key(key, self.version, self.VERSIONED_KEYS)
+
+    def _redis(self):
+        if hasattr(self._cache, 'cache') and isinstance(self._cache.cache, werkzeug.contrib.cache.RedisCache):
+            return self._cache.cache._client
+        return None
+
+    def _record_store(self):
+        "RecordStore for keys in RECORD_KEYS, when POLITICAL_DATA_STORAGE keeps them as redis hashes"
+        if self._store is None:
+            redis = self._redis()
+            if (redis is not None and self.RECORD_KEYS and has_app_context()
+                    and current_app.config.get('POLITICAL_DATA_STORAGE') == 'redis_hash'):
+                self._store = RecordStore(redis, self._cache.cache.key_prefix)
+            else:
+                self._store = False
+        return self._store or None
+
+    def _is_record_key(self, key):
+        key = unversioned_key(key)
+        return any(key.startswith(p) for p in self.RECORD_KEYS)
+
+    def load_version(self):
+        """
+        Loads data into the namespace of a new version, checks it, then activates it
+        Lookups keep reading the previous version until then. Older versions are removed.
+        Raises PoliticalDataError if the new version fails its checks
+        @return  number of records loaded
+        """
+        if not self.VERSIONED_KEYS:
+            return self.load_data()
+
+        previous = self.version
+        version = max(self._cache.get(KEY_LAST_VERSION.format(country_code=self.country_code)) or 0, previous) + 1
+        self.cache_set(KEY_LAST_VERSION.format(country_code=self.country_code), version)
+        self._version = version
+        self._loaded_keys = set()
+        try:
+            n = self.load_data()
+            self.validate(previous)
+        except:
+            self.remove_version(version, self._loaded_keys)
+            self._version = previous
+            raise
+        finally:
+            loaded_keys = self._loaded_keys
+            self._loaded_keys = None
+
+        self.cache_set(KEY_MANIFEST.format(country_code=self.country_code, version=version), sorted(loaded_keys))
+        self.activate(version)
+        return n
+
+    def validate(self, previous):
+        """
+        Checks the version being loaded has enough records, compared to the previous version,
+        and passes the smoke test lookup
+        """
+        count = len(self._loaded_keys)
+        previous_keys = self._cache.get(KEY_MANIFEST.format(country_code=self.country_code, version=previous))
+        if count < self.MINIMUM_RECORDS:
+            raise PoliticalDataError('loaded %d records for %s, expected at least %d' % (
+                count, self.country_code, self.MINIMUM_RECORDS))
+        if previous_keys and count < len(previous_keys) * self.MINIMUM_FRACTION:
+            raise PoliticalDataError('loaded %d records for %s, down from %d in version %d' % (
+                count, self.country_code, len(previous_keys), previous))
+        if not self.smoke_test():
+            raise PoliticalDataError('smoke test lookup failed for %s version %d' % (self.country_code, self.version))
+
+    def activate(self, version):
+        """
+        Points lookups at version, with a single cache write, and removes older versions
+        """
+        self.cache_set(KEY_ACTIVE_VERSION.format(country_code=self.country_code), version)
+        self._version = version
+
+        versions = (self._cache.get(KEY_VERSIONS.format(country_code=self.country_code)) or []) + [version]
+        for old in versions[:-KEEP_VERSIONS]:
+            self.remove_version(old)
+        self.cache_set(KEY_VERSIONS.format(country_code=self.country_code), versions[-KEEP_VERSIONS:])
+
+    def remove_version(self, version, keys=None):
+        "Deletes the keys of a loaded version, listed in its manifest"
+        manifest_key = KEY_MANIFEST.format(country_code=self.country_code, version=version)
+        if keys is None:
+            keys = self._cache.get(manifest_key) or []
+        self.cache_delete_many([versioned_key(k, version, self.VERSIONED_KEYS) for k in keys] + [manifest_key])
+
+        redis = self._redis()
+        if redis and self.SORTED_SETS:
+            redis.delete(*[versioned_key(s, version, self.VERSIONED_KEYS) for s in self.SORTED_SETS])
+
     def get_location(self, locate_by, raw):
         """
         @return  a location within the country using the given raw input
@@ -37,12 +210,50 @@ class DataProvider(object):
         Checks for key in cache and returns it, or default
         This is needed because werkzeug caches don't return defaults like dicts do
         """
-        return self._cache.get(key) or default
+        if self._record_store() and self._is_record_key(key):
+            return self.cache_get_many([key], default)[key]
+        return self._cache.get(self._key(key)) or default
 
-    def cache_set(self, key, value):
-        """ Add a new key/value to the cache """
-        if hasattr(self._cache, 'set'):
-            self._cache.set(key, value)
+    def cache_get_many(self, keys, default=list(), fields=None):
+        """
+        Gets multiple keys in a single round trip, and returns a dict of key to value or default
+        With fields, records kept as redis hashes are read with only those fields
+        Handles difference between flask-cache and mock-dictionary
+        """
+        if not keys:
+            return {}
+        cache_keys = [self._key(key) for key in keys]
+        store = self._record_store()
+        stored = {}
+        if store:
+            stored = store.get_many([k for k in cache_keys if self._is_record_key(k)], fields)
+        # and pickled values, for other keys
+        other_keys = [k for k in cache_keys if k not in stored]
+        if not other_keys:
+            values = []
+        elif hasattr(self._cache, 'get_many'):
+            values = self._cache.get_many(*other_keys)
+        elif hasattr(self._cache, 'get'):
+            values = [self._cache.get(key) for key in other_keys]
+        else:
+            raise AttributeError('cache does not appear to be dict-like')
+        stored.update(zip(other_keys, values))
+        return dict((key, stored[cache_key] or default) for (key, cache_key) in zip(keys, cache_keys))
+
+    def _loaded(self, keys):
+        # keys written to the version being loaded, for its manifest
+        if self._loaded_keys is not None:
+            self._loaded_keys.update(k for k in keys if self._key(k) != k)
+
+    def cache_set(self, key, value, timeout=None):
+        """ Add a new key/value to the cache, timeout is ignored by mock-dictionary """
+        self._loaded([key])
+        key = self._key(key)
+        store = self._record_store()
+        if store and self._is_record_key(key) and is_record_list(value):
+            store.set_many({key: value})
+        elif hasattr(self._cache, 'set'):
+            self._cache.set(key, value, timeout=timeout)
         elif hasattr(self._cache, 'update'):
             self._cache.update({key:value})
         else:
@@ -53,6 +264,16 @@ class DataProvider(object):
         Sets multiple keys and values from a mapping.
         Handles difference between flask-cache and mock-dictionary
         """
+        self._loaded(mapping.keys())
+        mapping = dict((self._key(k), v) for (k, v) in mapping.items())
+        store = self._record_store()
+        if store:
+            records = dict((k, v) for (k, v) in mapping.items() if self._is_record_key(k) and is_record_list(v))
+            if records:
+                store.set_many(records)
+                mapping = dict((k, v) for (k, v) in mapping.items() if k not in records)
+            if not mapping:
+                return
         if hasattr(self._cache, 'set_many'):
             self._cache.set_many(mapping)
         elif hasattr(self._cache, 'update'):
@@ -60,13 +281,80 @@ class DataProvider(object):
         else:
             raise AttributeError('cache does not appear to be dict-like')
 
-    def cache_search(self, key_starts_with):
+    def cache_delete_many(self, keys):
+        """
+        Deletes keys as they are in the cache, without resolving versions
+        Handles difference between flask-cache and mock-dictionary
+        """
+        if not keys:
+            return
+        if hasattr(self._cache, 'delete_many'):
+            self._cache.delete_many(*keys)
+        elif hasattr(self._cache, 'pop'):
+            for key in keys:
+                self._cache.pop(key, None)
+        else:
+            raise AttributeError('cache does not appear to be dict-like')
+
+    def cache_set_search_index(self, mapping):
+        """
+        Build search index over keys starting with one of SORTED_SETS,
+        and their record fields in SEARCH_FIELDS, and store it in the cache
+        """
+        searchable_items = [(key, records) for (key, records) in mapping.items()
+                            if any(key.startswith(s) for s in self.SORTED_SETS)]
+        index = SearchIndex.build(searchable_items, self.SEARCH_FIELDS)
+        self.cache_set(self.KEY_SEARCH_INDEX.format(country_code=self.country_code), index)
+        return index
+
+    def cache_search(self, key_starts_with, filters=None):
+        """
+        Searches for records under keys starting with a name
+        Filters is a list of (field, value), matched by prefix ignoring case and accents
+        Uses the search index built at load_data, and falls back to key scan for unindexed keys
         """
-        Searches for keys starting with a name
+        filters = filters or []
+        index = None
+        if any(key_starts_with.startswith(s) for s in self.SORTED_SETS):
+            index = self.cache_get(self.KEY_SEARCH_INDEX.format(country_code=self.country_code), None)
+
+        if index is not None:
+            indexed_filters = [(field, value) for (field, value) in filters if index.has_field(field)]
+            other_filters = [(field, value) for (field, value) in filters if not index.has_field(field)]
+
+            matches = index.search(key_starts_with, indexed_filters)
+            records = self.cache_get_many(sorted(set(key for (key, position) in matches)))
+            result = []
+            for (key, position) in matches:
+                if position is None:
+                    result.extend(records[key])
+                elif position < len(records[key]):
+                    result.append(records[key][position])
+        else:
+            other_filters = filters
+            result = self._cache_scan(key_starts_with)
+
+        for (field, value) in other_filters:
+            value = fold(value)
+            result = [d for d in result if d.get(field) and fold(d[field]).startswith(value)]
+        return result
+
+    def _cache_scan(self, key_starts_with):
+        """
+        Searches for keys starting with a name, without an index
         Handles difference between flask-cache and mock-dictionary
         """
         result = []
-        if isinstance(self._cache.cache, werkzeug.contrib.cache.RedisCache):
+        # keys as they are in the cache, in the namespace of the version being read
+        cache_starts_with = self._key(key_starts_with)
+        if isinstance(self._cache, dict):
+            for (k,v) in self._cache.items():
+                if k.startswith(cache_starts_with):
+                    if isinstance(v, list):
+                        result.extend(v)
+                    else:
+                        result.append(v)
+        elif isinstance(self._cache.cache, werkzeug.contrib.cache.RedisCache):
             redis = self._cache.cache._client
 
             # check sorted sets first
@@ -75,21 +363,21 @@ class DataProvider(object):
                     # weird redis syntax for min/max
                     min_val = u'[' + key_starts_with
                     max_val = u'(' + key_starts_with + u'\xff'
-                    matching_keys = redis.zrangebylex(s, min_val, max_val)
+                    matching_keys = redis.zrangebylex(self._key(s), min_val, max_val)
                     for key in matching_keys:
                         result.extend(self.cache_get(key))
 
             # fall back on key scan
             # can be fairly slow (3-4s for full scan)
             if not result:
-                key_scan = current_app.config['CACHE_KEY_PREFIX'] + key_starts_with + '*'
+                key_scan = current_app.config['CACHE_KEY_PREFIX'] + cache_starts_with + '*'
                 for prefixed_key in redis.scan_iter(match=key_scan):
                     key = prefixed_key.replace(current_app.config['CACHE_KEY_PREFIX'], '')
                     result.extend(self.cache_get(key))
         elif isinstance(self._cache.cache, werkzeug.contrib.cache.SimpleCache):
             # naively search across all the keys
             for (k,v) in self._cache.cache._cache.items():
-                if k.startswith(key_starts_with):
+                if k.startswith(cache_starts_with):
                     wet_value = pickle.loads(v[1])
                     if isinstance(wet_value, list):
                         result.extend(wet_value)
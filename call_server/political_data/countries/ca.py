@@ -1,15 +1,27 @@
 from flask_babel import gettext as _
+from datetime import datetime
+import csv
 
 import represent
 from . import DataProvider, CampaignType
 
+from ..boundaries import get_boundary_index
 from ..geocode import Geocoder, LocationError
+from ..search import fold
 from ..constants import CA_PROVINCE_ABBR_DICT
 from ...campaign.constants import (LOCATION_POSTAL, LOCATION_ADDRESS, LOCATION_LATLON)
 
 import logging
 log = logging.getLogger(__name__)
 
+def decode_csv_value(value):
+    # Represent's CSV downloads have been in UTF-8 and in Windows-1252
+    try:
+        return value.decode('utf-8')
+    except UnicodeDecodeError:
+        return value.decode('cp1252')
+
+
 class CACampaignType(CampaignType):
     pass
 
@@ -159,6 +171,14 @@ class CADataProvider(DataProvider):
 
     KEY_OPENNORTH = 'ca:opennorth:{boundary}'
 
+    # local files for representative sets, downloaded by the Makefile in political_data/data
+    # sets without them are looked up on represent.opennorth.ca
+    BOUNDARIES_FILE = 'call_server/political_data/data/ca_{body}_boundaries.json'
+    REPRESENTATIVES_FILE = 'call_server/political_data/data/ca_{body}.csv'
+    REPRESENTATIVE_SETS = ['house-of-commons'] + sorted(
+        l['body'] for l in CACampaignType_Province.provincial_legislatures.values())
+    REPRESENTATIVE_SET_NAMES = {'house-of-commons': 'House of Commons'}
+
     def __init__(self, cache, **kwargs):
         super(CADataProvider, self).__init__(**kwargs)
         self._cache = cache
@@ -175,13 +195,99 @@ class CADataProvider(DataProvider):
             return None
 
 
+    def _data_file(self, path, body_name):
+        return path.format(body=body_name.replace('-', '_'))
+
+    def _describe_boundary(self, properties):
+        # boundaries from the Represent API have their url, GeoJSON exports may name it boundary_url
+        url = properties.get('url') or properties['boundary_url']
+        return (self.boundary_url_to_key(url), properties.get('name'))
+
+    def get_boundary_index(self, body_name):
+        """
+        BoundaryIndex of ridings for a representative set, or None without a local boundary file
+        """
+        path = self._data_file(self.BOUNDARIES_FILE, body_name)
+        return get_boundary_index('ca_%s_boundaries' % body_name.replace('-', '_'), path, self._describe_boundary)
+
+    def _load_representatives(self, body_name, index):
+        """
+        Load representatives for a set from its Represent CSV, matched to ridings in index by district name
+        Returns a dictionary keyed by boundary, in the same format as responses from represent.opennorth.ca
+
+        eg ca:opennorth:federal-electoral-districts:59001 = {'name': 'Ed Fast', 'elected_office': 'MP', ...}
+        """
+        boundaries = dict((fold(name), key) for (key, name) in index.names.items() if name)
+        representatives = {}
+
+        with open(self._data_file(self.REPRESENTATIVES_FILE, body_name)) as f:
+            reader = csv.reader(f)
+            header = next(reader)
+            for row in reader:
+                row = [decode_csv_value(value) for value in row]
+                fields = dict(zip(header[:16], row[:16]))
+                boundary_key = boundaries.get(fold(fields['District name']))
+                if not boundary_key:
+                    log.warning(u'no boundary for {} district {}'.format(body_name, fields['District name']))
+                    continue
+
+                # then groups of office type, address, phone and fax
+                offices = []
+                for i in range(16, len(row) - 3, 4):
+                    (office_type, postal, tel, fax) = row[i:i+4]
+                    if not office_type:
+                        continue
+                    office = {'type': office_type}
+                    for (field, value) in (('postal', postal), ('tel', tel), ('fax', fax)):
+                        if value:
+                            office[field] = value
+                    offices.append(office)
+
+                rep = {
+                    'name': fields['Name'],
+                    'district_name': fields['District name'],
+                    'elected_office': fields['Primary role'],
+                    'party_name': fields['Party name'],
+                    'email': fields['Email'],
+                    'photo_url': fields['Photo URL'],
+                    'source_url': fields['Source URL'],
+                    'personal_url': fields['Website'],
+                    'offices': offices,
+                    'boundary_key': boundary_key,
+                    'cache_key': self.KEY_OPENNORTH.format(boundary=boundary_key),
+                }
+                if fields['First name'] and fields['Last name']:
+                    rep['first_name'] = fields['First name']
+                    rep['last_name'] = fields['Last name']
+                if body_name in self.REPRESENTATIVE_SET_NAMES:
+                    rep['representative_set_name'] = self.REPRESENTATIVE_SET_NAMES[body_name]
+                representatives[rep['cache_key']] = rep
+
+        return representatives
+
     def load_data(self):
-        # we don't have an easy mapping of postcode to riding
-        # so just hit OpenNorth with every request and cache responses
-        log.info('no data to load for political_data.countries.ca')
-        self.cache_set('political_data:ca', ['data sourced from represent.opennorth.ca',])
-        return 0
-        
+        """
+        Load representatives for sets with local boundary files, so their ridings are found offline
+        Other sets are looked up on OpenNorth for each request, and the responses cached
+        """
+        success = []
+        n = 0
+        for body_name in self.REPRESENTATIVE_SETS:
+            index = self.get_boundary_index(body_name)
+            if index is None:
+                continue
+            representatives = self._load_representatives(body_name, index)
+            self.cache_set_many(representatives)
+            success.append("%s %s ridings, %s representatives" % (len(index), body_name, len(representatives)))
+            n += len(representatives)
+
+        if not success:
+            log.info('no data to load for political_data.countries.ca')
+        success.append('other data sourced from represent.opennorth.ca')
+        success.append("at %s" % datetime.now())
+        self.cache_set('political_data:ca', success)
+        return n
+
 
     # convenience methods for easy district access
     def get_executive(self):
@@ -198,6 +304,17 @@ class CADataProvider(DataProvider):
         if not location or not (location.latitude and location.longitude):
             raise LocationError('CADataProvider.get_representatives requires location with lat/lon')
 
+        index = self.get_boundary_index(body_name)
+        if index is not None:
+            keys = [self.KEY_OPENNORTH.format(boundary=boundary)
+                    for boundary in index.lookup(location.latitude, location.longitude)]
+            # ridings without a loaded representative are vacant
+            representatives = self.cache_get_many(keys, default=None)
+            found = [key for key in keys if representatives[key]]
+            if found:
+                return found
+            # or the representatives aren't loaded yet, or were cleared, so ask represent
+
         point = "{},{}".format(location.latitude, location.longitude)
         reps = represent.representative(point=point, repr_set=body_name)
         # add throttle=False here to avoid rate limits
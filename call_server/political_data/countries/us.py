@@ -1,11 +1,13 @@
-import werkzeug.contrib.cache
 from flask_babel import gettext as _
-from graphqlclient import GraphQLClient
 
 from . import DataProvider, CampaignType
 
 from ..geocode import Geocoder, LocationError
-from ..constants import US_STATES
+from ..district_index import build_district_index, get_district_index
+from ..artifact import load_artifact
+from ..boundaries import get_boundary_index
+from ..openstates import get_openstates_client, round_latlon, OpenStatesError
+from ..constants import US_STATES, US_STATE_FIPS
 from ...campaign.constants import (LOCATION_POSTAL, LOCATION_ADDRESS, LOCATION_LATLON)
 from ...utils import ocd_field
 
@@ -13,7 +15,6 @@ import os
 import random
 import csv
 import yaml
-import json
 import collections
 from datetime import datetime
 import logging
@@ -74,12 +75,17 @@ class USCampaignType_Congress(USCampaignType):
     def region_choices(self):
         return US_STATES
 
+    # record fields needed to pick targets
+    TARGET_FIELDS = ['bioguide_id', 'party']
+
     def all_targets(self, location, campaign_region=None):
+        # fetch all legislator records for this location in one cache round trip
+        senators, representatives = self.data_provider.get_congress_members(location.postal, self.TARGET_FIELDS)
         return {
-            'upper': self._get_senators(location),
-            'lower': self._get_representative(location),
-            'republicans': self._get_congress_party(location, 'Republican'),
-            'democrats': self._get_congress_party(location, 'Democrat'),
+            'upper': self._get_target_keys(senators),
+            'lower': self._get_target_keys(representatives),
+            'republicans': self._get_target_keys(senators + representatives, 'Republican'),
+            'democrats': self._get_target_keys(senators + representatives, 'Democrat'),
         }
 
     def sort_targets(self, targets, subtype, order, shuffle_chamber=True):
@@ -109,40 +115,9 @@ class USCampaignType_Congress(USCampaignType):
         elif subtype == 'exec':
             return exec_targets
 
-    def _get_senators(self, location):
-        districts = self.data_provider.get_districts(location.postal)
-        # This is a set because zipcodes may cross states
-        states = set(d['state'] for d in districts)
-
-        for state in states:
-            for senator in self.data_provider.get_senators(state):
-                yield self.data_provider.KEY_BIOGUIDE.format(**senator)
-
-    def _get_representative(self, location):
-        districts = self.data_provider.get_districts(location.postal)
-
-        for district in districts:
-            rep = self.data_provider.get_house_members(district['state'], district['house_district'])
-            if rep:
-                yield self.data_provider.KEY_BIOGUIDE.format(**rep[0])
-
-    def _get_congress_party(self, location, party):
-        districts = self.data_provider.get_districts(location.postal)
-        # This is a set because zipcodes may cross states
-        states = set(d['state'] for d in districts)
-
-        matched_party = []
-
-        for state in states:
-            for senator in self.data_provider.get_senators(state):
-                if senator.get('party') == party:
-                    matched_party.append(self.data_provider.KEY_BIOGUIDE.format(**senator))
-
-        for district in districts:
-            rep = self.data_provider.get_house_members(district['state'], district['house_district'])
-            if rep and rep[0].get('party') == party:
-                matched_party.append(self.data_provider.KEY_BIOGUIDE.format(**rep[0]))
-        return matched_party
+    def _get_target_keys(self, legislators, party=None):
+        return [self.data_provider.KEY_BIOGUIDE.format(**l) for l in legislators
+                if party is None or l.get('party') == party]
 
 
 class USCampaignType_State(USCampaignType):
@@ -236,17 +211,27 @@ class USDataProvider(DataProvider):
     KEY_HOUSE = 'us:house:{state}:{district}'
     KEY_SENATE = 'us:senate:{state}'
     KEY_OPENSTATES = 'us_state:openstates:{id}'
+    KEY_STATE_LOCATION = 'us_state:location:{latitude:.3f},{longitude:.3f}'
     KEY_GOVERNOR = 'us_state:governor:{state}'
     KEY_ZIPCODE = 'us:zipcode:{zipcode}'
+    KEY_STATE_ZIPCODE = 'us_state:zipcode:{zipcode}'
+    KEY_STATE_DIVISION = 'us_state:division:{division}'
+    KEY_STATE_DIVISIONS = 'us_state:divisions:{state}'
 
     SORTED_SETS = ['us:house', 'us:senate', 'us_state:governor']
+    SEARCH_FIELDS = ['state', 'chamber', 'last_name', 'first_name']
+
+    RECORD_KEYS = ['us:bioguide', 'us:house', 'us:senate', 'us:zipcode', 'us_state:governor']
+    VERSIONED_KEYS = RECORD_KEYS + ['us_state:zipcode', 'political_data:us:search']
+    MINIMUM_RECORDS = 30000
+    SMOKE_TEST_ZIPCODE = '94612'
 
     def __init__(self, cache, api_cache=None, **kwargs):
         super(USDataProvider, self).__init__(**kwargs)
         self._cache = cache
+        self._districts = {}
         self._geocoder = Geocoder(country='US')
-        self._openstates = GraphQLClient('https://openstates.org/graphql')
-        self._openstates.inject_token(os.environ.get('OPENSTATES_API_KEY'), 'x-api-key')
+        self._openstates = get_openstates_client()
 
     def get_location(self, locate_by, raw, ignore_local_cache=False):
         if locate_by == LOCATION_POSTAL:
@@ -264,10 +249,64 @@ class USDataProvider(DataProvider):
         else:
             return None
 
+    LEGISLATOR_SOURCES = ['call_server/political_data/data/us_congress_current.yaml',
+                          'call_server/political_data/data/us_congress_historical.yaml',
+                          'call_server/political_data/data/us_congress_offices.yaml']
+    LEGISLATOR_FIELDS = ('first_name', 'last_name', 'bioguide_id', 'type', 'state', 'district', 'party',
+                         'start', 'end', 'phone', 'previous_phone')
+
+    def _parse_legislators(self):
+        """
+        Parse legislators from LEGISLATOR_SOURCES, for the us_congress artifact
+        Returns a dictionary of legislators, as tuples of LEGISLATOR_FIELDS for their last term,
+        and district offices keyed by bioguide id
+        """
+        legislators = []
+        offices = {}
+
+        with open(self.LEGISLATOR_SOURCES[0]) as f1, \
+            open(self.LEGISLATOR_SOURCES[1]) as f2, \
+            open(self.LEGISLATOR_SOURCES[2]) as f3:
+
+            current_leg = yaml.load(f1, Loader=yamlLoader)
+            historical_leg = yaml.load(f2, Loader=yamlLoader)
+            office_info = yaml.load(f3, Loader=yamlLoader)
+
+        for info in office_info:
+            offices[info['id']['bioguide']] = info.get('offices', [])
+
+        for info in current_leg+historical_leg:
+            term = info['terms'][-1]
+            if term['start'] < "2015-01-01":
+                continue # skip loading historical data
+                # set this to be before the start date of the oldest currently seated Senate class
+
+            # for re-elected incumbents without a phone in their new term
+            previous_phone = None
+            if len(info['terms']) > 1 and info['terms'][-2]['type'] == term['type']:
+                previous_phone = info['terms'][-2].get('phone')
+
+            legislators.append((
+                info['name']['first'],
+                info['name']['last'],
+                info['id']['bioguide'],
+                term['type'],
+                term['state'],
+                str(term['district']) if term.has_key('district') else None,
+                term['party'],
+                term['start'],
+                term['end'],
+                term.get('phone'),
+                previous_phone,
+            ))
+
+        return {'legislators': legislators, 'offices': offices}
+
     def _load_legislators(self):
         """
         Load US legislator data from us_congress_current.yaml
         Merges with district office data from us_congress_offices.yaml by bioguide id
+        The parsed files are kept in the us_congress artifact until they change
         Returns a dictionary keyed by state, district and bioguide id
 
         eg us:senate:CA = [{'title':'Sen', 'first_name':'Dianne',  'last_name': 'Feinstein', ...},
@@ -276,72 +315,50 @@ class USDataProvider(DataProvider):
         or us:bioguide:F000062 = [{'title':'Sen', 'first_name':'Dianne',  'last_name': 'Feinstein', ...}]
         """
         legislators = collections.defaultdict(list)
-        offices = collections.defaultdict(list)
-
-        with open('call_server/political_data/data/us_congress_current.yaml') as f1, \
-            open('call_server/political_data/data/us_congress_historical.yaml') as f2, \
-            open('call_server/political_data/data/us_congress_offices.yaml') as f3:
-
-            current_leg = yaml.load(f1, Loader=yamlLoader)
-            historical_leg = yaml.load(f2, Loader=yamlLoader)
-            office_info = yaml.load(f3, Loader=yamlLoader)
-
-            for info in office_info:
-                id = info['id']['bioguide']
-                offices[id] = info.get('offices', [])
-
-            for info in current_leg+historical_leg:
-                term = info['terms'][-1]
-                if term['start'] < "2015-01-01":
-                    continue # skip loading historical data
-                    # set this to be before the start date of the oldest currently seated Senate class
-
-                term['current'] = (term['end'] >= datetime.now().strftime('%Y-%m-%d'))
-
-                if term.get('phone') is None:
-                    term['name'] = info['name']['last']
-                    if term['current']:
-                        # try to pull from previous term, for re-elected incumbents
-                        try:
-                            prev_term = info['terms'][-2]
-                            old_phone = prev_term.get('phone')
-                            if old_phone and prev_term['type'] == term['type']:
-                                term['phone'] = old_phone
-                                log.info(u"pulling phone number from previous {type} term for {name}".format(**term))
-                            else:
-                                log.warning(u"term {start} - {end} does not have field phone for {type} {name}".format(**term))
-                        except IndexError:
-                            log.warning(u"term {start} - {end} does not have field phone for {type} {name}".format(**term))
+        parsed = load_artifact('us_congress', self.LEGISLATOR_SOURCES, self._parse_legislators)
+        offices = parsed['offices']
+        today = datetime.now().strftime('%Y-%m-%d')
+
+        for values in parsed['legislators']:
+            term = dict(zip(self.LEGISLATOR_FIELDS, values))
+            term['name'] = term['last_name']
+            current = (term['end'] >= today)
+
+            if term['phone'] is None:
+                if current:
+                    if term['previous_phone']:
+                        term['phone'] = term['previous_phone']
+                        log.info(u"pulling phone number from previous {type} term for {name}".format(**term))
                     else:
-                        continue
-
-                district = str(term['district']) if term.has_key('district') else None
-
-                record = {
-                    'first_name':  info['name']['first'],
-                    'last_name':   info['name']['last'],
-                    'bioguide_id': info['id']['bioguide'],
-                    'title':       "Senator" if term['type'] == "sen" else "Representative",
-                    'phone':       term.get('phone'),
-                    'chamber':     "senate" if term['type'] == "sen" else "house",
-                    'state':       term['state'],
-                    'district':    district,
-                    'offices':     offices.get(info['id']['bioguide'], []),
-                    'current':     term['current'],
-                    'party':       term['party'],
-                }
-
-                direct_key = self.KEY_BIOGUIDE.format(**record)
-                if record['chamber'] == "senate":
-                    chamber_key = self.KEY_SENATE.format(**record)
+                        log.warning(u"term {start} - {end} does not have field phone for {type} {name}".format(**term))
                 else:
-                    chamber_key = self.KEY_HOUSE.format(**record)
+                    continue
+
+            record = {
+                'first_name':  term['first_name'],
+                'last_name':   term['last_name'],
+                'bioguide_id': term['bioguide_id'],
+                'title':       "Senator" if term['type'] == "sen" else "Representative",
+                'phone':       term['phone'],
+                'chamber':     "senate" if term['type'] == "sen" else "house",
+                'state':       term['state'],
+                'district':    term['district'],
+                'offices':     offices.get(term['bioguide_id'], []),
+                'current':     current,
+                'party':       term['party'],
+            }
+
+            direct_key = self.KEY_BIOGUIDE.format(**record)
+            if record['chamber'] == "senate":
+                chamber_key = self.KEY_SENATE.format(**record)
+            else:
+                chamber_key = self.KEY_HOUSE.format(**record)
 
-                # we want bioguide access to all recent legislators
-                legislators[direct_key].append(record)
-                # but only house or senate access to current ones
-                if term['current']:
-                    legislators[chamber_key].append(record)
+            # we want bioguide access to all recent legislators
+            legislators[direct_key].append(record)
+            # but only house or senate access to current ones
+            if current:
+                legislators[chamber_key].append(record)
 
         return legislators
 
@@ -370,6 +387,60 @@ class USDataProvider(DataProvider):
 
         return districts
 
+    # state legislative district boundaries, as GeoJSON of TIGER/Line SLDU and SLDL features,
+    # and zipcode centroids from the census gazetteer, see the Makefile in political_data/data
+    STATE_DISTRICTS_FILE = 'call_server/political_data/data/us_{chamber}.json'
+    ZCTA_CENTROIDS_FILE = 'call_server/political_data/data/us_zcta_centroids.txt'
+    STATE_CHAMBERS = ['sldu', 'sldl']
+    STATE_DISTRICT_CELL_SIZE = 0.1  # degrees, state districts are smaller than congressional ones
+    STATE_LEGISLATURES = sorted(abbr for abbr in US_STATE_FIPS.values() if abbr not in ('DC', 'PR'))
+
+    def _describe_state_district(self, properties):
+        """
+        OCD division id and name of a district, from its ocd_id property
+        or the state and district codes of a TIGER/Line feature
+        """
+        if properties.get('ocd_id'):
+            return (properties['ocd_id'], properties.get('name'))
+        state = US_STATE_FIPS[properties['STATEFP']].lower()
+        for (chamber, field) in (('sldu', 'SLDUST'), ('sldl', 'SLDLST')):
+            if properties.get(field):
+                district = properties[field].lstrip('0').lower() or '0'
+                return ('ocd-division/country:us/state:{}/{}:{}'.format(state, chamber, district),
+                        properties.get('NAMELSAD'))
+        raise KeyError('no state legislative district in %s' % properties.get('GEOID'))
+
+    def get_state_district_index(self, chamber):
+        """
+        BoundaryIndex of state legislative districts, for chamber sldu or sldl
+        or None without a local boundary file
+        """
+        return get_boundary_index('us_%s' % chamber, self.STATE_DISTRICTS_FILE.format(chamber=chamber),
+            self._describe_state_district, cell_size=self.STATE_DISTRICT_CELL_SIZE)
+
+    def _load_state_districts(self):
+        """
+        Load state legislative districts at the centroid of each zipcode, from the census gazetteer
+        Returns a dictionary keyed by zipcode, which is empty without the gazetteer or district boundaries
+
+        eg us_state:zipcode:94612 = ['ocd-division/country:us/state:ca/sldu:9', 'ocd-division/country:us/state:ca/sldl:18']
+        """
+        districts = {}
+        indexes = [self.get_state_district_index(chamber) for chamber in self.STATE_CHAMBERS]
+        indexes = [index for index in indexes if index is not None]
+        if not indexes or not os.path.exists(self.ZCTA_CENTROIDS_FILE):
+            return districts
+
+        with open(self.ZCTA_CENTROIDS_FILE) as f:
+            reader = csv.DictReader(f, delimiter='\t')
+            # the gazetteer pads its last column name
+            reader.fieldnames = [name.strip() for name in reader.fieldnames]
+            for row in reader:
+                divisions = [d for index in indexes for d in index.lookup(row['INTPTLAT'], row['INTPTLONG'])]
+                if divisions:
+                    districts[self.KEY_STATE_ZIPCODE.format(zipcode=row['GEOID'])] = divisions
+        return districts
+
     def _load_governors(self):
         """
         Load US state governor data from saved file
@@ -396,33 +467,73 @@ class USDataProvider(DataProvider):
         return governors
 
     def load_data(self):
+        self._districts = {}
         districts = self._load_districts()
         legislators = self._load_legislators()
         governors = self._load_governors()
+        state_districts = self._load_state_districts()
 
         self.cache_set_many(districts)
         self.cache_set_many(legislators)
         self.cache_set_many(governors)
+        if state_districts:
+            self.cache_set_many(state_districts)
+
+        if self._loaded_keys is None:
+            # not loading a new version, so no need to wait for it to be activated
+            self._build_district_index(districts)
+        else:
+            self._loaded_districts = districts
 
         # if cache is redis, add lexigraphical index on states, names
-        if hasattr(self._cache, 'cache') and isinstance(self._cache.cache, werkzeug.contrib.cache.RedisCache):
-            redis = self._cache.cache._client
+        redis = self._redis()
+        if redis:
             searchable_items = legislators.items() + governors.items()
             for (key,record) in searchable_items:
                 for sorted_key in self.SORTED_SETS:
                     if key.startswith(sorted_key):
-                        redis.zadd(sorted_key, key, 0)
+                        redis.zadd(self._key(sorted_key), key, 0)
+
+        # index keys and record fields for cache_search
+        searchable = dict(legislators)
+        searchable.update(governors)
+        self.cache_set_search_index(searchable)
 
         success = [
             "%s zipcodes" % len(districts),
             "%s legislators" % len(legislators),
             "%s governors" % len(governors),
+            "%s zipcodes with state districts" % len(state_districts),
+            "version %s" % self.version,
             "at %s" % datetime.now(),
         ]
         log.info('loaded %s' % ', '.join(success))
         self.cache_set('political_data:us', success)
 
-        return len(districts) + len(legislators) + len(governors)
+        return len(districts) + len(legislators) + len(governors) + len(state_districts)
+
+    def _build_district_index(self, districts):
+        # compiled index for in-process zipcode lookups
+        try:
+            build_district_index(d for zipcode_districts in districts.values() for d in zipcode_districts)
+        except (IOError, OSError), e:
+            log.warning('unable to write district index: %s' % e)
+
+    def smoke_test(self):
+        # look up congress members for a zipcode in the loaded data, without the district index
+        districts = self.cache_get(self.KEY_ZIPCODE.format(zipcode=self.SMOKE_TEST_ZIPCODE))
+        if not districts:
+            return False
+        d = districts[0]
+        return bool(self.get_senators(d['state']) and self.get_house_members(d['state'], d['house_district']))
+
+    def activate(self, version):
+        # the district index is built from the same data, so replace it along with the version
+        districts = getattr(self, '_loaded_districts', None)
+        if districts:
+            self._build_district_index(districts)
+            self._loaded_districts = None
+        super(USDataProvider, self).activate(version)
 
 
     # convenience methods for easy house, senate, district access
@@ -442,76 +553,149 @@ class USDataProvider(DataProvider):
         return self.cache_get(key)
 
     def get_districts(self, zipcode):
-        key = self.KEY_ZIPCODE.format(zipcode=zipcode)
-        return self.cache_get(key)
+        # memoized, because providers live for a single request
+        # and geocoding and target lookup both need districts
+        if zipcode not in self._districts:
+            index = get_district_index()
+            if index is not None:
+                self._districts[zipcode] = index.get(zipcode)
+            else:
+                key = self.KEY_ZIPCODE.format(zipcode=zipcode)
+                self._districts[zipcode] = self.cache_get(key)
+        return self._districts[zipcode]
+
+    def get_congress_members(self, zipcode, fields=None):
+        """
+        Get senators and house members for all districts in a zipcode, with a single cache read
+        With fields, records may only have those fields
+        Returns a tuple of lists (senators, representatives)
+        """
+        districts = self.get_districts(zipcode)
+        # This is a set because zipcodes may cross states
+        states = set(d['state'] for d in districts)
+
+        senate_keys = [self.KEY_SENATE.format(state=state) for state in states]
+        house_keys = [self.KEY_HOUSE.format(state=d['state'], district=d['house_district'])
+                      for d in districts]
+        records = self.cache_get_many(senate_keys + house_keys, fields=fields)
+
+        senators = [s for key in senate_keys for s in records[key]]
+        representatives = [records[key][0] for key in house_keys if records[key]]
+        return (senators, representatives)
 
     def get_state_governor(self, state):
         key = self.KEY_GOVERNOR.format(state=state)
         return self.cache_get(key)
 
+    def get_state_divisions(self, location):
+        """
+        OCD division ids of the state legislative districts for a location, without external calls
+        From the district boundaries for a location with lat/lon, or the zipcode table for a postal location
+        Returns an empty list if the local data doesn't cover it
+        """
+        if location.latitude and location.longitude:
+            divisions = []
+            for chamber in self.STATE_CHAMBERS:
+                index = self.get_state_district_index(chamber)
+                if index is None:
+                    return []
+                divisions.extend(index.lookup(location.latitude, location.longitude))
+            return divisions
+        if location.postal:
+            return self.cache_get(self.KEY_STATE_ZIPCODE.format(zipcode=location.postal))
+        return []
+
     def get_state_legislators(self, location):
+        # from legislators cached by district, when every district for the location has them
+        divisions = self.get_state_divisions(location)
+        if divisions:
+            keys = [self.KEY_STATE_DIVISION.format(division=d) for d in divisions]
+            by_division = self.cache_get_many(keys)
+            if all(by_division[key] for key in keys):
+                return [leg for key in keys for leg in by_division[key]]
+
+        # otherwise ask OpenStates
         if not (location.latitude and location.longitude):
             location = self.get_location(LOCATION_POSTAL, location.raw, ignore_local_cache=True)
         
         if not (location.latitude and location.longitude):
             raise LocationError('USDataProvider.get_state_legislators requires location with lat/lon')    
 
-        # execute GraphQL query to get id, name, chamber, and contactDetails
-        api_response = self._openstates.execute('''
-            { people(latitude: %f, longitude: %f, first: 100) {
-                edges {
-                  node {
-                    id
-                    name
-                    givenName
-                    familyName
-                    chamber: currentMemberships(classification:["upper", "lower"]) {
-                      post {
-                        label
-                        role
-                        division {
-                          id
-                        }
-                      }
-                      organization {
-                        name
-                        classification
-                      }
-                    }
-                    contactDetails {
-                        value
-                        note
-                        type
-                    }
-                  }
-                }
-              }
-            }''' % (location.latitude, location.longitude))
-        parsed_response = json.loads(api_response)
+        # nearby callers share cached results
+        (latitude, longitude) = round_latlon(location.latitude, location.longitude)
+        location_key = self.KEY_STATE_LOCATION.format(latitude=latitude, longitude=longitude)
+        legislators = self.cache_get(location_key, None)
+        if legislators is not None:
+            return legislators
 
-        legislators = []
-        # save results individually in local cache
-        for edge in parsed_response['data']['people']['edges']:
-            leg = edge['node']
-
-            chamber_classification = leg['chamber'][0]['organization']['classification']
-            district_label = leg['chamber'][0]['post']['label']
-            post_division = leg['chamber'][0]['post']['division']['id']
-            post_state = ocd_field(post_division, 'state').upper()
-            role_title = leg['chamber'][0]['post']['role']
-
-            leg['chamber'] = chamber_classification
-            leg['state'] = post_state
-            leg['district'] = district_label
-            leg['title'] = role_title
-
-            key = self.KEY_OPENSTATES.format(id=leg['id'])
-            leg['cache_key'] = key
-            self.cache_set(key, leg)
-            legislators.append(leg)
+        try:
+            people = self._openstates.people_by_location(latitude, longitude)
+        except OpenStatesError, e:
+            raise LocationError('unable to get state legislators from OpenStates: %s' % e)
 
+        # save results individually in local cache
+        legislators = [self._parse_state_legislator(leg) for leg in people]
+        self.cache_set_many(dict((leg['cache_key'], leg) for leg in legislators))
+        self.cache_set(location_key, legislators, timeout=self._openstates.cache_ttl)
         return legislators
 
+    def _parse_state_legislator(self, leg):
+        "Flatten OpenStates person response for our cache"
+        chamber_classification = leg['chamber'][0]['organization']['classification']
+        district_label = leg['chamber'][0]['post']['label']
+        post_division = leg['chamber'][0]['post']['division']['id']
+        post_state = ocd_field(post_division, 'state').upper()
+        role_title = leg['chamber'][0]['post']['role']
+
+        leg['chamber'] = chamber_classification
+        leg['state'] = post_state
+        leg['district'] = district_label
+        leg['title'] = role_title
+        leg['division'] = post_division
+        leg['cache_key'] = self.KEY_OPENSTATES.format(id=leg['id'])
+        return leg
+
+    def cache_state_legislators(self, people):
+        """
+        Cache state legislators from OpenStates people, individually and in lists by division id of their district
+        Each state's lists are replaced, so districts without a legislator now, like vacant seats, are removed
+        Returns number of legislators cached
+        """
+        legislators = [self._parse_state_legislator(person) for person in people if person.get('chamber')]
+        divisions = collections.defaultdict(list)
+        by_state = collections.defaultdict(set)
+        for leg in legislators:
+            key = self.KEY_STATE_DIVISION.format(division=leg['division'])
+            divisions[key].append(leg)
+            by_state[self.KEY_STATE_DIVISIONS.format(state=leg['state'])].add(key)
+
+        stale = []
+        for (state_key, keys) in by_state.items():
+            stale.extend(set(self.cache_get(state_key, [])) - keys)
+        self.cache_delete_many(stale)
+
+        self.cache_set_many(dict((leg['cache_key'], leg) for leg in legislators))
+        self.cache_set_many(dict(divisions))
+        self.cache_set_many(dict((state_key, sorted(keys)) for (state_key, keys) in by_state.items()))
+        return len(legislators)
+
+    def load_state_legislators(self):
+        """
+        Cache the current legislators of each state from OpenStates, for get_state_legislators
+        States that fail keep the legislators cached before
+        Returns number of legislators cached
+        """
+        n = 0
+        for state in self.STATE_LEGISLATURES:
+            try:
+                people = self._openstates.people_by_state(state)
+            except OpenStatesError, e:
+                log.error('unable to refresh %s legislators from OpenStates: %s' % (state, e))
+                continue
+            n += self.cache_state_legislators(people)
+        log.info('cached %d state legislators' % n)
+        return n
+
     def get_bioguide(self, bioguide):
         # try first to get from cache
         key = self.KEY_BIOGUIDE.format(bioguide_id=bioguide)
@@ -524,47 +708,7 @@ class USDataProvider(DataProvider):
         
         if not leg:
             # or lookup from openstates and save
-            api_response = self._openstates.execute('''{
-                person(id:"%s") {
-                  id
-                  name
-                  givenName
-                  familyName
-                  chamber: currentMemberships(classification:["upper", "lower"]) {
-                      post {
-                        label
-                        role
-                        division {
-                          id
-                        }
-                      }
-                      organization {
-                        name
-                        classification
-                      }
-                  }
-                  contactDetails {
-                    value
-                    note
-                    type
-                  }
-                }
-                }''' % ocd_id)
-            parsed_response = json.loads(api_response)
-            leg = parsed_response['data']['person']
-
-            chamber_classification = leg['chamber'][0]['organization']['classification']
-            district_label = leg['chamber'][0]['post']['label']
-            post_division = leg['chamber'][0]['post']['division']['id']
-            post_state = ocd_field(post_division, 'state').upper()
-            role_title = leg['chamber'][0]['post']['role']
-
-            leg['chamber'] = chamber_classification
-            leg['state'] = post_state
-            leg['district'] = district_label
-            leg['title'] = role_title
-
-            leg['cache_key'] = key
+            leg = self._parse_state_legislator(self._openstates.person(ocd_id))
             self.cache_set(key, leg)
         return leg
 
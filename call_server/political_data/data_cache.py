@@ -1,13 +1,73 @@
+from uuid import uuid4
+
 from flask import current_app
-from ..extensions import cache
+from ..extensions import cache, rq
 from ..political_data.adapters import adapt_by_key
 from countries.us import USDataProvider
 
+KEY_DATA_VERSION = 'political_data:version'
+
+
+def political_data_version(cache=cache):
+    """
+    Token which changes whenever political data or campaign targets are updated
+    Use to memoize anything derived from the political data cache
+    """
+    version = cache.get(KEY_DATA_VERSION)
+    if not version:
+        version = uuid4().hex
+        if not cache.add(KEY_DATA_VERSION, version):
+            version = cache.get(KEY_DATA_VERSION)
+    return version
+
+
+def bump_political_data_version(cache=cache):
+    cache.set(KEY_DATA_VERSION, uuid4().hex)
+
+
+@rq.job
+def reload_political_data():
+    """
+    Load political data into new versions, and activate them once they pass their checks
+    Lookups carry on reading the active versions meanwhile
+    """
+    from . import load_data
+    return load_data(cache)
+
+
+@rq.job
+def refresh_state_legislators():
+    """
+    Cache current state legislators from OpenStates by district
+    so state campaigns look them up without external calls
+    """
+    return USDataProvider(cache).load_state_legislators()
+
+
 def check_political_data_cache(key, cache=cache):
-    adapter = adapt_by_key(key)
-    adapted_key, adapter_suffix = adapter.key(key)
-    cached_obj = cache.get(adapted_key)
+    return check_political_data_cache_many([key], cache)[key]
+
+
+def check_political_data_cache_many(keys, cache=cache):
+    """
+    Adapt cached political data for a list of keys, with a single cache read
+    Returns dict of key to adapted target data
+    """
+    adapted = []
+    for key in keys:
+        adapter = adapt_by_key(key)
+        adapted_key, adapter_suffix = adapter.key(key)
+        adapted.append((key, adapter, adapted_key))
+
+    adapted_keys = list(set(a[2] for a in adapted))
+    # read by the provider, from the active version of loaded data in its storage format
+    cached_objs = USDataProvider(cache).cache_get_many(adapted_keys, default=None)
+
+    return dict((key, _adapt_cached_obj(key, adapter, adapted_key, cached_objs.get(adapted_key), cache))
+                for (key, adapter, adapted_key) in adapted)
+
 
+def _adapt_cached_obj(key, adapter, adapted_key, cached_obj, cache):
     if not cached_obj:
         # some keys may not be in our local cache
         # but may be available over external APIs
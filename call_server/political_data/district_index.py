@@ -0,0 +1,138 @@
+"""
+Compiled zipcode to congressional district index.
+
+loadpoliticaldata writes a sorted array of fixed-width records to a binary
+file, which each worker memory-maps read-only. Lookups binary search the map,
+so they skip the cache round trip and pickle load, and the pages are shared
+between all processes on the host.
+
+File format, little-endian:
+    header: magic 'CPZD', format version, record count
+    records: zipcode (uint32), state (2 chars), house district (uint8), padding
+Records are sorted by zipcode, and a zipcode that spans districts has one
+record per district, in the order they were loaded.
+"""
+
+import os
+import mmap
+import struct
+import tempfile
+
+import logging
+log = logging.getLogger(__name__)
+
+DISTRICT_INDEX_PATH = 'call_server/political_data/data/us_districts.idx'
+
+MAGIC = 'CPZD'
+FORMAT_VERSION = 1
+HEADER = struct.Struct('<4sII')
+RECORD = struct.Struct('<I2sBx')
+ZIPCODE = struct.Struct('<I')
+
+
+class DistrictIndexError(Exception):
+    pass
+
+
+def build_district_index(districts, path=DISTRICT_INDEX_PATH):
+    """
+    Write index from an iterable of district dicts, like those from USDataProvider._load_districts
+    eg [{'state':'CA', 'zipcode':'94612', 'house_district': '13'}, ...]
+    The file is written next to the destination and renamed, so readers never see a partial index.
+    Returns number of records written
+    """
+    records = []
+    for d in districts:
+        records.append((int(d['zipcode']), str(d['state']), int(d['house_district'])))
+    # stable sort keeps the load order of districts within a zipcode
+    records.sort(key=lambda r: r[0])
+
+    directory = os.path.dirname(os.path.abspath(path))
+    fd, tmp_path = tempfile.mkstemp(dir=directory, suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.write(HEADER.pack(MAGIC, FORMAT_VERSION, len(records)))
+            for r in records:
+                f.write(RECORD.pack(*r))
+        os.chmod(tmp_path, 0644)
+        os.rename(tmp_path, path)
+    except:
+        os.unlink(tmp_path)
+        raise
+    return len(records)
+
+
+class DistrictIndex(object):
+    def __init__(self, path=DISTRICT_INDEX_PATH):
+        with open(path, 'rb') as f:
+            self._map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+        if len(self._map) < HEADER.size:
+            raise DistrictIndexError('district index %s is truncated' % path)
+        magic, version, count = HEADER.unpack_from(self._map, 0)
+        if magic != MAGIC or version != FORMAT_VERSION:
+            raise DistrictIndexError('district index %s has unknown format' % path)
+        if len(self._map) != HEADER.size + count * RECORD.size:
+            raise DistrictIndexError('district index %s is truncated' % path)
+        self.count = count
+
+    def __len__(self):
+        return self.count
+
+    def _zipcode_at(self, i):
+        return ZIPCODE.unpack_from(self._map, HEADER.size + i * RECORD.size)[0]
+
+    def get(self, zipcode):
+        """
+        Returns list of districts for a 5 digit zipcode, in the same format as the cache
+        eg [{'state':'WI', 'zipcode':'53811', 'house_district': '2'}, ...]
+        """
+        if not (len(zipcode) == 5 and zipcode.isdigit()):
+            return []
+        target = int(zipcode)
+
+        # binary search for first record with this zipcode
+        lo, hi = 0, self.count
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self._zipcode_at(mid) < target:
+                lo = mid + 1
+            else:
+                hi = mid
+
+        districts = []
+        offset = HEADER.size + lo * RECORD.size
+        while lo < self.count:
+            (code, state, district) = RECORD.unpack_from(self._map, offset)
+            if code != target:
+                break
+            districts.append({'state': state, 'zipcode': zipcode, 'house_district': str(district)})
+            lo += 1
+            offset += RECORD.size
+        return districts
+
+
+# opened once per process, and reopened when loadpoliticaldata replaces the file
+_index = None
+_index_key = None
+
+
+def get_district_index(path=DISTRICT_INDEX_PATH):
+    """
+    Returns the shared DistrictIndex for this process, or None if it has not been built
+    """
+    global _index, _index_key
+
+    try:
+        key = (path, os.stat(path).st_mtime)
+    except OSError:
+        return None
+
+    if _index is None or key != _index_key:
+        try:
+            _index = DistrictIndex(path)
+            _index_key = key
+        except (IOError, DistrictIndexError), e:
+            log.error('unable to open district index: %s' % e)
+            return None
+    return _index
@@ -1,7 +1,13 @@
 import geopy
 import os
+import time
+import threading
+import collections
+
+from flask import has_app_context
 
 from constants import US_STATE_NAME_DICT, CA_PROVINCE_NAME_DICT
+from ..extensions import cache
 
 GOOGLE_SERVICE = 'GoogleV3'
 SMARTYSTREETS_SERVICE = 'LiveAddress'
@@ -136,13 +142,111 @@ class Location(geopy.Location):
 class LocationError(TypeError):
     pass
 
+
+class GeocodeCache(object):
+    """
+    Two level cache for geocoder results, an in-process LRU in front of the shared app cache.
+    Failed lookups and timeouts are cached for negative_ttl, so we don't hammer a struggling service.
+    Results are stored as tuples, because Location.__getattr__ does not survive pickling.
+    """
+
+    def __init__(self, size=5000, ttl=None, negative_ttl=300, shared_cache=cache):
+        self.size = size
+        self.ttl = ttl if ttl is not None else int(os.environ.get('GEOCODE_CACHE_TTL', 60*60*24*7))
+        self.negative_ttl = negative_ttl
+        self.shared_cache = shared_cache
+        self.stats = collections.Counter()
+        self._local = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def make_key(service, kind, query):
+        "Key on normalized address or rounded latlon, per service"
+        if isinstance(query, tuple):
+            query = '%.4f,%.4f' % (float(query[0]), float(query[1]))
+        else:
+            if isinstance(query, unicode):
+                query = query.encode('utf-8')
+            query = ' '.join(str(query).lower().replace(',', ' ').split())
+        return 'geocode:%s:%s:%s' % (service, kind, query)
+
+    def _shared(self):
+        # geocoders may be used outside of app context, eg. in manager commands
+        if self.shared_cache is not None and has_app_context():
+            return self.shared_cache
+        return None
+
+    def get(self, key):
+        "Returns cached entry, or None"
+        now = time.time()
+        with self._lock:
+            entry = self._local.pop(key, None)
+            if entry and entry[0] > now:
+                # re-insert to mark as most recently used
+                self._local[key] = entry
+                self.stats['hit'] += 1
+                return entry[1]
+
+        shared = self._shared()
+        value = shared.get(key) if shared else None
+        if value is not None:
+            self.stats['shared_hit'] += 1
+            self._set_local(key, value, self._timeout(value))
+            return value
+
+        self.stats['miss'] += 1
+        return None
+
+    def set(self, key, value):
+        timeout = self._timeout(value)
+        self._set_local(key, value, timeout)
+        shared = self._shared()
+        if shared:
+            shared.set(key, value, timeout=timeout)
+
+    def _timeout(self, value):
+        return self.negative_ttl if is_negative(value) else self.ttl
+
+    def _set_local(self, key, value, timeout):
+        with self._lock:
+            self._local.pop(key, None)
+            self._local[key] = (time.time() + timeout, value)
+            while len(self._local) > self.size:
+                self._local.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._local.clear()
+        self.stats.clear()
+
+
+def is_negative(value):
+    "Cached errors, and results without coordinates or raw fields"
+    return value[0] == 'error' or (value[2] is None and not value[4])
+
+
+def dump_location(location):
+    return ('ok', location.address, location.latitude, location.longitude, location.raw, location.service)
+
+
+def load_location(value):
+    (status, address, latitude, longitude, raw, service) = value
+    point = (latitude, longitude) if latitude is not None else None
+    location = Location(address, point, raw)
+    location.service = service
+    return location
+
+
+# shared across Geocoder instances, which are created per data provider
+geocode_cache = GeocodeCache()
+
 class Geocoder(object):
     """
     a light wrapper around the geopy client
     with configurable service name
     """
 
-    def __init__(self, API_NAME=None, API_KEY=None, country='US'):
+    def __init__(self, API_NAME=None, API_KEY=None, country='US', cache=None):
         if not (API_NAME or API_KEY):
             # get keys from os.environ, because we may not have current_app context
             API_NAME = os.environ.get('GEOCODE_PROVIDER', 'nominatim').lower()  # default to the FOSS provider
@@ -150,6 +254,7 @@ class Geocoder(object):
 
         service = geopy.geocoders.get_geocoder_for_service(API_NAME)
         self.country = country
+        self.cache = cache or geocode_cache
 
         if API_NAME == 'nominatim':
                 # nominatim sets country bias at init
@@ -183,12 +288,32 @@ class Geocoder(object):
         return self.geocode(code, postal_only=True)
 
     def geocode(self, address, postal_only=False):
-        service = self.get_service_name()
-
         if not address:
             raise LocationError('empty string passed to geocoder')
             return None
 
+        kind = 'postal' if postal_only else 'address'
+        key = self.cache.make_key(self.get_service_name(), kind, address)
+        return self._cached(key, self._geocode, address, postal_only)
+
+    def _cached(self, key, lookup, *args):
+        cached = self.cache.get(key)
+        if cached is not None:
+            if cached[0] == 'error':
+                raise geopy.exc.GeocoderServiceError(cached[1])
+            return load_location(cached)
+
+        try:
+            result = lookup(*args)
+        except geopy.exc.GeocoderServiceError, e:
+            self.cache.set(key, ('error', str(e)))
+            raise
+        self.cache.set(key, dump_location(result))
+        return result
+
+    def _geocode(self, address, postal_only=False):
+        service = self.get_service_name()
+
         try:
             if service == GOOGLE_SERVICE:
                 response = self.client.geocode(address, region=self.country)
@@ -199,6 +324,7 @@ class Geocoder(object):
                 if not response:
                     return Location()
                 intermediate = Location(response)
+                intermediate.service = service
                 if postal_only or (not intermediate.postal):
                     # nominatim doesn't give full location for lots of queries
                     # so take the response, flip it and reverse it
@@ -235,6 +361,11 @@ class Geocoder(object):
                 (lat, lon) = latlon.split(',')
             except ValueError:
                 raise ValueError('unable to parse latlon as either tuple or comma delimited string')
+
+        key = self.cache.make_key(self.get_service_name(), 'reverse', (lat, lon))
+        return self._cached(key, self._reverse, lat, lon)
+
+    def _reverse(self, lat, lon):
         located = Location(self.client.reverse((lat, lon)))
         located.service = self.get_service_name()
         return located
@@ -0,0 +1,232 @@
+"""
+Pooled client for the OpenStates GraphQL API.
+
+One client is shared per process, so connections are kept alive between
+requests. Responses are cached in-process for OPENSTATES_CACHE_TTL seconds,
+identical queries that are in flight at the same time are sent once, and
+after repeated failures the circuit opens and calls fail fast, instead of
+tying up a Twilio webhook until harakiri.
+
+Uses threading primitives, which gevent monkey-patches in production, so
+waiting callers yield to other greenlets.
+"""
+
+import os
+import json
+import time
+import threading
+
+import requests
+from requests.adapters import HTTPAdapter
+
+import logging
+log = logging.getLogger(__name__)
+
+OPENSTATES_URL = 'https://openstates.org/graphql'
+
+PERSON_FIELDS = '''
+    id
+    name
+    givenName
+    familyName
+    chamber: currentMemberships(classification:["upper", "lower"]) {
+      post {
+        label
+        role
+        division {
+          id
+        }
+      }
+      organization {
+        name
+        classification
+      }
+    }
+    contactDetails {
+      value
+      note
+      type
+    }
+'''
+
+
+class OpenStatesError(Exception):
+    pass
+
+
+class CircuitOpenError(OpenStatesError):
+    pass
+
+
+def round_latlon(latitude, longitude, precision=3):
+    "Round coordinates to about 100m, so nearby callers share a cache entry"
+    return (round(float(latitude), precision), round(float(longitude), precision))
+
+
+class _InflightQuery(object):
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class OpenStatesClient(object):
+
+    def __init__(self, api_key=None, endpoint=OPENSTATES_URL, cache_ttl=None, cache_size=10000,
+                 timeout=5, pool_size=20, failure_threshold=5, cooldown=30):
+        self.endpoint = endpoint
+        self.timeout = timeout
+        self.cache_ttl = cache_ttl if cache_ttl is not None else int(os.environ.get('OPENSTATES_CACHE_TTL', 60*60*24))
+        self.cache_size = cache_size
+        self.failure_threshold = failure_threshold
+        self.cooldown = cooldown
+
+        self.session = requests.Session()
+        self.session.headers.update({
+            'Accept': 'application/json',
+            'Content-Type': 'application/json',
+        })
+        if api_key:
+            self.session.headers['x-api-key'] = api_key
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+
+        self._lock = threading.Lock()
+        self._cache = {}  # key -> (expires, data)
+        self._inflight = {}  # key -> _InflightQuery
+        self._failures = 0
+        self._open_until = 0
+
+    def people_by_location(self, latitude, longitude):
+        "Current legislators whose districts contain a point, rounded to share cached responses"
+        (latitude, longitude) = round_latlon(latitude, longitude)
+        query = '''
+            { people(latitude: %f, longitude: %f, first: 100) {
+                edges {
+                  node { %s }
+                }
+              }
+            }''' % (latitude, longitude, PERSON_FIELDS)
+        data = self.execute(query, cache_key='location:%.3f,%.3f' % (latitude, longitude))
+        return [edge['node'] for edge in data['people']['edges']]
+
+    def people_by_state(self, state, page_size=100):
+        "Current legislators of a state, requested a page at a time, without caching"
+        people = []
+        after = ''
+        while True:
+            query = '''
+                { people(jurisdiction: "ocd-jurisdiction/country:us/state:%s/government", first: %d%s) {
+                    edges {
+                      node { %s }
+                    }
+                    pageInfo {
+                      hasNextPage
+                      endCursor
+                    }
+                  }
+                }''' % (state.lower(), page_size, after, PERSON_FIELDS)
+            data = self.execute(query)
+            people.extend(edge['node'] for edge in data['people']['edges'])
+            if not data['people']['pageInfo']['hasNextPage']:
+                return people
+            after = ', after: "%s"' % data['people']['pageInfo']['endCursor']
+
+    def person(self, ocd_id):
+        query = '''{
+            person(id:"%s") { %s }
+            }''' % (ocd_id, PERSON_FIELDS)
+        data = self.execute(query, cache_key='person:%s' % ocd_id)
+        return data['person']
+
+    def execute(self, query, cache_key=None):
+        """
+        Run a GraphQL query and return the parsed data
+        If cache_key is given, responses are cached, and concurrent queries for the same key are coalesced
+        Raises OpenStatesError
+        """
+        if not cache_key:
+            return self._post(query)
+
+        with self._lock:
+            cached = self._cache.get(cache_key)
+            if cached and cached[0] > time.time():
+                return cached[1]
+
+            inflight = self._inflight.get(cache_key)
+            leader = inflight is None
+            if leader:
+                inflight = self._inflight[cache_key] = _InflightQuery()
+
+        if not leader:
+            # another caller is already asking, wait for its answer
+            if not inflight.done.wait(self.timeout * 2):
+                raise OpenStatesError('timed out waiting for OpenStates query %s' % cache_key)
+            if inflight.error:
+                raise inflight.error
+            return inflight.result
+
+        try:
+            inflight.result = self._post(query)
+            self._cache_set(cache_key, inflight.result)
+            return inflight.result
+        except OpenStatesError, e:
+            inflight.error = e
+            raise
+        finally:
+            with self._lock:
+                self._inflight.pop(cache_key, None)
+            inflight.done.set()
+
+    def _cache_set(self, key, data):
+        now = time.time()
+        with self._lock:
+            if len(self._cache) >= self.cache_size:
+                # drop expired entries, or everything if they are all fresh
+                for k in [k for (k, (expires, _)) in self._cache.items() if expires <= now]:
+                    del self._cache[k]
+                if len(self._cache) >= self.cache_size:
+                    self._cache.clear()
+            self._cache[key] = (now + self.cache_ttl, data)
+
+    def _post(self, query):
+        if self._open_until > time.time():
+            raise CircuitOpenError('OpenStates unavailable, retrying after %ds cooldown' % self.cooldown)
+
+        try:
+            response = self.session.post(self.endpoint, data=json.dumps({'query': query}), timeout=self.timeout)
+            response.raise_for_status()
+            parsed = response.json()
+        except (requests.RequestException, ValueError), e:
+            self._record_failure()
+            raise OpenStatesError('OpenStates request failed: %s' % e)
+
+        if parsed.get('errors'):
+            # query errors are not an outage, don't count them against the circuit
+            raise OpenStatesError('OpenStates query error: %s' % parsed['errors'])
+
+        self._failures = 0
+        return parsed['data']
+
+    def _record_failure(self):
+        with self._lock:
+            self._failures += 1
+            if self._failures >= self.failure_threshold:
+                log.error('OpenStates failed %d times, pausing requests for %ds' % (self._failures, self.cooldown))
+                self._open_until = time.time() + self.cooldown
+                self._failures = 0
+
+
+_client = None
+_client_lock = threading.Lock()
+
+
+def get_openstates_client():
+    "Shared client for this process"
+    global _client
+    if _client is None:
+        with _client_lock:
+            if _client is None:
+                _client = OpenStatesClient(api_key=os.environ.get('OPENSTATES_API_KEY'))
+    return _client
@@ -0,0 +1,101 @@
+"""
+Political data records kept as redis hashes, instead of pickled lists.
+
+Each cached key holds a list of records, eg the districts for a zipcode or
+the senators for a state. With POLITICAL_DATA_STORAGE = 'redis_hash' they
+are stored as a hash of each field name to a JSON list of its values, one
+for each record, and the number of records under COUNT_FIELD. Lookups which
+only need a few fields, like bioguide_id and party, read them with HMGET,
+and reads decode JSON instead of unpickling the records.
+
+A field which only some of the records have is stored as a JSON object of
+record position to value, so records come back with the fields they had.
+"""
+
+import json
+
+from redis.exceptions import ResponseError
+
+COUNT_FIELD = '_n'
+
+
+def encode_records(records):
+    "Hash mapping for a list of record dicts"
+    fields = []
+    for record in records:
+        fields.extend(f for f in record if f not in fields)
+
+    mapping = {COUNT_FIELD: len(records)}
+    for field in fields:
+        if all(field in r for r in records):
+            column = [r[field] for r in records]
+        else:
+            column = dict((str(i), r[field]) for (i, r) in enumerate(records) if field in r)
+        mapping[field] = json.dumps(column, separators=(',', ':'))
+    return mapping
+
+
+def decode_records(count, columns):
+    "List of record dicts, from the number of records and a dict of field name to encoded column"
+    records = [{} for i in range(int(count))]
+    for (field, column) in columns.items():
+        if column is None:
+            continue
+        values = json.loads(column)
+        if isinstance(values, dict):
+            for (i, value) in values.items():
+                records[int(i)][field] = value
+        else:
+            for (record, value) in zip(records, values):
+                record[field] = value
+    return records
+
+
+def is_record_list(value):
+    return isinstance(value, list) and all(isinstance(r, dict) for r in value)
+
+
+class RecordStore(object):
+    """Reads and writes lists of records as redis hashes, with one pipeline for each batch"""
+
+    def __init__(self, redis, key_prefix=None):
+        self.redis = redis
+        self.key_prefix = key_prefix or ''
+
+    def _key(self, key):
+        return self.key_prefix + key
+
+    def set_many(self, mapping):
+        "Store lists of records from a mapping of key to records, replacing the keys"
+        pipe = self.redis.pipeline(transaction=False)
+        for (key, records) in mapping.items():
+            pipe.delete(self._key(key))
+            pipe.hmset(self._key(key), encode_records(records))
+        pipe.execute()
+
+    def get_many(self, keys, fields=None):
+        """
+        Returns dict of key to list of records, or None for missing keys
+        With fields, records only have those fields.
+        Keys holding other types, like values pickled before the store was used, are left out
+        """
+        if not keys:
+            return {}
+        pipe = self.redis.pipeline(transaction=False)
+        for key in keys:
+            if fields:
+                pipe.hmget(self._key(key), [COUNT_FIELD] + list(fields))
+            else:
+                pipe.hgetall(self._key(key))
+
+        result = {}
+        for (key, value) in zip(keys, pipe.execute(raise_on_error=False)):
+            if isinstance(value, ResponseError):
+                continue
+            if fields:
+                (count, columns) = (value[0], dict(zip(fields, value[1:])))
+            else:
+                count = value.pop(COUNT_FIELD, None)
+                columns = value
+            result[key] = decode_records(count, columns) if count is not None else None
+        return result
@@ -0,0 +1,92 @@
+"""
+Prefix search index for political data cache keys and record fields.
+
+Built by DataProvider.load_data and stored in the cache as a single value, so
+a search costs one cache read plus one get_many for the matched keys, instead
+of a scan over the keyspace.
+"""
+
+from bisect import bisect_left
+
+from ..utils import ignore_accents
+
+
+def fold(value):
+    "Normalize a value for prefix comparison, ignoring case and accents"
+    return ignore_accents(value).lower()
+
+
+def key_str(key):
+    "Cache keys are bytestrings, but may come from request args as unicode"
+    if isinstance(key, unicode):
+        return key.encode('utf-8')
+    return key
+
+
+class SearchIndex(object):
+    """
+    Sorted lists of cache keys, and of (folded value, key, position) for each field,
+    where position is the index of the record in the list cached under key.
+    """
+
+    def __init__(self, fields):
+        self.fields = list(fields)
+        self._keys = []
+        self._values = dict((field, []) for field in self.fields)
+
+    @classmethod
+    def build(cls, items, fields):
+        """
+        Build index from an iterable of (cache key, list of records)
+        """
+        index = cls(fields)
+        for (key, records) in items:
+            index._keys.append(key)
+            if not isinstance(records, list):
+                records = [records]
+            for (position, record) in enumerate(records):
+                for field in index.fields:
+                    value = record.get(field)
+                    if value and isinstance(value, basestring):
+                        index._values[field].append((fold(value), key, position))
+        index._keys.sort()
+        for values in index._values.values():
+            values.sort()
+        return index
+
+    def __len__(self):
+        return len(self._keys)
+
+    def has_field(self, field):
+        return field in self._values
+
+    def keys(self, key_starts_with):
+        "Cache keys starting with a prefix, in lexical order"
+        key_starts_with = key_str(key_starts_with)
+        start = bisect_left(self._keys, key_starts_with)
+        end = bisect_left(self._keys, key_starts_with + '\xff')
+        return self._keys[start:end]
+
+    def match(self, field, value_starts_with):
+        "Set of (key, position) for records whose field starts with value, ignoring case and accents"
+        values = self._values[field]
+        value_starts_with = fold(value_starts_with)
+        start = bisect_left(values, (value_starts_with,))
+        end = bisect_left(values, (value_starts_with + '\xff',))
+        return set((key, position) for (_, key, position) in values[start:end])
+
+    def search(self, key_starts_with, filters=None):
+        """
+        Find records under keys starting with key_starts_with, matching all (field, value) filters
+        Returns sorted list of (key, position), where position is None to include all records under key
+        """
+        key_starts_with = key_str(key_starts_with)
+        keys = self.keys(key_starts_with)
+        if not filters:
+            return [(key, None) for key in keys]
+
+        matches = None
+        for (field, value) in filters:
+            found = set(m for m in self.match(field, value) if m[0].startswith(key_starts_with))
+            matches = found if matches is None else (matches & found)
+        return sorted(matches)
@@ -2,7 +2,6 @@ from flask import (Blueprint, request, jsonify)
 from flask_login import login_required
 
 from ..extensions import cache
-from ..utils import ignore_accents
 from . import get_country_data
 
 import logging
@@ -30,19 +29,19 @@ def search():
         return jsonify({'status': 'error',
                         'message': 'no key provided'})
 
-    results = []
-    for k in keys:
-        results.extend(data_provider.cache_search(k))
-
-    filters = request.args.getlist('filter')
-    for f in filters:
+    filters = []
+    for f in request.args.getlist('filter'):
         try:
             field, value = f.split('=')
-            value = ignore_accents(value.lower()) # ensure comparison ignores accented characters
-            results = [d for d in results if ignore_accents(d[field]).lower().startswith(value)]
+            filters.append((field, value))
         except ValueError,e:
-          log.error(e)
-          continue
+            log.error(e)
+            continue
+
+    # search index ignores case and accented characters
+    results = []
+    for k in keys:
+        results.extend(data_provider.cache_search(k, filters))
 
     return jsonify({
         'status': 'ok',
@@ -0,0 +1,204 @@
+"""
+Places scheduled calls, from one job run every minute.
+
+Each run selects the subscribers due that minute in one query on
+ix_schedule_call_subscribed_time, for live campaigns only, and checks them
+against the blocklist index in memory. Sessions for all of them are inserted
+together, the calls are queued for the dialer, or placed with Twilio on a
+pool of SCHEDULE_DISPATCH_WORKERS threads without it, and the subscribers
+called are updated with one executemany.
+
+The cron job is registered by schedule_dispatcher, as callers subscribe and
+when a per-subscriber cron job from before the dispatcher runs, so calls
+don't wait on an operator running dispatch_scheduled_calls --schedule.
+
+Runs can start late, behind other jobs on the queue, so the last minute
+dispatched is kept in the cache and each run covers every minute since,
+up to CATCH_UP. One run dispatches at a time, under a cache.add lock.
+Subscribers already called that minute are skipped, so a run can be repeated.
+"""
+
+import random
+from datetime import timedelta
+from multiprocessing.pool import ThreadPool
+
+from flask import current_app
+from sqlalchemy import bindparam, or_
+from sqlalchemy_utils.types.phone_number import phonenumbers
+
+from ..extensions import db, cache, rq
+from ..utils import utc_now
+from ..admin.blocklist import get_blocklist_index, record_hits
+from ..call.models import Session
+from ..call.outbound import start_session
+from ..call import vault, dialer
+from ..campaign.constants import STATUS_LIVE
+from ..campaign.models import Campaign
+from ..campaign.snapshot import get_campaign_snapshot
+from .models import ScheduleCall
+
+WEEKDAYS = range(5)  # monday to friday
+KEY_DISPATCHED = 'schedule:dispatched_minute'
+KEY_DISPATCHING = 'schedule:dispatching'
+KEY_SCHEDULED = 'schedule:dispatcher_scheduled'
+SCHEDULED_TIMEOUT = 60*60  # registered again after this, in case the cron job was cancelled
+DISPATCHING_TIMEOUT = 60*10  # refreshed for each minute, expires if the job dies
+CATCH_UP = timedelta(hours=1)  # minutes missed before this are not called
+
+
+def due_calls(minute):
+    "Subscribers to live campaigns with a time_to_call in this minute, not yet called in it"
+    start = minute.time()
+    end = (minute + timedelta(minutes=1)).time()
+    query = (ScheduleCall.query
+        .join(Campaign, ScheduleCall.campaign_id == Campaign.id)
+        .filter(ScheduleCall.subscribed == True,
+                ScheduleCall.time_to_call >= start,
+                Campaign.status_code == STATUS_LIVE,
+                or_(ScheduleCall.last_called == None, ScheduleCall.last_called < minute)))
+    if end > start:
+        # otherwise it's the last minute of the day, which runs to midnight
+        query = query.filter(ScheduleCall.time_to_call < end)
+    return query.all()
+
+
+def _dial(app, call):
+    # workers need their own app context, for config and url_for
+    with app.app_context():
+        return dialer.place_call(call)
+
+
+def schedule_dispatcher():
+    "Register the cron job running dispatch_scheduled_calls every minute, unless registered recently"
+    if not current_app.config.get('SCHEDULE_DISPATCH_CRON'):
+        return
+    if cache.add(KEY_SCHEDULED, True, timeout=SCHEDULED_TIMEOUT):
+        dispatch_scheduled_calls.cron('* * * * *', 'schedule:dispatch_scheduled_calls')
+
+
+@rq.job
+def dispatch_scheduled_calls(now=None):
+    """
+    Place calls to subscribers due in each minute since the last run up to this one, on weekdays
+    Returns number of calls placed or queued, or 0 if another run is dispatching
+    """
+    now = now or utc_now()
+    minute = now.replace(second=0, microsecond=0)
+    if not cache.add(KEY_DISPATCHING, True, timeout=DISPATCHING_TIMEOUT):
+        current_app.logger.warning('scheduled calls for %s left to the run in progress' % minute)
+        return 0
+
+    try:
+        dispatched = cache.get(KEY_DISPATCHED)
+        start = max(dispatched + timedelta(minutes=1), minute - CATCH_UP) if dispatched else minute
+        placed = 0
+        while start <= minute:
+            cache.set(KEY_DISPATCHING, True, timeout=DISPATCHING_TIMEOUT)
+            if start.weekday() in WEEKDAYS:
+                placed += dispatch_minute(start, now)
+            cache.set(KEY_DISPATCHED, start, timeout=0)
+            start += timedelta(minutes=1)
+        return placed
+    finally:
+        cache.delete(KEY_DISPATCHING)
+
+
+def dispatch_minute(minute, now):
+    "Place calls to subscribers due in minute, returns number placed or queued"
+    blocklist = get_blocklist_index()
+    campaigns = {}
+    to_call = []
+    for scheduled_call in due_calls(minute):
+        user_phone = scheduled_call.phone_number.e164
+        user_country = phonenumbers.region_code_for_number(scheduled_call.phone_number) or 'US'
+        blocked = blocklist.match(user_phone, None, user_country)
+        if blocked:
+            # the calls are coming from inside the building...
+            record_hits(blocked, user_phone)
+            continue
+
+        if scheduled_call.campaign_id not in campaigns:
+            campaigns[scheduled_call.campaign_id] = get_campaign_snapshot(scheduled_call.campaign_id)
+        campaign = campaigns[scheduled_call.campaign_id]
+        phone_numbers = campaign.phone_numbers(user_country)
+        if not phone_numbers:
+            current_app.logger.error('no numbers available for campaign %s in %s' % (campaign.id, user_country))
+            continue
+
+        from_number = random.choice(phone_numbers)
+        call_session = start_session(campaign, user_phone, scheduled_call.location, from_number)
+        db.session.add(call_session)
+        to_call.append((scheduled_call, call_session, user_phone, from_number))
+    if not to_call:
+        return 0
+
+    # ids are assigned on flush, read them before the commit expires the objects
+    db.session.flush()
+    calls = [{
+        'scheduled_call_id': scheduled_call.id,
+        'session_id': call_session.id,
+        'user_phone': user_phone,
+        'from_number': from_number,
+        'params': {
+            'campaignId': scheduled_call.campaign_id,
+            'userPhone': user_phone,
+            'userLocation': scheduled_call.location,
+            'scheduled': True,
+            'sessionId': call_session.id,
+        },
+    } for (scheduled_call, call_session, user_phone, from_number) in to_call]
+    db.session.commit()
+    for call in calls:
+        vault.store_phone(call['session_id'], call['user_phone'])
+
+    if dialer.enabled():
+        for call in calls:
+            dialer.queue_call(call)
+        placed = [True] * len(calls)
+    else:
+        app = current_app._get_current_object()
+        pool = ThreadPool(current_app.config.get('SCHEDULE_DISPATCH_WORKERS', 16))
+        try:
+            placed = pool.map(lambda call: _dial(app, call), calls)
+        finally:
+            pool.close()
+            pool.join()
+
+    table = ScheduleCall.__table__
+    called = [{'scheduled_call_id': c['scheduled_call_id'], 'called_at': now}
+        for (c, ok) in zip(calls, placed) if ok]
+    if called:
+        db.session.execute(table.update()
+            .where(table.c.id == bindparam('scheduled_call_id'))
+            .values(num_calls=table.c.num_calls + 1, last_called=bindparam('called_at')),
+            called)
+    failed = [{'session_id': c['session_id']} for (c, ok) in zip(calls, placed) if not ok]
+    if failed:
+        sessions = Session.__table__
+        db.session.execute(sessions.update()
+            .where(sessions.c.id == bindparam('session_id'))
+            .values(status='failed'),
+            failed)
+    db.session.commit()
+    return len(called)
+
+
+def move_legacy_jobs(scheduled_calls):
+    """
+    Cancel the cron jobs that placed calls for each subscriber, keeping their location
+    Returns number of jobs cancelled
+    """
+    legacy = [sc for sc in scheduled_calls if sc.job_id]
+    if not legacy:
+        return 0
+    jobs = dict((job.id, job) for job in rq.get_scheduler().get_jobs())
+    for scheduled_call in legacy:
+        job = jobs.get(scheduled_call.job_id)
+        if job and len(job.args) > 2 and not scheduled_call.location:
+            # create_call(campaign_id, phone, location)
+            scheduled_call.location = job.args[2]
+        scheduled_call.cancel_legacy_job()
+        db.session.add(scheduled_call)
+    db.session.commit()
+    schedule_dispatcher()
+    return len(legacy)
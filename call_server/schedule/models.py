@@ -1,8 +1,3 @@
-from flask import url_for
-import requests
-import logging
-
-from ..campaign.models import Campaign
 from ..utils import utc_now
 from ..extensions import db, rq
 from sqlalchemy_utils.types import phone_number
@@ -24,8 +19,14 @@ class ScheduleCall(db.Model):
     campaign = db.relationship('Campaign', backref=db.backref('scheduled_call_subscribed', lazy='dynamic'))
 
     phone_number = db.Column(phone_number.PhoneNumberType())
+    location = db.Column(db.String(255))
+
+    job_id = db.Column(db.String(36)) # UUID4, of a cron job from before dispatch_scheduled_calls
 
-    job_id = db.Column(db.String(36)) # UUID4
+    __table_args__ = (
+        # due calls, for dispatch_scheduled_calls
+        db.Index('ix_schedule_call_subscribed_time', 'subscribed', 'time_to_call'),
+    )
 
     def __init__(self, campaign_id, phone_number, time=utc_now().time()):
         self.created_at = utc_now()
@@ -36,63 +37,44 @@ class ScheduleCall(db.Model):
     def __repr__(self):
         return u'<ScheduleCall for {} to {}>'.format(self.campaign.name, self.phone_number.e164)
 
-    @property
-    def _function_name(self):
-        return 'create_call:{campaign_id}:{phone}'.format(campaign_id=self.campaign_id, phone=self.phone_number.e164)
-
     def user_phone(self):
         return self.phone_number.e164
 
     def start_job(self, location=None):
+        # calls are placed on weekdays at time_to_call by dispatch_scheduled_calls
         self.subscribed = True
-        weekdays = 'mon,tue,wed,thu,fri'
-        minute = self.time_to_call.minute
-        hour = self.time_to_call.hour
-        # TODO, set a max limit on the number of executions?
-        crontab = '{minute} {hour} {day_of_month} {month} {days_of_week}'.format(
-            minute=minute,
-            hour=hour,
-            day_of_month='*',
-            month='*',
-            days_of_week=weekdays)
-        cron_job = create_call.cron(crontab, self._function_name, self.campaign_id, self.phone_number.e164, location)
-        self.job_id = cron_job.id
+        if location:
+            self.location = location
+        self.cancel_legacy_job()
+        from .dispatch import schedule_dispatcher
+        schedule_dispatcher()
 
     def stop_job(self):
         self.subscribed = False
-        rq.get_scheduler().cancel(self.job_id)
+        self.cancel_legacy_job()
+
+    def cancel_legacy_job(self):
+        "Cancel the cron job that used to place calls for each subscriber"
+        if self.job_id:
+            rq.get_scheduler().cancel(self.job_id)
+            self.job_id = None
+
 
 @rq.job
 def create_call(campaign_id, phone, location):
-    params = {
-        'campaignId': campaign_id,
-        'userPhone': phone,
-        'userLocation': location,
-        'scheduled': True
-    }
-    campaign = Campaign.query.get(campaign_id)
-    if campaign.status != 'live':
-        # do not place scheduled calls for paused or archived campaigns
-        return None
-
-    scheduled_call = ScheduleCall.query.filter_by(campaign_id=campaign.id, phone_number=phone, subscribed=True).first()
-    if not scheduled_call:
-        return None
-
-    from ..admin.models import Blocklist
-    if Blocklist.user_blocked(phone, user_ip=None):
-        # the calls are coming from inside the building...
-        return False
-
-    resp = requests.get(url_for('call.create', _external=True, **params))
-    if resp.status_code == 200:
-        scheduled_call.num_calls += 1
-        scheduled_call.last_called = utc_now()
+    """
+    Legacy cron job, left for subscribers not yet moved to dispatch_scheduled_calls
+    Moves the subscriber to the dispatcher with its location, makes sure the dispatcher is scheduled,
+    and dispatches the calls due now, including this one
+    """
+    from .dispatch import dispatch_scheduled_calls, schedule_dispatcher
+    scheduled_call = ScheduleCall.query.filter_by(campaign_id=campaign_id, phone_number=phone, subscribed=True).first()
+    if scheduled_call:
+        if location and not scheduled_call.location:
+            scheduled_call.location = location
+        scheduled_call.cancel_legacy_job()
         db.session.add(scheduled_call)
         db.session.commit()
-        return True
-    else:
-        # this happens outside application context, so can't get the logger from current_app
-        logger = logging.getLogger("rq.worker")
-        logger.error('unable to execute scheduled create_call: %s "%s"' % (resp.url, resp.content))
-        return False
\ No newline at end of file
+    schedule_dispatcher()
+    dispatch_scheduled_calls()
+    return None
@@ -0,0 +1,3 @@
+from .models import CallRollup, SessionRollup, SessionCallsRollup, RollupWatermark
+from .jobs import update_stats_rollups, queue_stats_rollups, refresh_stats_rollups
+from .counters import count_completed_call, get_campaign_counts, reconcile_campaign_counters
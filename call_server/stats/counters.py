@@ -0,0 +1,209 @@
+"""
+Live completed call counters per campaign, for the public count.json.
+
+complete() counts each completed call in the cache: a running total, hourly
+buckets kept for a week to sum the last day and week, and a hash of calls by
+referral code. With the redis cache these are single INCR and HINCRBY
+commands. Twilio retries the webhook, so each CallSid and target is only
+counted once, behind a marker kept for the retry window. reconcile_campaign_counters checks them against the database, and
+seeds them for campaigns that have not been counted yet. Reads never run it,
+they queue it for campaigns that are not seeded, and serve the counters as
+they are meanwhile.
+"""
+
+from datetime import datetime, timedelta
+
+from flask import current_app
+
+from ..extensions import db, cache, rq
+from ..call.models import Call, Session
+from .jobs import update_stats_rollups, hour_bucket, CALL_SETTLE
+from .models import CallRollup
+
+KEY_TOTAL = 'stats:campaign:{campaign_id}:completed'
+KEY_HOUR = 'stats:campaign:{campaign_id}:completed:{hour:%Y%m%d%H}'
+KEY_REFERRALS = 'stats:campaign:{campaign_id}:referrals'
+KEY_SEEDED = 'stats:campaign:{campaign_id}:seeded'
+KEY_COUNTED = 'stats:call:{call_id}:{target_id}:counted'
+KEY_RECONCILE_QUEUED = 'stats:campaign:{campaign_id}:reconcile_queued'
+RECONCILE_QUEUED_TIMEOUT = 60*10  # queue again if the job hasn't seeded the counters by then
+HOURS_KEPT = 24 * 8
+SEEDED_TIMEOUT = 60*60*24  # reconcile on read at least daily, if the job isn't scheduled
+REFERRAL_MINIMUM = 2  # only list referral codes with more completed calls than this
+
+
+def _redis():
+    "Redis client behind the cache, or None for other cache types"
+    return getattr(cache.cache, '_client', None)
+
+
+def _key(key):
+    return (getattr(cache.cache, 'key_prefix', None) or '') + key
+
+
+def recent_hours(now, hours):
+    "Hour buckets, from the current one back"
+    current = hour_bucket(now)
+    return [current - timedelta(hours=n) for n in range(hours)]
+
+
+def count_completed_call(campaign_id, referral_code=None, now=None, call_id=None, target_id=None):
+    "Count a completed call, called as calls are logged, once for each call_id and target_id"
+    from ..call.call_log import RETRY_WINDOW  # call_log imports the stats package
+    if call_id and not cache.add(KEY_COUNTED.format(call_id=call_id, target_id=target_id), True,
+                                 timeout=int(RETRY_WINDOW.total_seconds())):
+        return
+    hour = hour_bucket(now or datetime.utcnow())
+    hour_key = KEY_HOUR.format(campaign_id=campaign_id, hour=hour)
+
+    redis = _redis()
+    if redis:
+        pipe = redis.pipeline(transaction=False)
+        pipe.incr(_key(KEY_TOTAL.format(campaign_id=campaign_id)))
+        pipe.incr(_key(hour_key))
+        pipe.expire(_key(hour_key), HOURS_KEPT * 60 * 60)
+        if referral_code:
+            pipe.hincrby(_key(KEY_REFERRALS.format(campaign_id=campaign_id)), referral_code, 1)
+        pipe.execute()
+    else:
+        cache.cache.inc(KEY_TOTAL.format(campaign_id=campaign_id))
+        cache.cache.inc(hour_key)
+        if referral_code:
+            key = KEY_REFERRALS.format(campaign_id=campaign_id)
+            referrals = cache.get(key) or {}
+            referrals[referral_code] = referrals.get(referral_code, 0) + 1
+            cache.set(key, referrals)
+
+
+def get_referrals(campaign_id):
+    key = KEY_REFERRALS.format(campaign_id=campaign_id)
+    redis = _redis()
+    if redis:
+        return dict((code, int(n)) for (code, n) in redis.hgetall(_key(key)).items())
+    return cache.get(key) or {}
+
+
+def set_referrals(campaign_id, referrals):
+    key = KEY_REFERRALS.format(campaign_id=campaign_id)
+    redis = _redis()
+    if redis:
+        pipe = redis.pipeline()
+        pipe.delete(_key(key))
+        if referrals:
+            pipe.hmset(_key(key), referrals)
+        pipe.execute()
+    else:
+        cache.set(key, referrals)
+
+
+def get_campaign_counts(campaign_id):
+    """
+    Returns dict of completed calls for a campaign, from the counters
+    Queues a job to seed them from the database the first time
+    """
+    if not cache.get(KEY_SEEDED.format(campaign_id=campaign_id)):
+        queue_reconcile(campaign_id)
+
+    hours = recent_hours(datetime.utcnow(), 24 * 7)
+    keys = [KEY_TOTAL.format(campaign_id=campaign_id)]
+    keys.extend(KEY_HOUR.format(campaign_id=campaign_id, hour=hour) for hour in hours)
+    values = [int(v or 0) for v in cache.get_many(*keys)]
+    total, by_hour = values[0], values[1:]
+
+    referrals = get_referrals(campaign_id)
+    return {
+        'completed': total,
+        'last_24h': sum(by_hour[:24]),
+        'last_week': sum(by_hour),
+        'referral_codes': dict((code, n) for (code, n) in referrals.items() if n > REFERRAL_MINIMUM)
+    }
+
+
+def queue_reconcile(campaign_id):
+    "Queue a job to reconcile a campaign's counters, once until it runs"
+    if cache.add(KEY_RECONCILE_QUEUED.format(campaign_id=campaign_id), True, timeout=RECONCILE_QUEUED_TIMEOUT):
+        reconcile_campaign_counters.queue(campaign_id)
+
+
+def database_counts(campaign_id, now, settled_before):
+    """
+    Completed calls for a campaign, by hour for the last week, and by referral code
+    Hours from settled_before on are counted from calls, the rest from the rollups,
+    which keep their totals when old calls are archived
+    """
+    referrals = dict(db.session.query(
+        Session.referral_code,
+        db.func.count(Call.id)
+    ).join(Call).filter(
+        Call.campaign_id == campaign_id,
+        Call.status == 'completed',
+        Session.referral_code != None
+    ).group_by(Session.referral_code))
+
+    update_stats_rollups()
+    total = db.session.query(db.func.sum(CallRollup.count)).filter(
+        CallRollup.campaign_id == campaign_id,
+        CallRollup.status == 'completed',
+        CallRollup.hour < settled_before
+    ).scalar() or 0
+
+    by_hour = dict(db.session.query(CallRollup.hour, db.func.sum(CallRollup.count)).filter(
+        CallRollup.campaign_id == campaign_id,
+        CallRollup.status == 'completed',
+        CallRollup.hour >= hour_bucket(now) - timedelta(hours=HOURS_KEPT),
+        CallRollup.hour < settled_before
+    ).group_by(CallRollup.hour))
+
+    recent = db.session.query(Call.timestamp).filter(
+        Call.campaign_id == campaign_id,
+        Call.status == 'completed',
+        Call.timestamp >= settled_before
+    )
+    for (timestamp,) in recent:
+        hour = hour_bucket(timestamp)
+        by_hour[hour] = by_hour.get(hour, 0) + 1
+        total += 1
+    return total, by_hour, referrals
+
+
+@rq.job
+def reconcile_campaign_counters(campaign_id='all'):
+    """
+    Compare counters with the database, and reset any that have drifted
+    Once seeded, hours that may still have calls being logged are left alone
+    Returns number of counters reset
+    """
+    if campaign_id == 'all':
+        campaign_ids = [c for (c,) in db.session.query(Call.campaign_id).distinct() if c]
+    else:
+        campaign_ids = [campaign_id]
+
+    now = datetime.utcnow()
+    settled_before = hour_bucket(now - CALL_SETTLE)
+    reset = 0
+    for campaign_id in campaign_ids:
+        seeded = cache.get(KEY_SEEDED.format(campaign_id=campaign_id))
+        (total, by_hour, referrals) = database_counts(campaign_id, now, settled_before)
+
+        total_key = KEY_TOTAL.format(campaign_id=campaign_id)
+        expected = {total_key: total}
+        for hour in recent_hours(now, HOURS_KEPT):
+            if hour < settled_before or not seeded:
+                expected[KEY_HOUR.format(campaign_id=campaign_id, hour=hour)] = by_hour.get(hour, 0)
+
+        keys = expected.keys()
+        for (key, value) in zip(keys, cache.get_many(*keys)):
+            if int(value or 0) != expected[key]:
+                if seeded:
+                    current_app.logger.warning('counter %s was %s, reset to %s' % (key, value, expected[key]))
+                timeout = HOURS_KEPT * 60 * 60 if key != total_key else 0
+                cache.cache.set(key, expected[key], timeout=timeout)
+                reset += 1
+
+        if get_referrals(campaign_id) != referrals:
+            set_referrals(campaign_id, referrals)
+            reset += 1
+
+        cache.set(KEY_SEEDED.format(campaign_id=campaign_id), True, timeout=SEEDED_TIMEOUT)
+        cache.delete(KEY_RECONCILE_QUEUED.format(campaign_id=campaign_id))
+    return reset
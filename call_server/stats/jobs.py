@@ -0,0 +1,225 @@
+"""
+Incremental rollups of calls and sessions, for the stats API.
+
+Each run picks up rows added since the watermark of the last run, in id order,
+and adds them to the hourly rollup tables in one transaction. The watermark
+follows insert order only, so rows the call log writes long after their
+timestamp are still picked up. Rows are only
+rolled up once they have settled: calls a minute after they are logged, and
+sessions after queue_delay has had time to be recorded by the status callback.
+"""
+
+from collections import defaultdict
+from datetime import datetime, timedelta
+
+import pytz
+from flask import current_app
+
+from ..extensions import db, cache, rq
+from ..call.models import Call, Session
+from .models import CallRollup, SessionRollup, SessionCallsRollup, RollupWatermark
+
+BATCH_SIZE = 10000
+CALL_SETTLE = timedelta(minutes=1)
+SESSION_SETTLE = timedelta(minutes=10)
+KEY_QUEUED = 'stats:rollup:queued'
+REFRESH_INTERVAL = 60  # seconds between jobs queued by stats requests, without STATS_ROLLUP_INTERVAL
+
+
+def naive_utc(timestamp):
+    if timestamp.tzinfo:
+        return timestamp.astimezone(pytz.utc).replace(tzinfo=None)
+    return timestamp
+
+
+def hour_bucket(timestamp):
+    "Start of the hour for timestamp, as naive UTC"
+    return naive_utc(timestamp).replace(minute=0, second=0, microsecond=0)
+
+
+def get_watermark(name):
+    # lock the watermark row, so concurrent runs don't count rows twice
+    watermark = RollupWatermark.query.filter_by(name=name).with_for_update().first()
+    if not watermark:
+        watermark = RollupWatermark(name)
+        db.session.add(watermark)
+    return watermark
+
+
+def settled(rows, cutoff):
+    "Rows up to the first one newer than cutoff, so the watermark never skips ahead"
+    for (n, row) in enumerate(rows):
+        if naive_utc(row.timestamp) > cutoff:
+            return rows[:n]
+    return rows
+
+
+def _existing(model, campaign_ids, hours=None):
+    query = model.query.filter(model.campaign_id.in_(campaign_ids))
+    if hours:
+        query = query.filter(model.hour >= min(hours), model.hour <= max(hours))
+    return query
+
+
+def rollup_calls(batch_size=BATCH_SIZE):
+    """
+    Adds up to batch_size calls since the last run to CallRollup and SessionCallsRollup
+    Returns number of calls rolled up
+    """
+    watermark = get_watermark('calls')
+    last_id = watermark.last_id
+
+    calls = (db.session.query(Call.id, Call.timestamp, Call.campaign_id, Call.target_id,
+                              Call.session_id, Call.status, Call.duration)
+        .filter(Call.id > last_id)
+        .order_by(Call.id)
+        .limit(batch_size)
+        .all())
+    calls = settled(calls, datetime.utcnow() - CALL_SETTLE)
+    if not calls:
+        db.session.rollback()
+        return 0
+
+    buckets = defaultdict(lambda: [0, 0])
+    session_completed = defaultdict(int)
+    for c in calls:
+        if not c.campaign_id:
+            continue
+        bucket = buckets[(hour_bucket(c.timestamp), c.campaign_id, c.target_id, c.status or 'unknown')]
+        bucket[0] += 1
+        bucket[1] += c.duration or 0
+        if c.status == 'completed' and c.session_id:
+            session_completed[(c.campaign_id, c.session_id)] += 1
+
+    if buckets:
+        campaign_ids = set(key[1] for key in buckets)
+        rollups = dict(((r.hour, r.campaign_id, r.target_id, r.status), r)
+            for r in _existing(CallRollup, campaign_ids, [key[0] for key in buckets]))
+        for (key, (count, duration)) in buckets.items():
+            rollup = rollups.get(key)
+            if not rollup:
+                rollup = CallRollup(*key)
+                db.session.add(rollup)
+            rollup.count += count
+            rollup.duration += duration
+
+    if session_completed:
+        update_session_calls(session_completed, last_id)
+
+    watermark.last_id = calls[-1].id
+    watermark.updated = datetime.utcnow()
+    db.session.commit()
+    return len(calls)
+
+
+def update_session_calls(session_completed, last_id):
+    """
+    Move sessions to their new bucket in the completed calls histogram
+    session_completed is a dict of (campaign_id, session_id) to newly completed calls
+    """
+    session_ids = [session_id for (campaign_id, session_id) in session_completed]
+    previous = {}
+    for i in range(0, len(session_ids), 500):
+        chunk = session_ids[i:i+500]
+        previous.update(db.session.query(Call.session_id, db.func.count(Call.id))
+            .filter(Call.session_id.in_(chunk),
+                    Call.status == 'completed',
+                    Call.id <= last_id)
+            .group_by(Call.session_id))
+
+    changes = defaultdict(int)
+    for ((campaign_id, session_id), completed) in session_completed.items():
+        before = previous.get(session_id, 0)
+        if before:
+            changes[(campaign_id, before)] -= 1
+        changes[(campaign_id, before + completed)] += 1
+
+    campaign_ids = set(key[0] for key in changes)
+    histogram = dict(((r.campaign_id, r.calls_completed), r)
+        for r in _existing(SessionCallsRollup, campaign_ids))
+    for (key, change) in changes.items():
+        bucket = histogram.get(key)
+        if not bucket:
+            bucket = SessionCallsRollup(*key)
+            db.session.add(bucket)
+        bucket.sessions += change
+
+
+def rollup_sessions(batch_size=BATCH_SIZE):
+    """
+    Adds up to batch_size sessions since the last run to SessionRollup
+    Returns number of sessions rolled up
+    """
+    watermark = get_watermark('sessions')
+
+    sessions = (db.session.query(Session.id, Session.timestamp, Session.campaign_id, Session.queue_delay)
+        .filter(Session.id > watermark.last_id)
+        .order_by(Session.id)
+        .limit(batch_size)
+        .all())
+    sessions = settled(sessions, datetime.utcnow() - SESSION_SETTLE)
+    if not sessions:
+        db.session.rollback()
+        return 0
+
+    buckets = defaultdict(lambda: [0, 0, 0.0])
+    for s in sessions:
+        if not s.campaign_id:
+            continue
+        bucket = buckets[(hour_bucket(s.timestamp), s.campaign_id)]
+        bucket[0] += 1
+        if s.queue_delay is not None:
+            bucket[1] += 1
+            bucket[2] += s.queue_delay.total_seconds()
+
+    if buckets:
+        campaign_ids = set(key[1] for key in buckets)
+        rollups = dict(((r.hour, r.campaign_id), r)
+            for r in _existing(SessionRollup, campaign_ids, [key[0] for key in buckets]))
+        for (key, (count, delay_count, delay_seconds)) in buckets.items():
+            rollup = rollups.get(key)
+            if not rollup:
+                rollup = SessionRollup(*key)
+                db.session.add(rollup)
+            rollup.count += count
+            rollup.queue_delay_count += delay_count
+            rollup.queue_delay_seconds += delay_seconds
+
+    watermark.last_id = sessions[-1].id
+    watermark.updated = datetime.utcnow()
+    db.session.commit()
+    return len(sessions)
+
+
+@rq.job
+def update_stats_rollups(batch_size=BATCH_SIZE):
+    """
+    Roll up all settled calls and sessions since the last run
+    Returns number of rows rolled up
+    """
+    total = 0
+    for rollup in (rollup_calls, rollup_sessions):
+        while True:
+            n = rollup(batch_size)
+            total += n
+            if n < batch_size:
+                break
+    return total
+
+
+def queue_stats_rollups():
+    "Queue a rollup job, at most once every STATS_ROLLUP_INTERVAL seconds"
+    interval = current_app.config.get('STATS_ROLLUP_INTERVAL')
+    if interval and cache.add(KEY_QUEUED, True, timeout=interval):
+        update_stats_rollups.queue()
+
+
+def refresh_stats_rollups():
+    """
+    Before the stats API reads the rollups, as they are
+    Queues a rollup job, at most once every STATS_ROLLUP_INTERVAL or REFRESH_INTERVAL seconds,
+    so a request never rolls up rows itself
+    """
+    interval = current_app.config.get('STATS_ROLLUP_INTERVAL') or REFRESH_INTERVAL
+    if cache.add(KEY_QUEUED, True, timeout=interval):
+        update_stats_rollups.queue()
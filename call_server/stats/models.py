@@ -0,0 +1,81 @@
+from ..extensions import db
+
+
+class CallRollup(db.Model):
+    # call counts and duration by target and status, bucketed by hour
+    __tablename__ = 'stats_call_rollup'
+
+    id = db.Column(db.Integer, primary_key=True)
+    hour = db.Column(db.DateTime, nullable=False)  # start of the hour, UTC
+    campaign_id = db.Column(db.ForeignKey('campaign_campaign.id'), nullable=False)
+    target_id = db.Column(db.ForeignKey('campaign_target.id'), nullable=True)
+    status = db.Column(db.String(25), nullable=False)
+    count = db.Column(db.Integer, default=0, nullable=False)
+    duration = db.Column(db.Integer, default=0, nullable=False)  # sum of call seconds
+
+    __table_args__ = (
+        db.UniqueConstraint('campaign_id', 'hour', 'target_id', 'status', name='stats_call_rollup_bucket'),
+    )
+
+    def __init__(self, hour, campaign_id, target_id, status):
+        self.hour = hour
+        self.campaign_id = campaign_id
+        self.target_id = target_id
+        self.status = status
+        self.count = 0
+        self.duration = 0
+
+
+class SessionRollup(db.Model):
+    # call sessions started, bucketed by hour
+    __tablename__ = 'stats_session_rollup'
+
+    id = db.Column(db.Integer, primary_key=True)
+    hour = db.Column(db.DateTime, nullable=False)
+    campaign_id = db.Column(db.ForeignKey('campaign_campaign.id'), nullable=False)
+    count = db.Column(db.Integer, default=0, nullable=False)
+    queue_delay_count = db.Column(db.Integer, default=0, nullable=False)  # sessions with a queue_delay
+    queue_delay_seconds = db.Column(db.Float, default=0, nullable=False)
+
+    __table_args__ = (
+        db.UniqueConstraint('campaign_id', 'hour', name='stats_session_rollup_bucket'),
+    )
+
+    def __init__(self, hour, campaign_id):
+        self.hour = hour
+        self.campaign_id = campaign_id
+        self.count = 0
+        self.queue_delay_count = 0
+        self.queue_delay_seconds = 0
+
+
+class SessionCallsRollup(db.Model):
+    # histogram of sessions by number of completed calls
+    __tablename__ = 'stats_session_calls_rollup'
+
+    id = db.Column(db.Integer, primary_key=True)
+    campaign_id = db.Column(db.ForeignKey('campaign_campaign.id'), nullable=False)
+    calls_completed = db.Column(db.Integer, nullable=False)
+    sessions = db.Column(db.Integer, default=0, nullable=False)
+
+    __table_args__ = (
+        db.UniqueConstraint('campaign_id', 'calls_completed', name='stats_session_calls_rollup_bucket'),
+    )
+
+    def __init__(self, campaign_id, calls_completed):
+        self.campaign_id = campaign_id
+        self.calls_completed = calls_completed
+        self.sessions = 0
+
+
+class RollupWatermark(db.Model):
+    # highest row id included in a rollup
+    __tablename__ = 'stats_rollup_watermark'
+
+    name = db.Column(db.String(40), primary_key=True)
+    last_id = db.Column(db.Integer, default=0, nullable=False)
+    updated = db.Column(db.DateTime)
+
+    def __init__(self, name):
+        self.name = name
+        self.last_id = 0
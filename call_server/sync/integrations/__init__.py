@@ -8,7 +8,7 @@ class CRMIntegration(object):
 
     def get_phone(self, twilio_sid):
         """Gets the dialed phone for a Session from Twilio in e164 format"""
-        twilio_call = self.twilio_client.calls.get(twilio_sid)
+        twilio_call = self.twilio_client.calls.get(twilio_sid).fetch()
         return twilio_call.to
 
     def get_user(self, phone_number):
@@ -1,3 +1,5 @@
+from threading import Lock
+
 from flask import current_app
 
 import requests
@@ -18,6 +20,9 @@ class ActionKitIntegration(CRMIntegration):
             self.ak_rpc = ActionKitXML(instance=domain, username=username, password=password)
         else:
             raise Exception('unable to authenticate to ActionKit')
+        # targets found or created, by (country, state, type, name)
+        self._target_ids = {}
+        self._target_lock = Lock()
 
     def get_user(self, phone_number):
         """Gets a user from ActionKit with the given phone number
@@ -46,7 +51,7 @@ class ActionKitIntegration(CRMIntegration):
         if campaign.country_code.upper() == 'US':
             # look up target in political_data
             data_provider = campaign.get_country_data()
-            target_data = data_provider.cache_get(target_key)
+            target_data = data_provider.cache_get(target.uid, {})
             
             if campaign.campaign_type == 'congress':
                 target_state = target_data.get('state', '')
@@ -76,6 +81,14 @@ class ActionKitIntegration(CRMIntegration):
         """Gets a target from ActionKit in the given country, state, type (senate, house, custom), and first/last name
         Returns a target ID"""
 
+        # sync workers share the integration, so only look up or create each target once
+        key = (country, state, target_type, target_name)
+        with self._target_lock:
+            if key not in self._target_ids:
+                self._target_ids[key] = self._find_or_create_target(country, state, target_type, target_name)
+            return self._target_ids[key]
+
+    def _find_or_create_target(self, country, state, target_type, target_name):
         # match in actionkit by country, state and type
         # these are the only indexed fields
         target_data = {'country': country,
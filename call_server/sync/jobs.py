@@ -1,19 +1,28 @@
+import time
+
 from flask import current_app
 
-from ..extensions import db, rq
+from ..config import DefaultConfig
+from ..extensions import db, cache, rq
 
 from .models import SyncCampaign
 from .integrations import CRMIntegrationError
 
+KEY_SYNCING = 'sync:campaign:{campaign_id}:syncing'
+# for the chunk in progress at the deadline, and the campaign meta after it
+HEADROOM = 10*60
+# jobs are decorated before the app is configured, so this is the default time limit
+JOB_TIMEOUT = DefaultConfig.CRM_SYNC_TIME_LIMIT + HEADROOM
+
 def get_crm_integration():
     # setup integration from config values
     if current_app.config['CRM_INTEGRATION'] == 'ActionKit':
         from .integrations.actionkit_crm import ActionKitIntegration
         ak_credentials = {'domain': current_app.config['ACTIONKIT_DOMAIN'],
                           'username': current_app.config['ACTIONKIT_USER']}
-        if 'ACTIONKIT_PASSWORD' in current_app.config:
+        if current_app.config.get('ACTIONKIT_PASSWORD'):
             ak_credentials['password'] = current_app.config['ACTIONKIT_PASSWORD']
-        elif 'ACTIONKIT_API_KEY' in current_app.config:
+        elif current_app.config.get('ACTIONKIT_API_KEY'):
             ak_credentials['api_key'] = current_app.config['ACTIONKIT_API_KEY']
         else:
             raise CRMIntegrationError('either ACTIONKIT_API_KEY or ACTIONKIT_PASSWORD must be configured')
@@ -24,15 +33,30 @@ def get_crm_integration():
     return crm_integration
 
 
-@rq.job
+@rq.job(timeout=JOB_TIMEOUT)
 def sync_campaigns(campaign_id='all'):
+    # campaign_id may be 'all', a single id or a list of ids
     crm_integration = get_crm_integration()
 
-    if campaign_id_list == 'all':
+    if campaign_id == 'all':
         campaigns_to_sync = SyncCampaign.query.all()
+    elif isinstance(campaign_id, (list, tuple)):
+        campaigns_to_sync = SyncCampaign.query.filter(SyncCampaign.campaign_id.in_(campaign_id))
     else:
         campaigns_to_sync = SyncCampaign.query.filter_by(campaign_id=campaign_id)
 
+    # one time limit for the whole run, so it is done before the next hourly run
+    # and within the job's timeout
+    time_limit = min(current_app.config.get('CRM_SYNC_TIME_LIMIT', 50*60), JOB_TIMEOUT - HEADROOM)
+    deadline = time.time() + time_limit
     for sync_campaign in campaigns_to_sync:
-        current_app.logger.info('sync campaign ID: %s' % sync_campaign.campaign_id)
-        sync_campaign.sync_calls(crm_integration)
\ No newline at end of file
+        # held while syncing, so an overlapping run doesn't save the same calls again
+        syncing = KEY_SYNCING.format(campaign_id=sync_campaign.campaign_id)
+        if not cache.add(syncing, True, timeout=JOB_TIMEOUT):
+            current_app.logger.warning('sync campaign ID: %s already running' % sync_campaign.campaign_id)
+            continue
+        try:
+            current_app.logger.info('sync campaign ID: %s' % sync_campaign.campaign_id)
+            sync_campaign.sync_calls(crm_integration, deadline)
+        finally:
+            cache.delete(syncing)
@@ -19,6 +19,7 @@ class SyncCampaign(db.Model):
     campaign = db.relationship('Campaign', backref=db.backref('sync_campaign', lazy='dynamic'))
 
     crm_id = db.Column(db.String(40)) # id of the campaign in the CRM
+    last_call_id = db.Column(db.Integer, default=0) # calls up to this id have been synced
 
     def __init__(self, campaign_id, crm_id):
         self.campaign_id = campaign_id
@@ -35,21 +36,20 @@ class SyncCampaign(db.Model):
             month='*',
             days_of_week='*')
         from jobs import sync_campaigns
-        cron_job = sync_campaigns.cron(crontab, 'sync:sync_campaigns:{}'.format(self.campaign_id), self.campaign_id)
+        # as sync_campaigns.cron, which doesn't pass the job's timeout on to the scheduler
+        cron_job = rq.get_scheduler().cron(crontab, sync_campaigns, args=(self.campaign_id,),
+            queue_name=sync_campaigns.helper.queue_name, id='cron-sync:sync_campaigns:{}'.format(self.campaign_id),
+            timeout=sync_campaigns.helper.timeout)
         self.job_id = cron_job.id
 
     def stop(self):
         rq.get_scheduler().cancel(self.job_id)
 
-    def sync_calls(self, integration):
-        unsynced_calls = Call.query.filter_by(campaign=self.campaign, sync_call=None)
-        for call in unsynced_calls:
-            sync_call = SyncCall(call.id)
-            result = sync_call.save_to_crm(self, integration)
-            if result:
-                db.session.add(sync_call)
+    def sync_calls(self, integration, deadline=None):
+        from pipeline import CRMSync
+        CRMSync(integration, deadline=deadline).sync_campaign(self)
 
-        completed_calls = Call.query.filter_by(campaign=self, status='completed')
+        completed_calls = Call.query.filter_by(campaign_id=self.campaign_id, status='completed')
         integration.save_campaign_meta(self.crm_id, {'count': completed_calls.count()})
         self.last_sync_time = datetime.utcnow()
         db.session.add(self)    
@@ -67,9 +67,10 @@ class SyncCall(db.Model):
 
     saved = db.Column(db.Boolean, default=False)
 
-    def __init__(self, call_id):
+    def __init__(self, call_id, call=None, saved=False):
         self.call_id = call_id
-        self.call = Call.query.get(self.call_id)
+        self.call = call or Call.query.get(self.call_id)
+        self.saved = saved
 
     def save_to_crm(self, sync_campaign, integration):
         # we only keep a hash of the phone locally, for privacy
@@ -87,10 +88,10 @@ class SyncCall(db.Model):
             return False
 
         crm_user = integration.get_user(user_phone)
-        current_app.logger.info('got user %s' % crm_user['id'])
         if not crm_user:
             current_app.logger.warning('unable to get crm user for phone: %s' % user_phone)
             return False
+        current_app.logger.info('got user %s' % crm_user['id'])
 
         self.saved = integration.save_action(self.call, sync_campaign.crm_id, crm_user)
         current_app.logger.info('synced %s->%s' % (crm_user['id'], self.call.id))
@@ -0,0 +1,179 @@
+"""
+Batched sync of calls to the CRM.
+
+Unsynced calls are read in chunks, in id order. For each chunk, phones are
+read from the phone vault where they are kept, and the rest looked up from
+Twilio, once for each call sid since every call in a session shares one. CRM users are looked up once per phone
+for the whole run. These lookups, and saving the actions, run on a bounded
+thread pool. Lookups are retried with backoff, saving an action isn't, since
+a retry could create it twice in the CRM.
+
+SyncCampaign.last_call_id is checkpointed after each chunk. A run that
+stops at the time limit, or on a request that keeps failing, carries on
+from there on the next run of the hourly job. A call that fails on
+MAX_FAILED_RUNS runs is marked as synced without being saved, so it doesn't
+hold up its campaign for good.
+"""
+
+import time
+from multiprocessing.pool import ThreadPool
+
+from flask import current_app
+from sqlalchemy.orm import joinedload
+
+from ..extensions import db, cache
+from ..call.models import Call
+from ..call import vault
+from .models import SyncCall
+
+CHUNK_SIZE = 200
+RETRIES = 3
+BACKOFF = 1  # seconds, doubled after each retry
+MAX_FAILED_RUNS = 24
+KEY_FAILED_RUNS = 'sync:call:{call_id}:failed_runs'
+
+
+class Failed(object):
+    "Result of a request that kept failing, so the call is tried again on the next run"
+
+FAILED = Failed()
+
+
+def with_retry(fn, *args):
+    "Call fn, retrying with backoff on errors, returns FAILED if it never succeeds"
+    delay = BACKOFF
+    for attempt in range(RETRIES + 1):
+        try:
+            return fn(*args)
+        except Exception:
+            if attempt == RETRIES:
+                current_app.logger.error('CRM sync %s%s failed' % (fn.__name__, args), exc_info=True)
+                return FAILED
+            time.sleep(delay)
+            delay *= 2
+
+
+def call_once(fn, *args):
+    "Call fn without retrying, for requests that aren't safe to repeat, returns FAILED on errors"
+    try:
+        return fn(*args)
+    except Exception:
+        current_app.logger.error('CRM sync %s%s failed' % (fn.__name__, args), exc_info=True)
+        return FAILED
+
+
+class CRMSync(object):
+    """Syncs calls for SyncCampaigns to a CRM integration, with a pool of workers"""
+
+    def __init__(self, integration, workers=None, time_limit=None, deadline=None):
+        self.integration = integration
+        self.app = current_app._get_current_object()
+        self.workers = workers or self.app.config.get('CRM_SYNC_WORKERS', 8)
+        # shared by the campaigns of a run, see sync_campaigns
+        self.deadline = deadline or time.time() + (time_limit or self.app.config.get('CRM_SYNC_TIME_LIMIT', 50*60))
+        self.users = {}  # phone number to CRM user, for the whole run
+        self.synced_sessions = set()  # to purge from the phone vault
+
+    def _run(self, request, fn, *args):
+        # workers need their own app context, for config and logging
+        with self.app.app_context():
+            return request(fn, *args)
+
+    def map(self, pool, fn, items):
+        "Returns dict of item to fn(item), run on the pool with retries"
+        items = list(items)
+        return dict(zip(items, pool.map(lambda item: self._run(with_retry, fn, item), items)))
+
+    def unsynced(self, sync_campaign):
+        "Next chunk of unsynced calls, with their campaign and target"
+        return (Call.query
+            .options(joinedload(Call.campaign), joinedload(Call.target))
+            .filter(Call.campaign_id == sync_campaign.campaign_id,
+                    Call.id > (sync_campaign.last_call_id or 0),
+                    ~Call.sync_call.any())
+            .order_by(Call.id)
+            .limit(CHUNK_SIZE)
+            .all())
+
+    def sync_chunk(self, pool, sync_campaign, calls):
+        """
+        Save a chunk of calls to the CRM
+        Returns list of ids of the calls that failed
+        """
+        # numbers from the vault, and from twilio for the rest
+        vaulted = vault.get_phones(set(c.session_id for c in calls if c.session_id))
+        sids = set(c.call_id for c in calls if c.call_id and c.session_id not in vaulted)
+        phones = self.map(pool, self.integration.get_phone, sids)
+        phones = dict((c.id, vaulted.get(c.session_id) or phones.get(c.call_id)) for c in calls)
+
+        new_phones = set(p for p in phones.values() if p and p is not FAILED) - set(self.users)
+        self.users.update(self.map(pool, self.integration.get_user, new_phones))
+
+        failed = []
+        to_save = []
+        for call in calls:
+            phone = phones[call.id]
+            crm_user = self.users.get(phone) if phone and phone is not FAILED else None
+            if phone is FAILED or crm_user is FAILED:
+                failed.append(call.id)
+            elif crm_user:
+                to_save.append((call, crm_user))
+            else:
+                current_app.logger.warning('unable to get crm user for call: %s' % call.id)
+
+        saves = [(call, sync_campaign.crm_id, crm_user) for (call, crm_user) in to_save]
+        results = pool.map(lambda args: self._run(call_once, self.integration.save_action, *args), saves)
+        for ((call, crm_user), saved) in zip(to_save, results):
+            if saved is FAILED:
+                failed.append(call.id)
+                continue
+            db.session.add(SyncCall(call.id, call=call, saved=saved))
+            self.synced_sessions.add(call.session_id)
+            current_app.logger.info('synced %s->%s' % (crm_user['id'], call.id))
+        return failed
+
+    def skip_failing(self, call_ids):
+        """
+        Count a failed run for each call, and mark the ones that failed MAX_FAILED_RUNS as synced without saving
+        Returns ids of the calls to try again
+        """
+        retry = []
+        for call_id in call_ids:
+            key = KEY_FAILED_RUNS.format(call_id=call_id)
+            if (cache.cache.inc(key) or 0) < MAX_FAILED_RUNS:
+                retry.append(call_id)
+                continue
+            current_app.logger.error('CRM sync skipping call %s, failed on %s runs' % (call_id, MAX_FAILED_RUNS))
+            db.session.add(SyncCall(call_id, saved=False))
+            cache.delete(key)
+        return retry
+
+    def sync_campaign(self, sync_campaign):
+        """
+        Sync calls for sync_campaign until done, out of time, or a request keeps failing
+        Returns number of calls checked
+        """
+        checked = 0
+        pool = ThreadPool(self.workers)
+        try:
+            while time.time() < self.deadline:
+                calls = self.unsynced(sync_campaign)
+                if not calls:
+                    break
+
+                failed = self.skip_failing(self.sync_chunk(pool, sync_campaign, calls))
+                first_failed = min(failed) if failed else None
+                # checkpoint, up to the first failure so it is tried again next run
+                sync_campaign.last_call_id = (first_failed - 1) if first_failed else calls[-1].id
+                db.session.add(sync_campaign)
+                db.session.commit()
+                vault.purge_phones(self.synced_sessions)
+                self.synced_sessions.clear()
+                checked += len(calls)
+                if first_failed:
+                    current_app.logger.warning('CRM sync stopped at call %s, will retry' % first_failed)
+                    break
+        finally:
+            pool.close()
+            pool.join()
+        return checked
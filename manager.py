@@ -58,8 +58,14 @@ def runserver(external=None):
 
 
 @manager.command
-def loadpoliticaldata():
-    """Load political data into persistent cache"""
+def loadpoliticaldata(background=False):
+    """Load political data into persistent cache, or --background to queue a job to reload it"""
+    if background:
+        with app.app_context():
+            political_data.reload_political_data.queue()
+        log.info("queued political data reload")
+        return
+
     try:
         import gevent.monkey
         gevent.monkey.patch_thread()
@@ -71,6 +77,28 @@ def loadpoliticaldata():
         n = political_data.load_data(cache)
     log.info("done loading %d objects" % n)
 
+@manager.command
+def loadstatelegislators(schedule=False):
+    """Cache current state legislators from OpenStates by district, or --schedule to refresh them daily"""
+    with app.app_context():
+        if schedule:
+            political_data.refresh_state_legislators.cron('23 4 * * *', 'political_data:refresh_state_legislators')
+            log.info("scheduled state legislator refresh daily")
+        else:
+            n = political_data.refresh_state_legislators()
+            log.info("cached %d state legislators" % n)
+
+@manager.command
+def buildpoliticaldata(force=False):
+    """Preprocess political data sources into artifacts for loadpoliticaldata, rebuilding only changed ones"""
+    from call_server.political_data.artifact import load_artifact
+    from call_server.political_data.countries.us import USDataProvider
+    with app.app_context():
+        us_data = USDataProvider(cache)
+        parsed = load_artifact('us_congress', us_data.LEGISLATOR_SOURCES, us_data._parse_legislators,
+            rebuild=force)
+    log.info("us_congress artifact has %d legislators" % len(parsed['legislators']))
+
 @manager.command
 def stop_scheduled_calls(campaign_id, date):
     # unsubscribe outgoing recurring calls created before date
@@ -84,7 +112,7 @@ def stop_scheduled_calls(campaign_id, date):
     confirm = raw_input('Confirm (Y/N): ')
     if confirm == 'Y':
         for sc in scheduled_calls:
-            print "canceling job", sc.job_id
+            print "stopping", sc
             sc.stop_job()
             db.session.add(sc)
         db.session.commit()
@@ -94,10 +122,11 @@ def stop_scheduled_calls(campaign_id, date):
 
 @manager.command
 def restart_scheduled_calls(campaign_id, accept_all=False):
-    # rebind outgoing recurring calls
+    # move outgoing recurring calls from their own cron jobs to the dispatcher
     from call_server.campaign import Campaign
     from call_server.campaign.constants import STATUS_LIVE
     from call_server.schedule import ScheduleCall
+    from call_server.schedule.dispatch import move_legacy_jobs
 
     if campaign_id == 'all':
         campaigns = Campaign.query.filter_by(prompt_schedule=True, status_code=STATUS_LIVE).all()
@@ -113,19 +142,39 @@ def restart_scheduled_calls(campaign_id, accept_all=False):
         for campaign in campaigns:
             scheduled_calls = ScheduleCall.query.filter_by(campaign=campaign, subscribed=True).all()
             print 'Scheduled calls for {}: {}'.format(campaign.name, len(scheduled_calls))
-            rq_scheduler = rq.get_scheduler()
-            for sc in scheduled_calls:
-                if not sc.job_id in rq_scheduler:
-                    print "resetting job", sc.job_id
-                    sc.start_job()
-                    db.session.add(sc)
-            db.session.commit()
+            print "moved jobs", move_legacy_jobs(scheduled_calls)
             print "done"
+        print "moved subscribers are called by dispatch_scheduled_calls, which is scheduled along with them"
+    else:
+        print "exit"
+
+@manager.command
+def dispatch_scheduled_calls(schedule=False):
+    """Place scheduled calls due this minute, or --schedule to run every minute and move legacy cron jobs"""
+    from call_server.schedule import ScheduleCall
+    from call_server.schedule.dispatch import dispatch_scheduled_calls, move_legacy_jobs
+    with app.app_context():
+        if schedule:
+            dispatch_scheduled_calls.cron('* * * * *', 'schedule:dispatch_scheduled_calls')
+            log.info("scheduled call dispatch every minute")
+            n = move_legacy_jobs(ScheduleCall.query.filter(ScheduleCall.job_id != None).all())
+            log.info("moved %d legacy scheduled call jobs" % n)
         else:
-            print "exit"
+            n = dispatch_scheduled_calls()
+            log.info("placed %d scheduled calls" % n)
 
 @manager.command
-def crmsync(campaigns='all'):
+def crmsync(campaigns='all', reschedule=False):
+    """Sync calls to the CRM, or --reschedule to register each campaign's hourly sync job again"""
+    if reschedule:
+        from call_server.sync.models import SyncCampaign
+        with app.app_context():
+            for sync_campaign in SyncCampaign.query.all():
+                sync_campaign.start()
+                db.session.add(sync_campaign)
+            db.session.commit()
+        print "rescheduled CRM sync jobs"
+        return
     print "Sync to CRM"
     if campaigns == 'all':
         campaigns_list = 'all'
@@ -136,12 +185,86 @@ def crmsync(campaigns='all'):
     sync.jobs.sync_campaigns(campaigns_list)
 
 @manager.command
-def redis_clear():
-    print "This will entirely clear the Redis cache"
+def rollupstats():
+    """Update call statistics rollups, run after migrating to backfill existing calls"""
+    from call_server.stats import update_stats_rollups
+    with app.app_context():
+        n = update_stats_rollups()
+    log.info("rolled up %d calls and sessions" % n)
+
+@manager.command
+def reconcilecounters(schedule=False):
+    """Check live campaign call counters against the database, or --schedule to run hourly"""
+    from call_server.stats import reconcile_campaign_counters
+    with app.app_context():
+        if schedule:
+            reconcile_campaign_counters.cron('17 * * * *', 'stats:reconcile_campaign_counters')
+            log.info("scheduled counter reconciliation hourly")
+        else:
+            n = reconcile_campaign_counters()
+            log.info("reset %d campaign counters" % n)
+
+@manager.command
+def create_partitions(schedule=False):
+    """Create monthly partitions of calls and sessions ahead of time, or --schedule to run daily"""
+    from call_server.call.partitions import create_partitions
+    with app.app_context():
+        if schedule:
+            create_partitions.cron('41 3 * * *', 'call:create_partitions')
+            log.info("scheduled partition creation daily")
+        else:
+            created = create_partitions()
+            log.info("created partitions %s" % ', '.join(created))
+
+@manager.command
+def archive_partitions(before, directory='archive'):
+    """Archive calls and sessions from months before a date (YYYY-MM-DD) to gzipped CSV, and drop them"""
+    from datetime import datetime
+    from call_server.call.partitions import archive_partitions
+    before_date = datetime.strptime(before, '%Y-%m-%d')
+    print 'This will remove all calls and sessions from before {:%B %Y} from the database'.format(before_date)
+    confirm = raw_input('Confirm (Y/N): ')
+    if confirm == 'Y':
+        with app.app_context():
+            archived = archive_partitions(before_date, directory)
+        log.info("archived %d partitions to %s" % (len(archived), directory))
+    else:
+        print "exit"
+
+@manager.command
+def export(campaign_id, kind='calls', format='csv', start=None, end=None, output=None):
+    """Export calls or sessions for a campaign, as csv or ndjson, to a file or stdout"""
+    import dateutil.parser
+    from call_server.api.export import export_query, export_lines
+    start_date = dateutil.parser.parse(start) if start else None
+    end_date = dateutil.parser.parse(end) if end else None
+    out = open(output, 'wb') if output else sys.stdout
+    with app.app_context():
+        for line in export_lines(kind, export_query(kind, int(campaign_id), start_date, end_date), format):
+            out.write(line)
+    if output:
+        out.close()
+
+@manager.command
+def redis_clear(include_political_data=False):
+    """Clear the Redis cache, except loaded political data unless --include_political_data"""
+    from call_server.political_data.countries import is_political_data_key
+    if include_political_data:
+        print "This will entirely clear the Redis cache"
+    else:
+        print "This will clear the Redis cache, except loaded political data"
     confirm = raw_input('Confirm (Y/N): ')
     if confirm == 'Y':
         with app.app_context():
-            cache.cache._client.flushdb()
+            redis = cache.cache._client
+            if include_political_data:
+                redis.flushdb()
+            else:
+                prefix = app.config.get('CACHE_KEY_PREFIX') or ''
+                keys = [k for k in redis.scan_iter()
+                        if not is_political_data_key(k[len(prefix):] if k.startswith(prefix) else k)]
+                for i in range(0, len(keys), 1000):
+                    redis.delete(*keys[i:i+1000])
         print "redis cache cleared"
     else:
         print "exit"
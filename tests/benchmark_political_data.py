@@ -0,0 +1,89 @@
+"""
+Benchmark for the storage formats of political data records in redis.
+
+Loads the US zipcode, legislator and governor records in each format of
+POLITICAL_DATA_STORAGE, under a key prefix of their own, and compares the
+memory they use and the latency of lookups. Zipcode lookups read the cache,
+without the district index. Needs REDIS_URL, and removes its keys after.
+
+    REDIS_URL=redis://localhost:6379 python tests/benchmark_political_data.py [iterations]
+"""
+
+import os
+import random
+import sys
+import timeit
+from os import path
+
+sys.path.append(path.dirname(path.dirname(path.abspath(__file__))))
+
+from call_server.app import create_app
+from call_server.config import TestingConfig
+from call_server.extensions import assets, cache
+from call_server.political_data.countries.us import USDataProvider, USCampaignType_Congress
+
+FORMATS = ['pickle', 'redis_hash']
+
+
+def config(storage):
+    class BenchmarkConfig(TestingConfig):
+        CACHE_TYPE = 'redis'
+        CACHE_REDIS_URL = os.environ['REDIS_URL']
+        CACHE_KEY_PREFIX = 'benchmark-%s:' % storage
+        POLITICAL_DATA_STORAGE = storage
+    return BenchmarkConfig
+
+
+def used_memory(redis):
+    return redis.info('memory')['used_memory']
+
+
+def run(storage, iterations):
+    assets._named_bundles = {}
+    app = create_app(config(storage))
+    with app.app_context():
+        us_data = USDataProvider(cache)
+        redis = us_data._redis()
+        prefix = app.config['CACHE_KEY_PREFIX']
+
+        districts = us_data._load_districts()
+        legislators = us_data._load_legislators()
+        governors = us_data._load_governors()
+        before = used_memory(redis)
+        for records in (districts, legislators, governors):
+            us_data.cache_set_many(records)
+        memory = used_memory(redis) - before
+
+        random.seed(1)
+        zipcodes = [key.split(':')[-1] for key in random.sample(sorted(districts), 100)]
+        bioguides = [key.split(':')[-1] for key in random.sample(sorted(legislators), 100)
+                     if key.startswith('us:bioguide')]
+        lookups = [
+            ('get_districts', lambda: [us_data.cache_get(us_data.KEY_ZIPCODE.format(zipcode=z)) for z in zipcodes]),
+            ('get_bioguide', lambda: [us_data.get_bioguide(b) for b in bioguides]),
+            ('get_congress_members', lambda: [us_data.get_congress_members(z, USCampaignType_Congress.TARGET_FIELDS)
+                                              for z in zipcodes]),
+        ]
+        timings = []
+        for (name, lookup) in lookups:
+            us_data._districts = {}
+            count = len(zipcodes) if name != 'get_bioguide' else len(bioguides)
+            elapsed = timeit.timeit(lookup, number=iterations)
+            timings.append((name, elapsed / iterations / count * 1e6))
+
+        keys = list(redis.scan_iter(match=prefix + '*'))
+        for n in range(0, len(keys), 1000):
+            redis.delete(*keys[n:n + 1000])
+    return memory, timings
+
+
+def main(iterations=10):
+    results = dict((storage, run(storage, iterations)) for storage in FORMATS)
+    print '%-22s %14s %14s' % tuple(['', ] + FORMATS)
+    print '%-22s %12.1fMB %12.1fMB' % tuple(['memory'] + [results[s][0] / 1e6 for s in FORMATS])
+    for (n, (name, timing)) in enumerate(results[FORMATS[0]][1]):
+        print '%-22s %12.1fus %12.1fus' % tuple([name] + [results[s][1][n][1] for s in FORMATS])
+
+
+if __name__ == '__main__':
+    main(*[int(arg) for arg in sys.argv[1:]])
@@ -0,0 +1,141 @@
+"""
+Benchmark for the call and session queries behind the stats API and admin.
+
+Seeds a synthetic calls table, then records the query plan and timing of each
+query, before and after creating the call and session indexes. Runs against
+an in-memory sqlite database by default, or set DATABASE_URL to an empty
+postgres database to see real plans.
+
+    python tests/benchmark_queries.py [sessions] [iterations]
+"""
+
+import os
+import random
+import sys
+import timeit
+from datetime import datetime, timedelta
+from os import path
+
+sys.path.append(path.dirname(path.dirname(path.abspath(__file__))))
+
+from call_server.app import create_app, db
+from call_server.config import TestingConfig
+from call_server.extensions import assets
+from call_server.campaign.models import Campaign, Target
+from call_server.call.models import Call, Session
+
+CAMPAIGNS = 20
+STATUSES = ['completed'] * 6 + ['busy', 'no-answer', 'failed', 'canceled']
+NOW = datetime(2019, 3, 15)
+INDEXES = [index for table in (Call.__table__, Session.__table__) for index in table.indexes]
+
+
+class BenchmarkConfig(TestingConfig):
+    SQLALCHEMY_DATABASE_URI = os.environ.get('DATABASE_URL', TestingConfig.SQLALCHEMY_DATABASE_URI)
+
+
+def queries(campaign_id, phone_hash, session_ids):
+    "(name, query) for each query, as run by the views"
+    month_start = NOW.replace(day=1)
+    return [
+        ('count completed', db.session.query(db.func.count(Call.id))
+            .filter(Call.campaign_id == campaign_id, Call.status == 'completed')),
+        ('count completed 24h', db.session.query(db.func.count(Call.id))
+            .filter(Call.campaign_id == campaign_id, Call.status == 'completed',
+                    Call.timestamp >= NOW - timedelta(hours=24))),
+        ('referral codes', db.session.query(Session.referral_code, db.func.count(Call.id))
+            .join(Call).filter(Call.campaign_id == campaign_id, Call.status == 'completed')
+            .group_by(Session.referral_code)),
+        ('campaign calls by date', db.session.query(db.func.date(Call.timestamp), Call.status, db.func.count(Call.id))
+            .filter(Call.campaign_id == campaign_id, Call.timestamp >= NOW - timedelta(days=7))
+            .group_by(db.func.date(Call.timestamp), Call.status)),
+        ('admin calls this month', db.session.query(db.func.count(Call.id))
+            .filter(Call.status == 'completed', Call.timestamp >= month_start, Call.timestamp <= NOW)),
+        ('campaign sessions', db.session.query(db.func.count(Session.id))
+            .filter(Session.campaign_id == campaign_id, Session.timestamp >= NOW - timedelta(days=7))),
+        ('call sids for number', db.session.query(Call.call_id).filter(Call.session_id.in_(
+            db.session.query(Session.id).filter_by(phone_hash=phone_hash).subquery())).distinct()),
+        ('rollup session calls', db.session.query(Call.session_id, db.func.count(Call.id))
+            .filter(Call.session_id.in_(session_ids), Call.status == 'completed')
+            .group_by(Call.session_id)),
+    ]
+
+
+def explain(query):
+    compiled = query.statement.compile(db.engine)
+    if db.engine.dialect.name == 'sqlite':
+        sql = 'EXPLAIN QUERY PLAN ' + str(compiled)
+    else:
+        sql = 'EXPLAIN ' + str(compiled)
+    if compiled.positional:
+        params = tuple(compiled.params[key] for key in compiled.positiontup)
+    else:
+        params = compiled.params
+    return [' '.join(str(col) for col in row) for row in db.engine.execute(sql, params)]
+
+
+def seed(sessions):
+    campaign_ids = []
+    for n in range(CAMPAIGNS):
+        campaign = Campaign(name='Benchmark %d' % n, country_code='us',
+            campaign_type='custom', campaign_language='en', segment_by='custom')
+        db.session.add(campaign)
+        campaign_ids.append(campaign)
+    target = Target(uid='custom:benchmark', title='Senator', name='Benchmark Target')
+    db.session.add(target)
+    db.session.commit()
+    campaign_ids = [c.id for c in campaign_ids]
+
+    random.seed(1)
+    session_rows, call_rows = [], []
+    for session_id in range(1, sessions + 1):
+        campaign_id = random.choice(campaign_ids)
+        timestamp = NOW - timedelta(minutes=random.randint(0, 60*24*90))
+        session_rows.append({'id': session_id, 'campaign_id': campaign_id, 'timestamp': timestamp,
+            'phone_hash': Session.hash_phone(str(session_id % (sessions / 2 or 1))),
+            'referral_code': random.choice([None, 'ref%d' % random.randint(0, 50)]),
+            'status': 'completed', 'direction': 'outbound'})
+        for n in range(random.randint(1, 3)):
+            call_rows.append({'session_id': session_id, 'campaign_id': campaign_id, 'target_id': target.id,
+                'timestamp': timestamp + timedelta(minutes=n), 'call_id': 'CA%032d' % len(call_rows),
+                'status': random.choice(STATUSES), 'duration': random.randint(0, 300)})
+    db.session.execute(Session.__table__.insert(), session_rows)
+    db.session.execute(Call.__table__.insert(), call_rows)
+    db.session.commit()
+    return campaign_ids, len(call_rows)
+
+
+def run(label, campaign_ids, iterations):
+    print '== %s' % label
+    phone_hash = Session.hash_phone('1')
+    for (name, query) in queries(campaign_ids[0], phone_hash, range(1, 501)):
+        elapsed = timeit.timeit(lambda: query.all(), number=iterations)
+        print '%-24s %10.2fms' % (name, elapsed / iterations * 1e3)
+        for line in explain(query):
+            print '    %s' % line
+
+
+def main(sessions=50000, iterations=10):
+    assets._named_bundles = {}
+    app = create_app(BenchmarkConfig)
+    with app.app_context():
+        db.create_all()
+        for index in INDEXES:
+            index.drop(db.engine)
+
+        campaign_ids, calls = seed(sessions)
+        db.engine.execute('ANALYZE')
+        print 'seeded %d sessions, %d calls' % (sessions, calls)
+
+        run('before', campaign_ids, iterations)
+        for index in INDEXES:
+            index.create(db.engine)
+        db.engine.execute('ANALYZE')
+        run('after', campaign_ids, iterations)
+
+        db.session.remove()
+        db.drop_all()
+
+
+if __name__ == '__main__':
+    main(*[int(arg) for arg in sys.argv[1:]])
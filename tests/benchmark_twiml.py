@@ -0,0 +1,86 @@
+"""
+Micro-benchmark for rendering TwiML responses in the call flow.
+
+Compares rendering the messages of each hop from the campaign's audio on
+every request, as play_or_say did, against precompiled campaign messages.
+
+    python tests/benchmark_twiml.py [iterations]
+"""
+
+import sys
+import timeit
+from os import path
+
+import pystache
+from twilio.twiml.voice_response import VoiceResponse, Gather, Dial
+
+sys.path.append(path.dirname(path.dirname(path.abspath(__file__))))
+
+from call_server.app import create_app, db
+from call_server.config import TestingConfig
+from call_server.extensions import assets
+from call_server.campaign.models import Campaign, AudioRecording, CampaignAudioRecording
+from call_server.campaign.snapshot import get_campaign_snapshot
+from call_server.call.constants import TWILIO_TTS_LANGUAGES
+from call_server.call.twiml import campaign_messages
+
+TARGET = {'title': 'Senator', 'name': 'Test Target', 'location': 'Oakland', 'office_type': 'district'}
+
+# (messages played, with their template variables) for each hop
+HOPS = {
+    'intro_wait_human': [('msg_intro', {}), ('msg_intro_confirm', {})],
+    'location_gather': [('msg_location', {}), ('msg_unparsed_location', {}), ('msg_goodbye', {})],
+    'make_single': [('msg_target_intro', TARGET)],
+    'complete': [('msg_target_busy', TARGET), ('msg_between_calls', {'calls_left': 2})],
+}
+
+
+def render_uncompiled(campaign, hop):
+    resp = VoiceResponse()
+    for (key, kwargs) in HOPS[hop]:
+        audio = campaign.audio(key)
+        lang = campaign.language_code
+        if lang not in TWILIO_TTS_LANGUAGES:
+            lang = lang.split('-')[0] if '-' in lang else 'en'
+        text = getattr(audio, 'text_to_speech', None) or audio
+        resp.say(pystache.render(text, kwargs), voice='alice', language=lang)
+    resp.append(Gather(num_digits=1, method="POST", timeout=10, action='/call/make_calls'))
+    resp.append(Dial(None, caller_id='+15105550199').number('+12025550100'))
+    return str(resp)
+
+
+def render_compiled(campaign, hop):
+    resp = VoiceResponse()
+    messages = campaign_messages(campaign)
+    for (key, kwargs) in HOPS[hop]:
+        messages.append(resp, key, **kwargs)
+    resp.append(Gather(num_digits=1, method="POST", timeout=10, action='/call/make_calls'))
+    resp.append(Dial(None, caller_id='+15105550199').number('+12025550100'))
+    return str(resp)
+
+
+def main(iterations=5000):
+    assets._named_bundles = {}
+    app = create_app(TestingConfig)
+    with app.test_request_context():
+        db.create_all()
+        campaign = Campaign(name='Benchmark', country_code='us',
+            campaign_type='custom', campaign_language='en', segment_by='custom')
+        db.session.add(campaign)
+        recording = AudioRecording(key='msg_target_intro', version=1,
+            text_to_speech='Now connecting you to {{title}} {{name}} at their {{office_type}} office in {{location}}')
+        db.session.add(CampaignAudioRecording(campaign=campaign, recording=recording, selected=True))
+        db.session.commit()
+
+        snapshot = get_campaign_snapshot(campaign.id)
+        print '%-18s %12s %12s %8s' % ('hop', 'uncompiled', 'compiled', 'speedup')
+        for hop in sorted(HOPS):
+            assert render_uncompiled(snapshot, hop) == render_compiled(snapshot, hop)
+            before = timeit.timeit(lambda: render_uncompiled(snapshot, hop), number=iterations)
+            after = timeit.timeit(lambda: render_compiled(snapshot, hop), number=iterations)
+            print '%-18s %10.1fus %10.1fus %7.1fx' % (hop,
+                before / iterations * 1e6, after / iterations * 1e6, before / after)
+
+
+if __name__ == '__main__':
+    main(*[int(arg) for arg in sys.argv[1:]])
@@ -6,6 +6,7 @@ from run import BaseTestCase
 from call_server.utils import utc_now
 from call_server.extensions import db
 from call_server.admin.models import Blocklist
+from call_server.admin.blocklist import invalidate_blocklist, flush_blocklist_hits, get_blocklist_index
 
 
 class TestBlocklist(BaseTestCase):
@@ -26,6 +27,7 @@ class TestBlocklist(BaseTestCase):
 
         Blocklist.query.delete()
         db.session.commit()
+        invalidate_blocklist()
 
     def test_no_blocks(self):
         self.assertEqual(Blocklist.active_blocks(), [])
@@ -37,6 +39,7 @@ class TestBlocklist(BaseTestCase):
         b = Blocklist(phone_number=self.user_phone)
         db.session.add(b)
         db.session.commit()
+        invalidate_blocklist()
 
         self.assertEqual(len(Blocklist.active_blocks()), 1)
 
@@ -46,6 +49,7 @@ class TestBlocklist(BaseTestCase):
         other_blocked = Blocklist.user_blocked(self.other_phone, self.other_ip)
         self.assertFalse(other_blocked)
 
+        flush_blocklist_hits()
         self.assertEqual(b.hits, 1)
 
     def test_phone_hash_block(self):
@@ -53,6 +57,7 @@ class TestBlocklist(BaseTestCase):
         b.phone_hash = '2ceab7622c3ea1de7e5b1db8c90ed3c161a4d097df6755d21df8a349fe63089c'
         db.session.add(b)
         db.session.commit()
+        invalidate_blocklist()
 
         self.assertEqual(len(Blocklist.active_blocks()), 1)
 
@@ -62,12 +67,14 @@ class TestBlocklist(BaseTestCase):
         other_blocked = Blocklist.user_blocked(self.other_phone, self.other_ip)
         self.assertFalse(other_blocked)
 
+        flush_blocklist_hits()
         self.assertEqual(b.hits, 1)
 
     def test_ip_block(self):
         b = Blocklist(ip_address=self.user_ip)
         db.session.add(b)
         db.session.commit()
+        invalidate_blocklist()
 
         self.assertEqual(len(Blocklist.active_blocks()), 1)
 
@@ -77,6 +84,7 @@ class TestBlocklist(BaseTestCase):
         other_blocked = Blocklist.user_blocked(self.other_phone, self.other_ip)
         self.assertFalse(other_blocked)
 
+        flush_blocklist_hits()
         self.assertEqual(b.hits, 1)
 
 
@@ -84,6 +92,7 @@ class TestBlocklist(BaseTestCase):
         b = Blocklist(phone_number=self.user_phone, ip_address=self.user_ip)
         db.session.add(b)
         db.session.commit()
+        invalidate_blocklist()
 
         self.assertEqual(len(Blocklist.active_blocks()), 1)
 
@@ -93,6 +102,7 @@ class TestBlocklist(BaseTestCase):
         other_blocked = Blocklist.user_blocked(self.other_phone, self.other_ip)
         self.assertFalse(other_blocked)
 
+        flush_blocklist_hits()
         self.assertEqual(b.hits, 1)
 
     def test_separate_phone_ip_blocks(self):
@@ -101,6 +111,7 @@ class TestBlocklist(BaseTestCase):
         db.session.add(b_phone)
         db.session.add(b_ip)
         db.session.commit()
+        invalidate_blocklist()
 
         self.assertEqual(len(Blocklist.active_blocks()), 2)
 
@@ -110,6 +121,7 @@ class TestBlocklist(BaseTestCase):
         other_blocked = Blocklist.user_blocked(self.other_phone, self.other_ip)
         self.assertFalse(other_blocked)
 
+        flush_blocklist_hits()
         self.assertEqual(b_phone.hits, 1)
         self.assertEqual(b_ip.hits, 1)
 
@@ -122,16 +134,19 @@ class TestBlocklist(BaseTestCase):
         db.session.add(b_phone)
         db.session.add(b_ip)
         db.session.commit()
+        invalidate_blocklist()
 
         self.assertEqual(len(Blocklist.active_blocks()), 2)
 
         is_blocked = Blocklist.user_blocked(self.user_phone, self.user_ip)
         self.assertTrue(is_blocked)
+        flush_blocklist_hits()
         self.assertEqual(b_phone.hits, 1)
         self.assertEqual(b_ip.hits, 0)
 
         someone_else_blocked = Blocklist.user_blocked(some_other_phone, some_other_ip)
         self.assertTrue(someone_else_blocked)
+        flush_blocklist_hits()
         self.assertEqual(b_phone.hits, 1)
         self.assertEqual(b_ip.hits, 1)    
    
@@ -145,16 +160,19 @@ class TestBlocklist(BaseTestCase):
 
         db.session.add(b)
         db.session.commit()
+        invalidate_blocklist()
 
         self.assertEqual(len(Blocklist.active_blocks()), 1)
         is_blocked = Blocklist.user_blocked(self.user_phone, self.user_ip)
         self.assertTrue(is_blocked)
+        flush_blocklist_hits()
         self.assertEqual(b.hits, 1)
 
         # move creation timestamp backwards to expire it
         b.timestamp = b.timestamp - one_hour - timedelta(minutes=2)
         db.session.add(b)
         db.session.commit()
+        invalidate_blocklist()
 
         self.assertEqual(len(Blocklist.active_blocks()), 0)
         is_blocked = Blocklist.user_blocked(self.user_phone, self.user_ip)
@@ -162,4 +180,38 @@ class TestBlocklist(BaseTestCase):
 
         other_blocked = Blocklist.user_blocked(self.other_phone, self.other_ip)
         self.assertFalse(other_blocked)
+        flush_blocklist_hits()
         self.assertEqual(b.hits, 1)
+
+    def test_hits_buffered(self):
+        b = Blocklist(ip_address=self.user_ip)
+        db.session.add(b)
+        db.session.commit()
+        invalidate_blocklist()
+
+        for i in range(3):
+            self.assertTrue(Blocklist.user_blocked(self.user_phone, self.user_ip))
+        # not written until flushed
+        self.assertEqual(b.hits, 0)
+
+        self.assertEqual(flush_blocklist_hits(), 3)
+        self.assertEqual(b.hits, 3)
+        self.assertEqual(b.phone_number.e164, '+15108675309')
+
+        # counts are cleared once written
+        self.assertEqual(flush_blocklist_hits(), 0)
+        self.assertEqual(b.hits, 3)
+
+    def test_index_expires_blocks(self):
+        b = Blocklist(ip_address=self.user_ip)
+        b.expires = timedelta(hours=1)
+        db.session.add(b)
+        db.session.commit()
+        invalidate_blocklist()
+
+        index = get_blocklist_index()
+        self.assertEqual(index.match(self.user_phone, self.user_ip), set([b.id]))
+
+        # pretend an hour has passed, without rebuilding the index
+        index._expiry = [(0, b.id)]
+        self.assertEqual(index.match(self.user_phone, self.user_ip), set())
@@ -0,0 +1,78 @@
+import json
+import os
+import shutil
+import tempfile
+import unittest
+
+from call_server.political_data.boundaries import BoundaryIndex, get_boundary_index, read_features
+
+
+def square(x, y, size):
+    return [[x, y], [x + size, y], [x + size, y + size], [x, y + size], [x, y]]
+
+
+class TestBoundaryIndex(unittest.TestCase):
+
+    def setUp(self):
+        self.index = BoundaryIndex.build([
+            ('west', 'West', {'type': 'Polygon', 'coordinates': [square(-74.0, 45.0, 1.0)]}),
+            # with a hole, which is in the island
+            ('east', 'East', {'type': 'Polygon', 'coordinates': [square(-73.0, 45.0, 1.0), square(-72.75, 45.25, 0.5)]}),
+            ('island', 'Island', {'type': 'MultiPolygon', 'coordinates': [
+                [square(-72.75, 45.25, 0.5)], [square(-70.0, 45.0, 0.25)]]}),
+        ])
+
+    def test_lookup(self):
+        self.assertEqual(len(self.index), 3)
+        self.assertEqual(self.index.lookup(45.5, -73.5), ['west'])
+        self.assertEqual(self.index.lookup(45.1, -72.9), ['east'])
+
+    def test_hole(self):
+        self.assertEqual(self.index.lookup(45.5, -72.5), ['island'])
+
+    def test_multipolygon(self):
+        self.assertEqual(self.index.lookup(45.1, -69.9), ['island'])
+
+    def test_outside(self):
+        self.assertEqual(self.index.lookup(44.5, -73.5), [])
+        self.assertEqual(self.index.lookup(45.5, -71.5), [])
+        self.assertEqual(self.index.lookup(10.0, 10.0), [])
+
+
+class TestBoundaryFiles(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def write(self, name, data):
+        path = os.path.join(self.tmp_dir, name)
+        with open(path, 'w') as f:
+            json.dump(data, f)
+        return path
+
+    def test_read_represent(self):
+        path = self.write('represent.json', {'objects': [
+            {'name': 'West', 'url': '/boundaries/test/1/',
+             'simple_shape': {'type': 'Polygon', 'coordinates': [square(-74.0, 45.0, 1.0)]}}]})
+        features = list(read_features(path))
+        self.assertEqual(features[0][0], {'name': 'West', 'url': '/boundaries/test/1/'})
+        self.assertEqual(features[0][1]['type'], 'Polygon')
+
+    def test_get_boundary_index(self):
+        path = self.write('geo.json', {'type': 'FeatureCollection', 'features': [
+            {'type': 'Feature', 'properties': {'id': 'west', 'name': 'West'},
+             'geometry': {'type': 'Polygon', 'coordinates': [square(-74.0, 45.0, 1.0)]}}]})
+        describe = lambda properties: (properties['id'], properties['name'])
+
+        index = get_boundary_index('geo', path, describe)
+        self.assertEqual(index.lookup(45.5, -73.5), ['west'])
+        self.assertEqual(index.names, {'west': 'West'})
+        # artifact is kept next to the boundary file
+        self.assertTrue(os.path.exists(os.path.join(self.tmp_dir, 'geo.pickle')))
+        self.assertIs(get_boundary_index('geo', path, describe), index)
+
+    def test_missing_file(self):
+        self.assertIsNone(get_boundary_index('missing', os.path.join(self.tmp_dir, 'missing.json'), None))
@@ -1,8 +1,13 @@
+import json
 import logging
+import os
+import shutil
+import tempfile
 
 from run import BaseTestCase
 
 from call_server.political_data.lookup import locate_targets
+from call_server.political_data.countries import ca, is_political_data_key
 from call_server.political_data.countries.ca import CADataProvider
 from call_server.political_data.geocode import Location
 from call_server.campaign.models import Campaign
@@ -64,3 +69,61 @@ class TestCAData(BaseTestCase):
         self.assertEqual(mha['elected_office'], 'MNA')
         # compare on the url, not the representative_set_name, to avoid unicode comparison issues
         self.assertEqual(mha['related']['representative_set_url'], '/representative-sets/quebec-assemblee-nationale/')
+
+
+class TestCAOfflineData(BaseTestCase):
+
+    def setUp(self, **kwargs):
+        super(TestCAOfflineData, self).setUp(**kwargs)
+        self.tmp_dir = tempfile.mkdtemp()
+        with open(os.path.join(self.tmp_dir, 'ca_house_of_commons_boundaries.json'), 'w') as f:
+            json.dump({'objects': [{
+                'name': u'Ville-Marie\u2014Le Sud-Ouest\u2014\xcele-des-Soeurs',
+                'url': '/boundaries/federal-electoral-districts/24077/',
+                'simple_shape': {'type': 'MultiPolygon', 'coordinates': [[[
+                    [-73.6, 45.45], [-73.5, 45.45], [-73.5, 45.55], [-73.6, 45.55], [-73.6, 45.45]]]]},
+            }]}, f)
+        shutil.copy('call_server/political_data/data/ca_house_of_commons.csv', self.tmp_dir)
+
+        self.mock_cache = {}
+        self.ca_data = CADataProvider(self.mock_cache)
+        self.ca_data.BOUNDARIES_FILE = os.path.join(self.tmp_dir, 'ca_{body}_boundaries.json')
+        self.ca_data.REPRESENTATIVES_FILE = os.path.join(self.tmp_dir, 'ca_{body}.csv')
+        self.ca_data.load_data()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+        super(TestCAOfflineData, self).tearDown()
+
+    def test_representatives_offline(self):
+        location = Location('Montreal', (45.500577, -73.567427), {'province': 'QC'})
+        keys = self.ca_data.get_representatives(location)
+        self.assertEqual(keys, ['ca:opennorth:federal-electoral-districts:24077'])
+
+        mp = self.ca_data.cache_get(keys[0])
+        self.assertEqual(mp['elected_office'], 'MP')
+        self.assertEqual(mp['representative_set_name'], 'House of Commons')
+        self.assertEqual(mp['boundary_key'], 'federal-electoral-districts:24077')
+        self.assertIn('legislature', [o['type'] for o in mp['offices']])
+
+    def represent_representatives(self, location):
+        "get_representatives, with represent answering no representatives, returns (keys, points asked)"
+        points = []
+        representative = ca.represent.representative
+        ca.represent.representative = lambda point, repr_set: points.append(point) or []
+        try:
+            return (self.ca_data.get_representatives(location), points)
+        finally:
+            ca.represent.representative = representative
+
+    def test_outside_ridings(self):
+        location = Location('Ottawa', (45.4215, -75.6972), {'province': 'ON'})
+        self.assertEqual(self.represent_representatives(location), ([], ['45.4215,-75.6972']))
+
+    def test_not_loaded(self):
+        self.mock_cache.clear()
+        location = Location('Montreal', (45.500577, -73.567427), {'province': 'QC'})
+        self.assertEqual(self.represent_representatives(location), ([], ['45.500577,-73.567427']))
+
+    def test_kept_by_redis_clear(self):
+        self.assertTrue(is_political_data_key('ca:opennorth:federal-electoral-districts:24077'))
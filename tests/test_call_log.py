@@ -0,0 +1,91 @@
+import cPickle as pickle
+from datetime import datetime, timedelta
+
+from run import BaseTestCase
+
+from call_server.extensions import db
+from call_server.campaign.models import Campaign, Target
+from call_server.call.models import Call, Session
+from call_server.call.call_log import (log_call, log_session_ringing, log_session_status,
+    log_inbound_status, write_events, write_each)
+
+
+class TestCallLog(BaseTestCase):
+
+    def setUp(self, **kwargs):
+        super(TestCallLog, self).setUp(**kwargs)
+
+        self.campaign = Campaign(name='Test Call Log', country_code='us',
+            campaign_type='custom', campaign_language='en', segment_by='custom')
+        self.target = Target(uid='custom:T1', title='Senator', name='Test Target')
+        db.session.add(self.campaign)
+        db.session.add(self.target)
+        db.session.commit()
+
+        self.call_session = Session(campaign_id=self.campaign.id)
+        db.session.add(self.call_session)
+        db.session.commit()
+
+    def call_event(self, call_id, status='completed', target_id=None):
+        return ('call', {'timestamp': datetime.utcnow(), 'session_id': self.call_session.id,
+            'campaign_id': self.campaign.id, 'target_id': target_id or self.target.id,
+            'call_id': call_id, 'status': status, 'duration': '42'})
+
+    def test_log_call(self):
+        log_call(self.call_session.id, self.campaign.id, self.target.id, 'CA123', 'completed', '42')
+
+        call = Call.query.one()
+        self.assertEqual(call.call_id, 'CA123')
+        self.assertEqual(call.status, 'completed')
+        self.assertEqual(call.duration, 42)
+
+    def test_retried_call_logged_once(self):
+        self.assertEqual(write_events([self.call_event('CA123'), self.call_event('CA123')]), 1)
+        self.assertEqual(write_events([self.call_event('CA123')]), 0)
+        self.assertEqual(write_events([self.call_event(None), self.call_event(None)]), 2)
+        self.assertEqual(Call.query.count(), 3)
+
+    def test_session_status(self):
+        log_session_ringing(self.call_session.id)
+        queue_delay = Session.query.get(self.call_session.id).queue_delay
+        self.assertIsNotNone(queue_delay)
+
+        # only the first ringing event counts
+        log_session_ringing(self.call_session.id)
+        log_session_status(self.call_session.id, 'completed', '120')
+
+        db.session.expire_all()
+        call_session = Session.query.get(self.call_session.id)
+        self.assertEqual(call_session.queue_delay, queue_delay)
+        self.assertEqual(call_session.status, 'completed')
+        self.assertEqual(call_session.duration, 120)
+
+    def test_status_callback(self):
+        params = {'campaignId': self.campaign.id, 'userPhone': '+15105550100',
+            'sessionId': self.call_session.id, 'targetIds': self.target.uid}
+        response = self.client.post('/call/status_callback', data=dict(params, CallStatus='ringing'))
+        self.assertEqual(response.status_code, 200)
+        self.client.post('/call/status_callback', data=dict(params, CallStatus='completed', CallDuration='90'))
+
+        db.session.expire_all()
+        call_session = Session.query.get(self.call_session.id)
+        self.assertIsNotNone(call_session.queue_delay)
+        self.assertEqual(call_session.status, 'completed')
+        self.assertEqual(call_session.duration, 90)
+
+    def test_inbound_status(self):
+        inbound = Session(campaign_id=self.campaign.id, phone_number='+15105550100', direction='inbound')
+        db.session.add(inbound)
+        db.session.commit()
+
+        log_inbound_status(Session.hash_phone('+15105550100'), self.campaign.id, None, 'completed', '60')
+
+        db.session.expire_all()
+        self.assertEqual(Session.query.get(inbound.id).status, 'completed')
+        self.assertEqual(Session.query.get(self.call_session.id).status, 'initiated')
+
+    def test_write_each(self):
+        good = pickle.dumps(self.call_event('CA123'))
+        unknown = pickle.dumps(('unknown', {}))
+        self.assertEqual(write_each([good, 'not a pickle', unknown]), ['not a pickle', unknown])
+        self.assertEqual(Call.query.one().call_id, 'CA123')
@@ -0,0 +1,102 @@
+from run import BaseTestCase
+
+from call_server.extensions import db, cache
+from call_server.political_data import bump_political_data_version
+from call_server.campaign.models import Campaign
+from call_server.campaign.snapshot import _snapshots
+from call_server.call.models import Call, Session
+from call_server.call.plan import get_call_plan
+
+
+class TestCallPlan(BaseTestCase):
+
+    def setUp(self, **kwargs):
+        super(TestCallPlan, self).setUp(**kwargs)
+
+        self.campaign = Campaign(name='Test Plan', country_code='us',
+            campaign_type='custom', campaign_language='en', segment_by='custom')
+        db.session.add(self.campaign)
+        db.session.commit()
+        _snapshots.clear()
+
+        self.call_session = Session(campaign_id=self.campaign.id, phone_number='5105550199')
+        db.session.add(self.call_session)
+        db.session.commit()
+
+        self.keys = ['us:bioguide:T000001', 'us:bioguide:T000002']
+        for (n, key) in enumerate(self.keys):
+            cache.set(key, [{
+                'first_name': 'Test',
+                'last_name': 'Target %d' % n,
+                'title': 'Representative',
+                'phone': '202-555-010%d' % n,
+                'state': 'CA',
+                'district': '13'
+            }])
+        bump_political_data_version()
+
+    def start_calls(self):
+        return self.client.post('/call/make_calls', data={
+            'campaignId': self.campaign.id,
+            'sessionId': self.call_session.id,
+            'userPhone': '5105550199',
+            'targetIds': self.keys
+        })
+
+    def test_plan_stored(self):
+        response = self.start_calls()
+        self.assert200(response)
+        self.assertNotIn('targetIds', response.data)
+        self.assertIn('sessionId=%d' % self.call_session.id, response.data)
+
+        plan = get_call_plan(self.call_session.id)
+        self.assertEqual(len(plan), 2)
+        self.assertEqual(plan.user_phone, '+15105550199')
+        self.assertEqual(plan[0].target_key, self.keys[0])
+        self.assertEqual(plan[1].phone, '+12025550101')
+
+    def test_make_single_from_plan(self):
+        self.start_calls()
+        response = self.client.post('/call/make_single', data={
+            'sessionId': self.call_session.id,
+            'call_index': 1
+        })
+        self.assert200(response)
+        self.assertIn('+12025550101</Number>', response.data)
+        self.assertIn('callerId="+15105550199"', response.data)
+
+    def test_complete_from_plan(self):
+        self.start_calls()
+        plan = get_call_plan(self.call_session.id)
+
+        response = self.client.post('/call/complete', data={
+            'sessionId': self.call_session.id,
+            'call_index': 0,
+            'DialCallStatus': 'completed'
+        })
+        self.assert200(response)
+        self.assertIn('call_index=1', response.data)
+
+        call = Call.query.one()
+        self.assertEqual(call.session_id, self.call_session.id)
+        self.assertEqual(call.target_id, plan[0].target_id)
+
+    def test_legacy_params(self):
+        # calls started before plans were stored still carry their targets
+        response = self.client.post('/call/make_single', data={
+            'campaignId': self.campaign.id,
+            'sessionId': self.call_session.id,
+            'userPhone': '5105550199',
+            'targetIds': self.keys,
+            'call_index': 0
+        })
+        self.assert200(response)
+        self.assertIn('+12025550100</Number>', response.data)
+        self.assertIsNotNone(get_call_plan(self.call_session.id))
+
+    def test_missing_plan(self):
+        response = self.client.post('/call/make_single', data={
+            'sessionId': self.call_session.id + 1,
+            'call_index': 0
+        })
+        self.assert400(response)
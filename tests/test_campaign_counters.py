@@ -0,0 +1,111 @@
+import json
+from datetime import datetime, timedelta
+
+from run import BaseTestCase
+
+from call_server.extensions import db, cache
+from call_server.campaign.models import Campaign, Target
+from call_server.call.models import Call, Session
+from call_server.stats.counters import (count_completed_call, get_campaign_counts,
+    reconcile_campaign_counters, KEY_TOTAL)
+
+
+class TestCampaignCounters(BaseTestCase):
+
+    def setUp(self, **kwargs):
+        super(TestCampaignCounters, self).setUp(**kwargs)
+        cache.clear()
+
+        self.campaign = Campaign(name='Test Counters', country_code='us',
+            campaign_type='custom', campaign_language='en', segment_by='custom')
+        self.target = Target(uid='custom:T1', title='Senator', name='Test Target')
+        db.session.add(self.campaign)
+        db.session.add(self.target)
+        db.session.commit()
+
+        self.queued = []
+        self.queue = reconcile_campaign_counters.queue
+        reconcile_campaign_counters.queue = lambda *args, **kwargs: self.queued.append(args)
+
+    def tearDown(self):
+        reconcile_campaign_counters.queue = self.queue
+        super(TestCampaignCounters, self).tearDown()
+
+    def add_calls(self, timestamp, statuses, referral_code=None):
+        call_session = Session(campaign_id=self.campaign.id)
+        call_session.referral_code = referral_code
+        db.session.add(call_session)
+        db.session.commit()
+
+        for status in statuses:
+            call = Call(call_session.id, self.campaign.id, self.target.id, status=status)
+            call.timestamp = timestamp
+            db.session.add(call)
+            if status == 'completed':
+                count_completed_call(self.campaign.id, referral_code, now=timestamp)
+        db.session.commit()
+
+    def test_seeded_from_database(self):
+        now = datetime.utcnow()
+        self.add_calls(now - timedelta(days=30), ['completed'])
+        self.add_calls(now - timedelta(days=3), ['completed', 'busy'])
+        self.add_calls(now, ['completed'] * 3, referral_code='abc')
+        self.add_calls(now, ['completed'], referral_code='xyz')
+        cache.clear()
+
+        reconcile_campaign_counters(self.campaign.id)
+        self.assertEqual(get_campaign_counts(self.campaign.id), {
+            'completed': 6,
+            'last_24h': 4,
+            'last_week': 5,
+            'referral_codes': {'abc': 3}
+        })
+
+    def test_unseeded_read_queues_reconcile(self):
+        self.add_calls(datetime.utcnow() - timedelta(days=2), ['completed'])
+        cache.clear()
+
+        # served from the counters as they are, and seeded by the job
+        self.assertEqual(get_campaign_counts(self.campaign.id)['completed'], 0)
+        get_campaign_counts(self.campaign.id)
+        self.assertEqual(self.queued, [(self.campaign.id,)])
+
+        reconcile_campaign_counters(self.campaign.id)
+        self.assertEqual(get_campaign_counts(self.campaign.id)['completed'], 1)
+        self.assertEqual(len(self.queued), 1)
+
+    def test_counted_live(self):
+        get_campaign_counts(self.campaign.id)
+        self.add_calls(datetime.utcnow(), ['completed', 'completed', 'no-answer'])
+
+        counts = get_campaign_counts(self.campaign.id)
+        self.assertEqual(counts['completed'], 2)
+        self.assertEqual(counts['last_24h'], 2)
+
+    def test_current_hour_counted_once(self):
+        self.add_calls(datetime.utcnow() - timedelta(minutes=2), ['completed'])
+        reconcile_campaign_counters(self.campaign.id)
+        self.assertEqual(get_campaign_counts(self.campaign.id)['last_24h'], 1)
+
+    def test_reconcile_resets_drift(self):
+        self.add_calls(datetime.utcnow() - timedelta(days=2), ['completed'])
+        self.assertEqual(reconcile_campaign_counters(self.campaign.id), 0)
+
+        cache.cache.inc(KEY_TOTAL.format(campaign_id=self.campaign.id), 5)
+        self.assertEqual(reconcile_campaign_counters(self.campaign.id), 1)
+        self.assertEqual(get_campaign_counts(self.campaign.id)['completed'], 1)
+
+    def test_retried_webhook_counted_once(self):
+        get_campaign_counts(self.campaign.id)
+        for call_id in ('CA123', 'CA123', 'CA456'):
+            count_completed_call(self.campaign.id, call_id=call_id, target_id=self.target.id)
+        # the same call to another target is counted
+        count_completed_call(self.campaign.id, call_id='CA123', target_id=self.target.id + 1)
+        self.assertEqual(get_campaign_counts(self.campaign.id)['completed'], 3)
+
+    def test_count_json(self):
+        self.add_calls(datetime.utcnow(), ['completed'])
+
+        response = self.client.get('/api/campaign/%d/count.json' % self.campaign.id)
+        self.assert200(response)
+        self.assertEqual(json.loads(response.data)['completed'], 1)
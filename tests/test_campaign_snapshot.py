@@ -0,0 +1,127 @@
+import logging
+
+from run import BaseTestCase
+
+from call_server.extensions import db, cache
+from call_server.political_data import bump_political_data_version
+from call_server.campaign.models import Campaign, Target, AudioRecording, CampaignAudioRecording
+from call_server.campaign.snapshot import (get_campaign_snapshot, invalidate_campaign_snapshot,
+    resolve_targets, FrozenError, _snapshots)
+
+
+class TestCampaignSnapshot(BaseTestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        # quiet logging
+        logging.getLogger(__name__).setLevel(logging.WARNING)
+
+    def setUp(self, **kwargs):
+        super(TestCampaignSnapshot, self).setUp(**kwargs)
+
+        self.campaign = Campaign(name='Test Snapshot', country_code='us',
+            campaign_type='custom', campaign_language='en', segment_by='custom')
+        db.session.add(self.campaign)
+        db.session.commit()
+
+        recording = AudioRecording(key='msg_intro', version=1, text_to_speech='Hello {{name}}')
+        db.session.add(recording)
+        db.session.add(CampaignAudioRecording(campaign=self.campaign, recording=recording, selected=True))
+        db.session.commit()
+
+        _snapshots.clear()
+        invalidate_campaign_snapshot(self.campaign.id)
+
+    def test_snapshot_matches_campaign(self):
+        snapshot = get_campaign_snapshot(self.campaign.id)
+        self.assertEqual(snapshot.name, self.campaign.name)
+        self.assertEqual(snapshot.language_code, 'en-US')
+        self.assertEqual(snapshot.status, self.campaign.status)
+        self.assertEqual(snapshot.audio('msg_intro').text_to_speech, 'Hello {{name}}')
+        self.assertTrue(snapshot.has_audio('msg_intro'))
+        self.assertEqual(snapshot.audio_or_default('msg_goodbye'), self.campaign.audio_or_default('msg_goodbye'))
+
+    def test_snapshot_reused(self):
+        snapshot = get_campaign_snapshot(self.campaign.id)
+        self.assertIs(get_campaign_snapshot(self.campaign.id), snapshot)
+
+    def test_snapshot_from_shared_cache(self):
+        snapshot = get_campaign_snapshot(self.campaign.id)
+        _snapshots.clear()
+        cached = get_campaign_snapshot(self.campaign.id)
+        self.assertIsNot(cached, snapshot)
+        self.assertEqual(cached.version, snapshot.version)
+
+    def test_invalidate(self):
+        snapshot = get_campaign_snapshot(self.campaign.id)
+
+        self.campaign.name = 'Test Snapshot Renamed'
+        db.session.add(self.campaign)
+        db.session.commit()
+        self.assertEqual(get_campaign_snapshot(self.campaign.id).name, 'Test Snapshot')
+
+        invalidate_campaign_snapshot(self.campaign.id)
+        updated = get_campaign_snapshot(self.campaign.id)
+        self.assertNotEqual(updated.version, snapshot.version)
+        self.assertEqual(updated.name, 'Test Snapshot Renamed')
+
+    def test_read_only(self):
+        snapshot = get_campaign_snapshot(self.campaign.id)
+        with self.assertRaises(FrozenError):
+            snapshot.name = 'Changed'
+
+    def test_missing_campaign(self):
+        self.assertIsNone(get_campaign_snapshot(self.campaign.id + 1))
+
+
+class TestResolveTargets(BaseTestCase):
+
+    def setUp(self, **kwargs):
+        super(TestResolveTargets, self).setUp(**kwargs)
+
+        self.key = 'us:bioguide:T000001'
+        cache.set(self.key, [{
+            'first_name': 'Test',
+            'last_name': 'Target',
+            'bioguide_id': 'T000001',
+            'title': 'Representative',
+            'phone': '202-555-0100',
+            'state': 'CA',
+            'district': '13',
+            'offices': [{'id': 'T000001-oakland', 'city': 'Oakland', 'state': 'CA', 'phone': '510-555-0100'}]
+        }])
+        bump_political_data_version()
+
+    def test_get_or_create_many(self):
+        results = Target.get_or_create_many([self.key, self.key])
+        self.assertEqual(len(results), 2)
+        (target, created) = results[0]
+        self.assertTrue(created)
+        self.assertIs(results[1][0], target)
+        self.assertEqual(target.name, 'Test Target')
+        self.assertEqual(len(target.offices), 1)
+
+        (target, created) = Target.get_or_create_many([self.key])[0]
+        self.assertFalse(created)
+        self.assertEqual(Target.query.count(), 1)
+
+    def test_get_or_create_wraps_many(self):
+        (target, created) = Target.get_or_create('T000001', 'us:bioguide')
+        self.assertTrue(created)
+        self.assertEqual(target.uid, self.key)
+
+    def test_resolve_targets_memoized(self):
+        first = resolve_targets([self.key])[0]
+        self.assertEqual(first.name, 'Test Target')
+        self.assertEqual(first.offices[0].phone_number(), '+15105550100')
+
+        # remove from database, memoized snapshot is still returned
+        Target.query.filter_by(uid=self.key).delete()
+        db.session.commit()
+        self.assertIs(resolve_targets([self.key])[0], first)
+
+        # until political data changes
+        bump_political_data_version()
+        second = resolve_targets([self.key])[0]
+        self.assertIsNot(second, first)
+        self.assertEqual(second.name, 'Test Target')
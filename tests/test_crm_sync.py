@@ -0,0 +1,160 @@
+from threading import Lock
+from unittest import skipIf
+
+from run import BaseTestCase
+
+from call_server.extensions import db
+from call_server.campaign.models import Campaign, Target
+from call_server.call.models import Call, Session
+from call_server.call import vault
+from call_server.sync import pipeline
+from call_server.sync.models import SyncCampaign, SyncCall
+from call_server.sync.integrations import CRMIntegration
+from call_server.sync.pipeline import CRMSync
+
+
+class RecordingIntegration(CRMIntegration):
+    """Answers from dicts, and records each request"""
+
+    def __init__(self, phones, users, failing_sids=(), failing_saves=False):
+        super(RecordingIntegration, self).__init__()
+        self.phones = phones
+        self.users = users
+        self.failing_sids = failing_sids
+        self.failing_saves = failing_saves
+        self.requests = []
+        self.lock = Lock()
+
+    def record(self, *request):
+        with self.lock:
+            self.requests.append(request)
+
+    def get_phone(self, twilio_sid):
+        self.record('get_phone', twilio_sid)
+        if twilio_sid in self.failing_sids:
+            raise IOError('twilio unavailable')
+        return self.phones.get(twilio_sid)
+
+    def get_user(self, phone_number):
+        self.record('get_user', phone_number)
+        return self.users.get(phone_number)
+
+    def save_action(self, call, crm_campaign_id, crm_user):
+        self.record('save_action', call.id, crm_user['id'])
+        if self.failing_saves:
+            raise IOError('crm unavailable')
+        return True
+
+
+class TestCRMSync(BaseTestCase):
+
+    def setUp(self, **kwargs):
+        super(TestCRMSync, self).setUp(**kwargs)
+        pipeline.BACKOFF = 0
+
+        self.campaign = Campaign(name='Test Sync', country_code='us',
+            campaign_type='custom', campaign_language='en', segment_by='custom')
+        self.target = Target(uid='custom:T1', title='Senator', name='Test Target')
+        db.session.add(self.campaign)
+        db.session.add(self.target)
+        db.session.commit()
+
+        # SyncCampaign schedules its job on creation, so insert the row directly
+        db.session.execute(SyncCampaign.__table__.insert(),
+            {'campaign_id': self.campaign.id, 'crm_id': 'callpower-test'})
+        db.session.commit()
+        self.sync_campaign = SyncCampaign.query.one()
+
+    def add_session_calls(self, sid, n):
+        call_session = Session(campaign_id=self.campaign.id)
+        db.session.add(call_session)
+        db.session.commit()
+        for i in range(n):
+            db.session.add(Call(call_session.id, self.campaign.id, self.target.id, call_id=sid, status='completed'))
+        db.session.commit()
+
+    def test_lookups_deduplicated(self):
+        self.add_session_calls('CA1', 3)
+        self.add_session_calls('CA2', 2)
+        self.add_session_calls('CA3', 1)
+        integration = RecordingIntegration(
+            phones={'CA1': '+15105550100', 'CA2': '+15105550100', 'CA3': '+15105550101'},
+            users={'+15105550100': {'id': 1}})
+
+        self.assertEqual(CRMSync(integration, workers=2).sync_campaign(self.sync_campaign), 6)
+
+        requests = [r[0] for r in integration.requests]
+        self.assertEqual(requests.count('get_phone'), 3)
+        self.assertEqual(requests.count('get_user'), 2)
+        self.assertEqual(requests.count('save_action'), 5)
+        self.assertEqual(SyncCall.query.count(), 5)
+        self.assertEqual(self.sync_campaign.last_call_id, Call.query.order_by(Call.id.desc()).first().id)
+
+        # nothing left to sync
+        self.assertEqual(CRMSync(integration).sync_campaign(self.sync_campaign), 0)
+
+    def test_failure_checkpointed(self):
+        self.add_session_calls('CA1', 1)
+        self.add_session_calls('CA2', 1)
+        self.add_session_calls('CA3', 1)
+        phones = {'CA1': '+15105550100', 'CA2': '+15105550101', 'CA3': '+15105550102'}
+        users = dict((phone, {'id': phone}) for phone in phones.values())
+        (first, second, third) = [c.id for c in Call.query.order_by(Call.id)]
+
+        integration = RecordingIntegration(phones, users, failing_sids=['CA2'])
+        CRMSync(integration).sync_campaign(self.sync_campaign)
+        # attempted once, and retried
+        self.assertEqual(integration.requests.count(('get_phone', 'CA2')), pipeline.RETRIES + 1)
+        self.assertEqual(self.sync_campaign.last_call_id, second - 1)
+        self.assertEqual(sorted(s.call_id for s in SyncCall.query), [first, third])
+
+        # the next run picks up the failed call only
+        integration = RecordingIntegration(phones, users)
+        self.assertEqual(CRMSync(integration).sync_campaign(self.sync_campaign), 1)
+        self.assertEqual(SyncCall.query.count(), 3)
+        self.assertEqual(self.sync_campaign.last_call_id, second)
+
+    def test_failing_call_skipped(self):
+        self.add_session_calls('CA1', 1)
+        self.add_session_calls('CA2', 1)
+        phones = {'CA1': '+15105550100', 'CA2': '+15105550101'}
+        users = dict((phone, {'id': phone}) for phone in phones.values())
+        first = Call.query.order_by(Call.id).first().id
+
+        pipeline.MAX_FAILED_RUNS = 2
+        try:
+            integration = RecordingIntegration(phones, users, failing_sids=['CA1'])
+            CRMSync(integration).sync_campaign(self.sync_campaign)
+            self.assertEqual(self.sync_campaign.last_call_id, first - 1)
+            self.assertEqual(SyncCall.query.count(), 1)
+
+            # skipped on its second failed run
+            CRMSync(integration).sync_campaign(self.sync_campaign)
+            self.assertEqual(self.sync_campaign.last_call_id, first)
+            self.assertEqual(SyncCall.query.count(), 2)
+            self.assertFalse(SyncCall.query.filter_by(call_id=first).one().saved)
+        finally:
+            pipeline.MAX_FAILED_RUNS = 24
+
+    def test_save_action_not_retried(self):
+        self.add_session_calls('CA1', 1)
+        integration = RecordingIntegration({'CA1': '+15105550100'}, {'+15105550100': {'id': 1}},
+            failing_saves=True)
+
+        CRMSync(integration).sync_campaign(self.sync_campaign)
+        self.assertEqual([r[0] for r in integration.requests].count('save_action'), 1)
+        self.assertEqual(SyncCall.query.count(), 0)
+
+    @skipIf(vault.Fernet is None, 'cryptography is not installed')
+    def test_phones_from_vault(self):
+        self.app.config['PHONE_VAULT_KEY'] = vault.Fernet.generate_key()
+        self.add_session_calls('CA1', 2)
+        session_id = Call.query.first().session_id
+        vault.store_phone(session_id, '+15105550100')
+        integration = RecordingIntegration(phones={}, users={'+15105550100': {'id': 1}})
+
+        CRMSync(integration).sync_campaign(self.sync_campaign)
+        self.assertNotIn('get_phone', [r[0] for r in integration.requests])
+        self.assertEqual(SyncCall.query.count(), 2)
+        # purged once synced
+        self.assertEqual(vault.get_phones([session_id]), {})
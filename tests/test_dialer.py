@@ -0,0 +1,78 @@
+from run import BaseTestCase
+
+from twilio.base.exceptions import TwilioRestException
+
+from call_server.extensions import db
+from call_server.campaign.models import Campaign
+from call_server.call.models import Session
+from call_server.call.dialer import TokenBucket, Pacer, place_call, dialer_metrics
+
+
+class TestTokenBucket(BaseTestCase):
+
+    def test_rate(self):
+        bucket = TokenBucket(2, now=0)
+        self.assertEqual(bucket.wait(0), 0)
+        bucket.take(0)
+        bucket.take(0)
+        self.assertEqual(bucket.wait(0), 0.5)
+        self.assertEqual(bucket.wait(0.25), 0.25)
+        self.assertEqual(bucket.wait(0.5), 0)
+
+    def test_burst_limited(self):
+        bucket = TokenBucket(1, burst=3, now=0)
+        # idle for a long time only allows a burst of 3
+        for i in range(3):
+            self.assertEqual(bucket.wait(100), 0)
+            bucket.take(100)
+        self.assertEqual(bucket.wait(100), 1)
+
+    def test_pacer_account_and_number(self):
+        pacer = Pacer(account_cps=2, number_cps=1, now=0)
+        pacer.take('+15105550100', 0)
+        # the number is limited to one call a second
+        self.assertEqual(pacer.wait('+15105550100', 0), 1)
+        self.assertEqual(pacer.wait('+15105550101', 0), 0)
+        pacer.take('+15105550101', 0)
+        # and the account to two
+        self.assertEqual(pacer.wait('+15105550102', 0), 0.5)
+
+
+class FailingTwilio(object):
+    def __init__(self):
+        self.calls = self
+
+    def create(self, **kwargs):
+        raise TwilioRestException(400, '/Calls', msg='invalid number')
+
+
+class TestPlaceCall(BaseTestCase):
+
+    def setUp(self, **kwargs):
+        super(TestPlaceCall, self).setUp(**kwargs)
+        self.app.config['ADMIN_API_KEY'] = 'test-key'
+        self.app.secret_key = 'test'
+
+        self.campaign = Campaign(name='Test Dialer', country_code='us',
+            campaign_type='custom', campaign_language='en', segment_by='custom')
+        db.session.add(self.campaign)
+        db.session.commit()
+        self.call_session = Session(campaign_id=self.campaign.id)
+        db.session.add(self.call_session)
+        db.session.commit()
+
+    def test_twilio_error(self):
+        self.app.config['TWILIO_CLIENT'] = FailingTwilio()
+        self.app.config['SERVER_NAME'] = 'localhost'
+        placed = place_call({'session_id': self.call_session.id,
+            'params': {'campaignId': self.campaign.id, 'sessionId': self.call_session.id},
+            'user_phone': '+15105550100', 'from_number': '+15105550199'})
+        self.assertFalse(placed)
+
+    def test_metrics_without_queue(self):
+        self.assertEqual(dialer_metrics()['enabled'], False)
+        self.assertEqual(dialer_metrics()['depth'], 0)
+
+        response = self.client.get('/api/dialer.json?api_key=test-key')
+        self.assert200(response)
+        self.assertEqual(response.json['dialed'], 0)
@@ -0,0 +1,73 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+from call_server.political_data.district_index import (build_district_index, get_district_index,
+    DistrictIndex, DistrictIndexError)
+
+
+class TestDistrictIndex(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.tmp_dir, 'us_districts.idx')
+
+        self.districts = [
+            {'state': 'WI', 'zipcode': '53811', 'house_district': '3'},
+            {'state': 'CA', 'zipcode': '94612', 'house_district': '13'},
+            {'state': 'KY', 'zipcode': '42223', 'house_district': '1'},
+            {'state': 'WI', 'zipcode': '53811', 'house_district': '2'},
+            {'state': 'TN', 'zipcode': '42223', 'house_district': '7'},
+            {'state': 'MA', 'zipcode': '02111', 'house_district': '8'},
+            {'state': 'DC', 'zipcode': '20001', 'house_district': '0'},
+        ]
+        build_district_index(self.districts, self.path)
+        self.index = DistrictIndex(self.path)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def test_count(self):
+        self.assertEqual(len(self.index), len(self.districts))
+
+    def test_single(self):
+        self.assertEqual(self.index.get('94612'), [{'state': 'CA', 'zipcode': '94612', 'house_district': '13'}])
+
+    def test_leading_zero(self):
+        self.assertEqual(self.index.get('02111'), [{'state': 'MA', 'zipcode': '02111', 'house_district': '8'}])
+        self.assertEqual(self.index.get('20001')[0]['house_district'], '0')
+
+    def test_multiple_keeps_order(self):
+        districts = self.index.get('53811')
+        self.assertEqual([d['house_district'] for d in districts], ['3', '2'])
+
+        districts = self.index.get('42223')
+        self.assertEqual([d['state'] for d in districts], ['KY', 'TN'])
+
+    def test_missing(self):
+        self.assertEqual(self.index.get('99999'), [])
+        self.assertEqual(self.index.get('00000'), [])
+        self.assertEqual(self.index.get('9461'), [])
+        self.assertEqual(self.index.get('94612-1234'), [])
+
+    def test_reload_after_rebuild(self):
+        first = get_district_index(self.path)
+        self.assertEqual(len(first), len(self.districts))
+
+        # bump mtime, filesystems may not have subsecond resolution
+        build_district_index(self.districts[:2], self.path)
+        stat = os.stat(self.path)
+        os.utime(self.path, (stat.st_atime, stat.st_mtime + 10))
+
+        second = get_district_index(self.path)
+        self.assertEqual(len(second), 2)
+
+    def test_not_built(self):
+        self.assertIsNone(get_district_index(os.path.join(self.tmp_dir, 'missing.idx')))
+
+    def test_truncated(self):
+        with open(self.path, 'r+b') as f:
+            f.truncate(20)
+        with self.assertRaises(DistrictIndexError):
+            DistrictIndex(self.path)
@@ -0,0 +1,62 @@
+import csv
+import json
+from datetime import datetime, timedelta
+from StringIO import StringIO
+
+from run import BaseTestCase
+
+from call_server.extensions import db
+from call_server.campaign.models import Campaign, Target
+from call_server.call.models import Call, Session
+
+
+class TestExport(BaseTestCase):
+
+    def setUp(self, **kwargs):
+        super(TestExport, self).setUp(**kwargs)
+        self.app.config['ADMIN_API_KEY'] = 'test-key'
+        self.app.secret_key = 'test'
+
+        self.campaign = Campaign(name='Test Export', country_code='us',
+            campaign_type='custom', campaign_language='en', segment_by='custom')
+        self.target = Target(uid='custom:T1', title='Senator', name=u'Test T\xe4rget')
+        db.session.add(self.campaign)
+        db.session.add(self.target)
+        db.session.commit()
+
+        self.call_session = Session(campaign_id=self.campaign.id, phone_number='+15105550100')
+        self.call_session.queue_delay = timedelta(seconds=3)
+        db.session.add(self.call_session)
+        db.session.commit()
+
+        for (day, status) in [(14, 'completed'), (15, 'busy')]:
+            call = Call(self.call_session.id, self.campaign.id, self.target.id, call_id='CA%d' % day, status=status)
+            call.timestamp = datetime(2019, 3, day, 10)
+            db.session.add(call)
+        db.session.commit()
+
+    def export(self, path, query=''):
+        response = self.client.get('/api/campaign/%d/%s?api_key=test-key%s' % (self.campaign.id, path, query))
+        self.assert200(response)
+        return response
+
+    def test_calls_csv(self):
+        response = self.export('calls.csv')
+        self.assertEqual(response.mimetype, 'text/csv')
+
+        rows = list(csv.DictReader(StringIO(response.data)))
+        self.assertEqual([r['call_id'] for r in rows], ['CA14', 'CA15'])
+        self.assertEqual(rows[0]['target_name'].decode('utf-8'), u'Test T\xe4rget')
+        self.assertEqual(rows[0]['timestamp'], '2019-03-14T10:00:00')
+
+    def test_calls_date_range(self):
+        response = self.export('calls.ndjson', '&start=2019-03-15')
+        rows = [json.loads(line) for line in response.data.splitlines()]
+        self.assertEqual([r['status'] for r in rows], ['busy'])
+        self.assertEqual(rows[0]['target_uid'], 'custom:T1')
+
+    def test_sessions_ndjson(self):
+        rows = [json.loads(line) for line in self.export('sessions.ndjson').data.splitlines()]
+        self.assertEqual(len(rows), 1)
+        self.assertEqual(rows[0]['phone_hash'], Session.hash_phone('+15105550100'))
+        self.assertEqual(rows[0]['queue_delay'], 3)
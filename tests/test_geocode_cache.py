@@ -0,0 +1,96 @@
+import time
+import unittest
+
+import geopy
+
+from call_server.political_data.geocode import (Geocoder, GeocodeCache, NOMINATIM_SERVICE)
+
+
+class FakeNominatim(object):
+    """Stands in for the geopy client, counting requests"""
+
+    def __init__(self, error=None):
+        self.error = error
+        self.requests = 0
+
+    def geocode(self, address, addressdetails=True):
+        self.requests += 1
+        if self.error:
+            raise self.error
+        if address.strip().lower().startswith('nowhere'):
+            return None
+        return geopy.Location('1 Frank H Ogawa Plaza, Oakland', (37.8053, -122.2725),
+            {'address': {'postcode': '94612', 'country_code': 'us', 'state': 'California'}})
+
+    def reverse(self, latlon):
+        self.requests += 1
+        if self.error:
+            raise self.error
+        return geopy.Location('Oakland', latlon,
+            {'address': {'postcode': '94612', 'country_code': 'us', 'state': 'California'}})
+
+
+class TestGeocodeCache(unittest.TestCase):
+
+    def setUp(self):
+        self.cache = GeocodeCache(size=10, ttl=60, negative_ttl=60, shared_cache=None)
+        self.geocoder = Geocoder(API_NAME='nominatim', cache=self.cache)
+        self.geocoder.client = FakeNominatim()
+        # fake client class name isn't the service name
+        self.geocoder.get_service_name = lambda: NOMINATIM_SERVICE
+
+    def test_make_key_normalizes(self):
+        self.assertEqual(GeocodeCache.make_key('Nominatim', 'address', u' 1 Main St,  Oakland '),
+                         GeocodeCache.make_key('Nominatim', 'address', '1 main st oakland'))
+        self.assertEqual(GeocodeCache.make_key('Nominatim', 'reverse', ('37.80441', '-122.26774')),
+                         'geocode:Nominatim:reverse:37.8044,-122.2677')
+
+    def test_geocode_cached(self):
+        first = self.geocoder.geocode('1 Frank H Ogawa Plaza, Oakland')
+        second = self.geocoder.geocode('1 frank h ogawa plaza oakland')
+        self.assertEqual(self.geocoder.client.requests, 1)
+
+        self.assertEqual(second.latlon, first.latlon)
+        self.assertEqual(second.postal, '94612')
+        self.assertEqual(second.state, 'CA')
+        self.assertEqual(second.service, NOMINATIM_SERVICE)
+        self.assertEqual(self.cache.stats['hit'], 1)
+        self.assertEqual(self.cache.stats['miss'], 1)
+
+    def test_reverse_cached(self):
+        self.geocoder.reverse('37.80441,-122.26774')
+        result = self.geocoder.reverse((37.80439, -122.26771))
+        self.assertEqual(self.geocoder.client.requests, 1)
+        self.assertEqual(result.postal, '94612')
+
+    def test_negative_cached(self):
+        empty = self.geocoder.geocode('nowhere at all')
+        self.assertIsNone(empty.latitude)
+        self.geocoder.geocode('nowhere at all')
+        self.assertEqual(self.geocoder.client.requests, 1)
+
+    def test_error_cached(self):
+        self.geocoder.client = FakeNominatim(error=geopy.exc.GeocoderUnavailable('down'))
+        for i in range(2):
+            with self.assertRaises(geopy.exc.GeocoderServiceError):
+                self.geocoder.reverse('37.8044,-122.2677')
+        self.assertEqual(self.geocoder.client.requests, 1)
+
+    def test_negative_expires(self):
+        self.cache.negative_ttl = 0
+        self.geocoder.geocode('nowhere at all')
+        time.sleep(0.01)
+        self.geocoder.geocode('nowhere at all')
+        self.assertEqual(self.geocoder.client.requests, 2)
+
+    def test_lru_eviction(self):
+        for i in range(12):
+            self.geocoder.geocode('%d Main St, Oakland' % i)
+        self.assertEqual(len(self.cache._local), 10)
+
+        self.geocoder.geocode('0 Main St, Oakland')
+        self.assertEqual(self.geocoder.client.requests, 13)
+
+    def test_nominatim_postal_skips_reverse(self):
+        self.geocoder.geocode('1 Frank H Ogawa Plaza, Oakland')
+        self.assertEqual(self.geocoder.client.requests, 1)
@@ -0,0 +1,98 @@
+import os
+from datetime import datetime
+from unittest import skipIf
+
+import alembic.command
+import sqlalchemy as sa
+from alembic.config import Config
+
+from run import BaseTestCase
+
+from call_server.app import create_app
+from call_server.config import TestingConfig
+from call_server.extensions import assets, db
+from call_server.campaign.models import Campaign, Target
+from call_server.call.models import Call, Session
+
+try:
+    import psycopg2
+except ImportError:
+    psycopg2 = None
+
+# an empty postgres database to migrate, eg postgresql://localhost/call_power_test
+POSTGRES_URL = os.environ.get('TEST_POSTGRES_URL')
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+class PostgresConfig(TestingConfig):
+    SQLALCHEMY_DATABASE_URI = POSTGRES_URL
+
+
+@skipIf(not POSTGRES_URL or psycopg2 is None, 'needs TEST_POSTGRES_URL and psycopg2')
+class TestPartitionMigration(BaseTestCase):
+
+    def create_app(self):
+        assets._named_bundles = {}
+        return create_app(PostgresConfig if POSTGRES_URL else TestingConfig)
+
+    def setUp(self):
+        super(TestPartitionMigration, self).setUp()
+        self.campaign = Campaign(name='Test Migration', country_code='us',
+            campaign_type='custom', campaign_language='en', segment_by='custom')
+        self.target = Target(uid='custom:T1', title='Senator', name='Test Target')
+        db.session.add(self.campaign)
+        db.session.add(self.target)
+        db.session.commit()
+
+        for timestamp in [datetime(2019, 3, 14, 10), datetime.utcnow()]:
+            call_session = Session(campaign_id=self.campaign.id)
+            call_session.timestamp = timestamp
+            db.session.add(call_session)
+            db.session.commit()
+            call = Call(call_session.id, self.campaign.id, self.target.id, status='completed', duration=30)
+            call.timestamp = timestamp
+            db.session.add(call)
+        db.session.commit()
+        db.session.remove()
+
+        self.migrate('stamp', 'c7d2e4b19a35')
+
+    def tearDown(self):
+        db.session.remove()
+        db.engine.execute('DROP TABLE IF EXISTS alembic_version')
+        super(TestPartitionMigration, self).tearDown()
+
+    def migrate(self, command, revision):
+        assets._named_bundles = {}
+        config = Config(os.path.join(ROOT, 'alembic.ini'))
+        config.set_main_option('script_location', os.path.join(ROOT, 'alembic'))
+        config.attributes['engine'] = db.engine
+        getattr(alembic.command, command)(config, revision)
+
+    def foreign_keys(self, table):
+        return sorted((fk['constrained_columns'][0], fk['referred_table'])
+                      for fk in sa.inspect(db.engine).get_foreign_keys(table))
+
+    def is_partitioned(self, table):
+        return bool(db.engine.execute("SELECT 1 FROM pg_partitioned_table WHERE partrelid = to_regclass('%s')"
+                                      % table).scalar())
+
+    def test_upgrade_downgrade(self):
+        self.migrate('upgrade', 'e5b0c3d8a6f1')
+        self.assertTrue(self.is_partitioned('calls'))
+        self.assertTrue(self.is_partitioned('calls_session'))
+        self.assertEqual(self.foreign_keys('calls'),
+                         [('campaign_id', 'campaign_campaign'), ('target_id', 'campaign_target')])
+        self.assertEqual(self.foreign_keys('calls_session'), [('campaign_id', 'campaign_campaign')])
+        self.assertEqual(Call.query.count(), 2)
+        self.assertEqual(Session.query.count(), 2)
+
+        self.migrate('downgrade', 'c7d2e4b19a35')
+        self.assertFalse(self.is_partitioned('calls'))
+        self.assertEqual(self.foreign_keys('calls'),
+                         [('campaign_id', 'campaign_campaign'), ('session_id', 'calls_session'),
+                          ('target_id', 'campaign_target')])
+        self.assertEqual(self.foreign_keys('calls_session'), [('campaign_id', 'campaign_campaign')])
+        self.assertEqual(self.foreign_keys('sync_call'), [('call_id', 'calls')])
+        self.assertEqual(Call.query.count(), 2)
+        self.assertEqual(Session.query.count(), 2)
@@ -0,0 +1,126 @@
+import time
+import threading
+import unittest
+
+import requests
+
+from call_server.political_data.openstates import (OpenStatesClient, OpenStatesError,
+    CircuitOpenError, round_latlon)
+
+
+class FakeResponse(object):
+    def __init__(self, data):
+        self.data = data
+
+    def raise_for_status(self):
+        pass
+
+    def json(self):
+        return self.data
+
+
+class FakeSession(object):
+    """Counts posts, and returns a canned response after an optional delay"""
+
+    def __init__(self, data=None, error=None, delay=0):
+        self.data = data or {'data': {'person': {'id': 'ocd-person/1'}}}
+        self.error = error
+        self.delay = delay
+        self.posts = 0
+
+    def post(self, url, data=None, timeout=None):
+        self.posts += 1
+        time.sleep(self.delay)
+        if self.error:
+            raise self.error
+        return FakeResponse(self.data)
+
+
+class TestOpenStatesClient(unittest.TestCase):
+
+    def setUp(self):
+        self.client = OpenStatesClient(cache_ttl=60, failure_threshold=2, cooldown=60)
+
+    def test_round_latlon(self):
+        self.assertEqual(round_latlon(37.804417, -122.267747), (37.804, -122.268))
+        self.assertEqual(round_latlon('37.8044', '-122.2677'), (37.804, -122.268))
+
+    def test_cached(self):
+        self.client.session = FakeSession()
+        self.assertEqual(self.client.person('ocd-person/1'), {'id': 'ocd-person/1'})
+        self.assertEqual(self.client.person('ocd-person/1'), {'id': 'ocd-person/1'})
+        self.assertEqual(self.client.session.posts, 1)
+
+    def test_expired(self):
+        self.client.cache_ttl = 0
+        self.client.session = FakeSession()
+        self.client.person('ocd-person/1')
+        self.client.person('ocd-person/1')
+        self.assertEqual(self.client.session.posts, 2)
+
+    def test_coalesce_inflight(self):
+        self.client.session = FakeSession(delay=0.2)
+        results = []
+
+        def lookup():
+            results.append(self.client.person('ocd-person/1'))
+
+        threads = [threading.Thread(target=lookup) for i in range(5)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+
+        self.assertEqual(len(results), 5)
+        self.assertEqual(self.client.session.posts, 1)
+
+    def test_query_error(self):
+        self.client.session = FakeSession(data={'errors': [{'message': 'bad query'}]})
+        with self.assertRaises(OpenStatesError):
+            self.client.person('ocd-person/1')
+        # not counted as an outage
+        self.assertEqual(self.client._failures, 0)
+
+    def test_circuit_breaker(self):
+        self.client.session = FakeSession(error=requests.ConnectionError('down'))
+        for i in range(2):
+            with self.assertRaises(OpenStatesError):
+                self.client.person('ocd-person/%d' % i)
+        self.assertEqual(self.client.session.posts, 2)
+
+        # circuit is open, fail without a request
+        with self.assertRaises(CircuitOpenError):
+            self.client.person('ocd-person/3')
+        self.assertEqual(self.client.session.posts, 2)
+
+        # and closes after cooldown
+        self.client._open_until = 0
+        self.client.session = FakeSession()
+        self.assertEqual(self.client.person('ocd-person/1'), {'id': 'ocd-person/1'})
+
+
+class PagedSession(object):
+    """Returns each page of people in turn"""
+
+    def __init__(self, pages):
+        self.pages = pages
+        self.queries = []
+
+    def post(self, url, data=None, timeout=None):
+        self.queries.append(data)
+        (people, cursor) = self.pages[len(self.queries) - 1]
+        return FakeResponse({'data': {'people': {
+            'edges': [{'node': {'id': p}} for p in people],
+            'pageInfo': {'hasNextPage': bool(cursor), 'endCursor': cursor},
+        }}})
+
+
+class TestOpenStatesPaging(unittest.TestCase):
+
+    def test_people_by_state(self):
+        client = OpenStatesClient()
+        client.session = PagedSession([(['ocd-person/1', 'ocd-person/2'], 'cursor-1'), (['ocd-person/3'], None)])
+        people = client.people_by_state('CA', page_size=2)
+        self.assertEqual([p['id'] for p in people], ['ocd-person/1', 'ocd-person/2', 'ocd-person/3'])
+        self.assertIn('state:ca/government', client.session.queries[0])
+        self.assertIn('after: \\"cursor-1\\"', client.session.queries[1])
@@ -0,0 +1,25 @@
+from datetime import datetime
+
+from run import BaseTestCase
+
+from call_server.call.partitions import (add_months, month_start, partition_name,
+    is_partitioned, create_partitions, archive_partitions)
+
+
+class TestPartitions(BaseTestCase):
+
+    def test_add_months(self):
+        self.assertEqual(add_months(datetime(2019, 11, 1), 1), datetime(2019, 12, 1))
+        self.assertEqual(add_months(datetime(2019, 12, 1), 1), datetime(2020, 1, 1))
+        self.assertEqual(add_months(datetime(2019, 1, 1), -1), datetime(2018, 12, 1))
+
+    def test_partition_name(self):
+        month = month_start(datetime(2019, 3, 15, 10, 30))
+        self.assertEqual(partition_name('calls', month), 'calls_y2019m03')
+        self.assertEqual(partition_name('calls_session', month), 'calls_session_y2019m03')
+
+    def test_not_partitioned(self):
+        # the testing database is sqlite, where tables aren't partitioned
+        self.assertFalse(is_partitioned())
+        self.assertEqual(create_partitions(), [])
+        self.assertEqual(archive_partitions(datetime(2019, 1, 1), '/nonexistent'), [])
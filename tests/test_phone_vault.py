@@ -0,0 +1,42 @@
+from unittest import skipIf
+
+from run import BaseTestCase
+
+from call_server.extensions import cache
+from call_server.call import vault
+
+
+class TestPhoneVault(BaseTestCase):
+
+    def setUp(self, **kwargs):
+        super(TestPhoneVault, self).setUp(**kwargs)
+        cache.clear()
+
+    def test_disabled_without_key(self):
+        self.app.config['PHONE_VAULT_KEY'] = None
+        vault.store_phone(1, '+15105550100')
+        self.assertFalse(vault.enabled())
+        self.assertEqual(vault.get_phones([1]), {})
+        self.assertEqual(vault.get_sessions('+15105550100'), [])
+
+    @skipIf(vault.Fernet is None, 'cryptography is not installed')
+    def test_store_and_purge(self):
+        self.app.config['PHONE_VAULT_KEY'] = vault.Fernet.generate_key()
+        vault.store_phone(1, '+15105550100')
+        vault.store_phone(2, '+15105550100')
+
+        # encrypted at rest
+        self.assertNotIn('5550100', cache.get(vault.KEY_PHONE.format(session_id=1)))
+        self.assertEqual(vault.get_phones([1, 2, 3]), {1: '+15105550100', 2: '+15105550100'})
+        self.assertEqual(vault.get_sessions('+15105550100'), [1, 2])
+
+        vault.purge_phones([1])
+        self.assertEqual(vault.get_phones([1, 2]), {2: '+15105550100'})
+        self.assertEqual(vault.get_sessions('+15105550100'), [2])
+
+    @skipIf(vault.Fernet is None, 'cryptography is not installed')
+    def test_key_rotated(self):
+        self.app.config['PHONE_VAULT_KEY'] = vault.Fernet.generate_key()
+        vault.store_phone(1, '+15105550100')
+        self.app.config['PHONE_VAULT_KEY'] = vault.Fernet.generate_key()
+        self.assertEqual(vault.get_phones([1]), {})
@@ -0,0 +1,62 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+from call_server.political_data.artifact import load_artifact, artifact_path, write_artifact, read_artifact
+
+
+class TestArtifact(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.source = os.path.join(self.tmp_dir, 'source.yaml')
+        with open(self.source, 'w') as f:
+            f.write('- first\n')
+        self.builds = []
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def build(self):
+        with open(self.source) as f:
+            data = {'lines': f.read().splitlines()}
+        self.builds.append(data)
+        return data
+
+    def load(self, **kwargs):
+        return load_artifact('test', [self.source], self.build, directory=self.tmp_dir, **kwargs)
+
+    def test_built_once(self):
+        self.assertEqual(self.load(), {'lines': ['- first']})
+        self.assertTrue(os.path.exists(artifact_path('test', self.tmp_dir)))
+        self.assertEqual(self.load(), {'lines': ['- first']})
+        self.assertEqual(len(self.builds), 1)
+
+    def test_rebuilt_when_source_changes(self):
+        self.load()
+        with open(self.source, 'a') as f:
+            f.write('- second\n')
+        self.assertEqual(self.load(), {'lines': ['- first', '- second']})
+        self.assertEqual(len(self.builds), 2)
+        # and kept until it changes again
+        self.load()
+        self.assertEqual(len(self.builds), 2)
+
+    def test_forced_rebuild(self):
+        self.load()
+        self.load(rebuild=True)
+        self.assertEqual(len(self.builds), 2)
+
+    def test_unreadable_artifact(self):
+        path = artifact_path('test', self.tmp_dir)
+        with open(path, 'w') as f:
+            f.write('not a pickle')
+        self.assertIsNone(read_artifact(path, 'abc'))
+        self.assertEqual(self.load(), {'lines': ['- first']})
+
+    def test_other_hash(self):
+        path = artifact_path('test', self.tmp_dir)
+        write_artifact(path, 'abc', [1, 2, 3])
+        self.assertEqual(read_artifact(path, 'abc'), [1, 2, 3])
+        self.assertIsNone(read_artifact(path, 'def'))
@@ -0,0 +1,67 @@
+import logging
+
+from run import BaseTestCase
+
+from call_server.political_data import check_political_data_cache_many
+from call_server.political_data.countries import PoliticalDataError, KEY_ACTIVE_VERSION
+from call_server.political_data.countries.us import USDataProvider
+
+
+class TestPoliticalDataVersions(BaseTestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        # quiet logging
+        logging.getLogger('cache').setLevel(logging.WARNING)
+
+        # load twice, to have an active version and the one before it
+        cls.mock_cache = {}  # mock flask-cache outside of application context
+        USDataProvider(cls.mock_cache, 'localmem').load_version()
+        USDataProvider(cls.mock_cache, 'localmem').load_version()
+
+    def setUp(self, **kwargs):
+        super(TestPoliticalDataVersions, self).setUp(**kwargs)
+        self.cache = dict(self.mock_cache)
+
+    def test_versioned_namespace(self):
+        self.assertEqual(self.cache[KEY_ACTIVE_VERSION.format(country_code='us')], 2)
+        self.assertIn('us:v2:senate:CA', self.cache)
+        self.assertIn('us:v1:senate:CA', self.cache)
+        self.assertNotIn('us:senate:CA', self.cache)
+
+        us_data = USDataProvider(self.cache, 'localmem')
+        self.assertEqual(us_data.version, 2)
+        self.assertEqual(len(us_data.get_senators('CA')), 2)
+        self.assertEqual(len(us_data.cache_search('us:senate:', [('state', 'ma')])), 2)
+
+    def test_old_versions_removed(self):
+        USDataProvider(self.cache, 'localmem').load_version()
+        self.assertEqual(USDataProvider(self.cache, 'localmem').version, 3)
+        self.assertFalse(any(k.startswith('us:v1:') for k in self.cache))
+        self.assertIn('us:v2:senate:CA', self.cache)
+        self.assertIn('us:v3:senate:CA', self.cache)
+
+    def test_failed_check_keeps_active_version(self):
+        class EmptyProvider(USDataProvider):
+            def _load_legislators(self):
+                return {}
+
+        with self.assertRaises(PoliticalDataError):
+            EmptyProvider(self.cache, 'localmem').load_version()
+        self.assertEqual(USDataProvider(self.cache, 'localmem').version, 2)
+        # the failed version is removed
+        self.assertFalse(any(k.startswith('us:v3:') for k in self.cache))
+
+    def test_reader_keeps_its_version(self):
+        reader = USDataProvider(self.cache, 'localmem')
+        self.assertEqual(reader.version, 2)
+        USDataProvider(self.cache, 'localmem').load_version()
+        # a request already reading version 2 carries on with it
+        self.assertEqual(reader.version, 2)
+        self.assertEqual(len(reader.get_senators('CA')), 2)
+
+    def test_political_data_cache(self):
+        key = USDataProvider(self.cache, 'localmem').get_senators('CA')[0]['bioguide_id']
+        data = check_political_data_cache_many(['us:bioguide:%s' % key], self.cache)
+        self.assertEqual(data['us:bioguide:%s' % key]['uid'], 'us:bioguide:%s' % key)
+        self.assertEqual(data['us:bioguide:%s' % key]['title'], 'Senator')
@@ -0,0 +1,49 @@
+import unittest
+
+from call_server.political_data.record_store import encode_records, decode_records, COUNT_FIELD
+from call_server.political_data.countries import unversioned_key
+
+
+class TestRecordStore(unittest.TestCase):
+
+    RECORDS = [
+        {'first_name': 'Dianne', 'last_name': 'Feinstein', 'bioguide_id': 'F000062', 'party': 'Democrat',
+         'district': None, 'offices': [{'city': 'San Francisco', 'phone': '415-393-0707'}]},
+        {'first_name': 'Kamala', 'last_name': 'Harris', 'bioguide_id': 'H001075', 'party': 'Democrat',
+         'district': None, 'offices': []},
+    ]
+
+    def test_round_trip(self):
+        mapping = encode_records(self.RECORDS)
+        self.assertEqual(mapping[COUNT_FIELD], 2)
+        count = mapping.pop(COUNT_FIELD)
+        self.assertEqual(decode_records(count, mapping), self.RECORDS)
+
+    def test_empty(self):
+        mapping = encode_records([])
+        self.assertEqual(mapping, {COUNT_FIELD: 0})
+        self.assertEqual(decode_records('0', {}), [])
+
+    def test_sparse_fields(self):
+        records = [{'state': 'WI', 'house_district': '7'}, {'state': 'WI'}]
+        mapping = encode_records(records)
+        count = mapping.pop(COUNT_FIELD)
+        self.assertEqual(decode_records(count, mapping), records)
+
+    def test_selected_fields(self):
+        mapping = encode_records(self.RECORDS)
+        # as read by hmget, with count from the hash as a string
+        columns = {'bioguide_id': mapping['bioguide_id'], 'party': mapping['party']}
+        records = decode_records(str(mapping[COUNT_FIELD]), columns)
+        self.assertEqual(records, [{'bioguide_id': 'F000062', 'party': 'Democrat'},
+                                   {'bioguide_id': 'H001075', 'party': 'Democrat'}])
+
+    def test_missing_field_columns(self):
+        # fields the records don't have come back from hmget as None
+        mapping = encode_records(self.RECORDS)
+        records = decode_records(mapping[COUNT_FIELD], {'party': mapping['party'], 'phone': None})
+        self.assertEqual(records, [{'party': 'Democrat'}, {'party': 'Democrat'}])
+
+    def test_unversioned_key(self):
+        self.assertEqual(unversioned_key('us:v3:house:CA:13'), 'us:house:CA:13')
+        self.assertEqual(unversioned_key('us:house:CA:13'), 'us:house:CA:13')
@@ -0,0 +1,139 @@
+from datetime import datetime, time, timedelta
+from threading import Lock
+
+import pytz
+
+from run import BaseTestCase
+
+from call_server.extensions import db, cache
+from call_server.admin.models import Blocklist
+from call_server.admin.blocklist import invalidate_blocklist
+from call_server.campaign.constants import STATUS_LIVE, STATUS_PAUSED
+from call_server.campaign.models import Campaign, TwilioPhoneNumber
+from call_server.call.models import Session
+from call_server.schedule.models import ScheduleCall
+from call_server.schedule.dispatch import dispatch_scheduled_calls, KEY_DISPATCHED, KEY_DISPATCHING
+
+MONDAY = datetime(2026, 10, 19, 14, 30, 20, tzinfo=pytz.utc)
+SATURDAY = datetime(2026, 10, 24, 14, 30, 20, tzinfo=pytz.utc)
+
+
+class FakeCall(object):
+    def __init__(self, status):
+        self.status = status
+
+
+class RecordingTwilio(object):
+    """Stands in for the Twilio client, and records the calls placed"""
+
+    def __init__(self):
+        self.calls = self
+        self.placed = []
+        self.lock = Lock()
+
+    def create(self, **kwargs):
+        with self.lock:
+            self.placed.append(kwargs)
+        return FakeCall('queued')
+
+
+class TestScheduleDispatch(BaseTestCase):
+
+    def setUp(self, **kwargs):
+        super(TestScheduleDispatch, self).setUp(**kwargs)
+        self.twilio = RecordingTwilio()
+        self.app.config['TWILIO_CLIENT'] = self.twilio
+        self.app.config['SERVER_NAME'] = 'localhost'
+        invalidate_blocklist()
+
+        self.number = TwilioPhoneNumber(number='+15105550199')
+        self.campaign = self.add_campaign('Live', STATUS_LIVE)
+        self.paused = self.add_campaign('Paused', STATUS_PAUSED)
+
+    def add_campaign(self, name, status_code):
+        campaign = Campaign(name=name, country_code='us', campaign_type='custom',
+            campaign_language='en', segment_by='custom', status_code=status_code)
+        campaign.phone_number_set = [self.number]
+        db.session.add(campaign)
+        db.session.commit()
+        return campaign
+
+    def subscribe(self, campaign, phone, at=time(14, 30, 5), location='94110'):
+        scheduled_call = ScheduleCall(campaign.id, phone, time=at)
+        scheduled_call.start_job(location=location)
+        db.session.add(scheduled_call)
+        db.session.commit()
+        return scheduled_call
+
+    def test_due_calls_placed(self):
+        self.subscribe(self.campaign, '+15105550100')
+        self.subscribe(self.campaign, '+15105550101', at=time(14, 31))
+        self.subscribe(self.paused, '+15105550102')
+        unsubscribed = self.subscribe(self.campaign, '+15105550103')
+        unsubscribed.stop_job()
+        db.session.commit()
+
+        self.assertEqual(dispatch_scheduled_calls(MONDAY), 1)
+        self.assertEqual([c['to'] for c in self.twilio.placed], ['+15105550100'])
+        self.assertEqual(self.twilio.placed[0]['from_'], '+15105550199')
+        self.assertIn('userLocation=94110', self.twilio.placed[0]['url'])
+
+        called = ScheduleCall.query.filter_by(phone_number='+15105550100').one()
+        self.assertEqual(called.num_calls, 1)
+        self.assertIsNotNone(called.last_called)
+        session = Session.query.one()
+        self.assertEqual(session.location, '94110')
+        self.assertIn('sessionId=%d' % session.id, self.twilio.placed[0]['url'])
+
+    def test_run_again_in_same_minute(self):
+        self.subscribe(self.campaign, '+15105550100')
+        self.assertEqual(dispatch_scheduled_calls(MONDAY), 1)
+        self.assertEqual(dispatch_scheduled_calls(MONDAY), 0)
+        self.assertEqual(len(self.twilio.placed), 1)
+
+    def test_weekends_skipped(self):
+        self.subscribe(self.campaign, '+15105550100')
+        self.assertEqual(dispatch_scheduled_calls(SATURDAY), 0)
+        self.assertEqual(self.twilio.placed, [])
+
+    def test_blocked_skipped(self):
+        self.subscribe(self.campaign, '+15105550100')
+        self.subscribe(self.campaign, '+15105550101')
+        db.session.add(Blocklist(phone_number='+15105550101'))
+        db.session.commit()
+        invalidate_blocklist()
+
+        self.assertEqual(dispatch_scheduled_calls(MONDAY), 1)
+        self.assertEqual([c['to'] for c in self.twilio.placed], ['+15105550100'])
+
+    def test_late_run_catches_up(self):
+        self.subscribe(self.campaign, '+15105550100', at=time(14, 27))
+        self.subscribe(self.campaign, '+15105550101', at=time(14, 29))
+        self.subscribe(self.campaign, '+15105550102', at=time(14, 31))
+        cache.set(KEY_DISPATCHED, MONDAY.replace(minute=27, second=0), timeout=0)
+
+        # 14:27 was dispatched by the last run
+        self.assertEqual(dispatch_scheduled_calls(MONDAY), 1)
+        self.assertEqual([c['to'] for c in self.twilio.placed], ['+15105550101'])
+        self.assertEqual(dispatch_scheduled_calls(MONDAY + timedelta(minutes=1)), 1)
+        self.assertEqual(cache.get(KEY_DISPATCHED), MONDAY.replace(minute=31, second=0))
+
+    def test_overlapping_run_skipped(self):
+        self.subscribe(self.campaign, '+15105550100')
+        cache.add(KEY_DISPATCHING, True)
+        self.assertEqual(dispatch_scheduled_calls(MONDAY), 0)
+        cache.delete(KEY_DISPATCHING)
+        self.assertEqual(dispatch_scheduled_calls(MONDAY), 1)
+
+    def test_dispatcher_scheduled_on_subscribe(self):
+        registered = []
+        cron = dispatch_scheduled_calls.cron
+        dispatch_scheduled_calls.cron = lambda *args: registered.append(args)
+        self.app.config['SCHEDULE_DISPATCH_CRON'] = True
+        try:
+            self.subscribe(self.campaign, '+15105550100')
+            self.subscribe(self.campaign, '+15105550101')
+        finally:
+            dispatch_scheduled_calls.cron = cron
+        # once, until it is due to be registered again
+        self.assertEqual(registered, [('* * * * *', 'schedule:dispatch_scheduled_calls')])
@@ -0,0 +1,168 @@
+import json
+from datetime import datetime, timedelta
+
+from run import BaseTestCase
+
+from call_server.extensions import db, cache
+from call_server.campaign.models import Campaign, Target
+from call_server.call.models import Call, Session
+from call_server.stats.models import CallRollup, SessionRollup, SessionCallsRollup
+from call_server.stats.jobs import update_stats_rollups
+from call_server.api.views import histogram_median
+
+
+class TestStatsRollup(BaseTestCase):
+
+    def setUp(self, **kwargs):
+        super(TestStatsRollup, self).setUp(**kwargs)
+        self.app.config['ADMIN_API_KEY'] = 'test-key'
+        self.app.secret_key = 'test'
+
+        self.campaign = Campaign(name='Test Stats', country_code='us',
+            campaign_type='custom', campaign_language='en', segment_by='custom')
+        self.target = Target(uid='custom:T1', title='Senator', name='Test Target')
+        db.session.add(self.campaign)
+        db.session.add(self.target)
+        db.session.commit()
+
+        self.hour = datetime(2019, 3, 14, 10)
+
+        # the stats API queues rollup jobs, run here by each test
+        self.queued = []
+        self.queue = update_stats_rollups.queue
+        update_stats_rollups.queue = lambda *args, **kwargs: self.queued.append(args)
+
+    def tearDown(self):
+        update_stats_rollups.queue = self.queue
+        super(TestStatsRollup, self).tearDown()
+
+    def add_session(self, timestamp, calls, queue_delay=None):
+        call_session = Session(campaign_id=self.campaign.id)
+        call_session.timestamp = timestamp
+        call_session.queue_delay = queue_delay
+        db.session.add(call_session)
+        db.session.commit()
+
+        for (minutes, status) in calls:
+            call = Call(call_session.id, self.campaign.id, self.target.id, status=status, duration=30)
+            call.timestamp = timestamp + timedelta(minutes=minutes)
+            db.session.add(call)
+        db.session.commit()
+        return call_session
+
+    def test_rollup_calls(self):
+        self.add_session(self.hour, [(1, 'completed'), (2, 'completed'), (3, 'busy')],
+            queue_delay=timedelta(seconds=4))
+        self.add_session(self.hour + timedelta(minutes=30), [(1, 'completed')],
+            queue_delay=timedelta(seconds=2))
+        self.add_session(self.hour + timedelta(hours=1), [(1, 'no-answer')])
+
+        self.assertEqual(update_stats_rollups(), 8)
+
+        completed = CallRollup.query.filter_by(status='completed').one()
+        self.assertEqual(completed.hour, self.hour)
+        self.assertEqual(completed.count, 3)
+        self.assertEqual(completed.duration, 90)
+        self.assertEqual(CallRollup.query.count(), 3)
+
+        sessions = SessionRollup.query.filter_by(hour=self.hour).one()
+        self.assertEqual(sessions.count, 2)
+        self.assertEqual(sessions.queue_delay_seconds, 6)
+
+        histogram = dict((r.calls_completed, r.sessions) for r in SessionCallsRollup.query)
+        self.assertEqual(histogram, {1: 1, 2: 1})
+
+    def test_rollup_incremental(self):
+        call_session = self.add_session(self.hour, [(1, 'completed')])
+        update_stats_rollups()
+
+        # a second completed call in the same session moves it up the histogram
+        call = Call(call_session.id, self.campaign.id, self.target.id, status='completed')
+        call.timestamp = self.hour + timedelta(minutes=5)
+        db.session.add(call)
+        db.session.commit()
+
+        self.assertEqual(update_stats_rollups(), 1)
+        self.assertEqual(update_stats_rollups(), 0)
+
+        self.assertEqual(CallRollup.query.filter_by(status='completed').one().count, 2)
+        histogram = dict((r.calls_completed, r.sessions) for r in SessionCallsRollup.query)
+        self.assertEqual(histogram, {1: 0, 2: 1})
+
+    def test_logged_late(self):
+        self.add_session(self.hour, [(1, 'completed')])
+        update_stats_rollups()
+
+        # written by the call log hours after it was placed, with a higher id and an earlier timestamp
+        call_session = self.add_session(self.hour + timedelta(hours=3), [])
+        call = Call(call_session.id, self.campaign.id, self.target.id, status='completed')
+        call.timestamp = self.hour - timedelta(hours=2)
+        db.session.add(call)
+        db.session.commit()
+
+        self.assertEqual(update_stats_rollups(), 2)
+        self.assertEqual(sum(r.count for r in CallRollup.query), 2)
+
+    def test_recent_calls_wait(self):
+        self.add_session(self.hour, [(1, 'completed')])
+        self.add_session(datetime.utcnow(), [(0, 'completed')])
+
+        # only the settled session and call
+        self.assertEqual(update_stats_rollups(), 2)
+        self.assertEqual(CallRollup.query.one().count, 1)
+
+    def test_histogram_median(self):
+        self.assertEqual(histogram_median([(1, 2), (3, 1)]), 1)
+        self.assertEqual(histogram_median([(1, 1), (3, 1)]), 2)
+        self.assertIsNone(histogram_median([]))
+
+    def test_campaign_stats(self):
+        self.add_session(self.hour, [(1, 'completed'), (2, 'completed')], queue_delay=timedelta(seconds=4))
+        self.add_session(self.hour, [(3, 'completed')], queue_delay=timedelta(seconds=2))
+        update_stats_rollups()
+
+        response = self.client.get('/api/campaign/%d/stats.json?api_key=test-key' % self.campaign.id)
+        self.assert200(response)
+        data = json.loads(response.data)
+        self.assertEqual(data['sessions_started'], 2)
+        self.assertEqual(data['queue_avg_seconds'], 3)
+        self.assertEqual(data['sessions_completed'], 2)
+        self.assertEqual(data['calls_completed'], 3)
+        self.assertEqual(data['calls_per_session'], {'avg': '1.50', 'med': 1.5})
+        self.assertEqual(data['date_start'], '2019-03-14')
+
+    def test_campaign_date_calls(self):
+        self.add_session(self.hour, [(1, 'completed'), (2, 'busy')])
+        self.add_session(self.hour + timedelta(days=1), [(1, 'completed')])
+        update_stats_rollups()
+
+        response = self.client.get('/api/campaign/%d/date_calls.json?api_key=test-key' % self.campaign.id)
+        self.assert200(response)
+        self.assertEqual(json.loads(response.data)['objects'], {
+            '2019-03-14': {'completed': 1, 'busy': 1},
+            '2019-03-15': {'completed': 1}
+        })
+
+    def test_refresh_queues_job(self):
+        self.add_session(self.hour, [(1, 'completed')])
+        for interval in (60, None):
+            self.app.config['STATS_ROLLUP_INTERVAL'] = interval
+            cache.clear()
+            del self.queued[:]
+            response = self.client.get('/api/campaign/%d/stats.json?api_key=test-key' % self.campaign.id)
+            self.client.get('/api/campaign/%d/stats.json?api_key=test-key' % self.campaign.id)
+            self.assert200(response)
+            self.assertEqual(len(self.queued), 1)
+            # served from the rollups as they are, until the job runs
+            self.assertEqual(json.loads(response.data)['calls_completed'], 0)
+            self.assertEqual(CallRollup.query.count(), 0)
+
+    def test_campaign_target_calls(self):
+        self.add_session(self.hour, [(1, 'completed'), (2, 'busy')])
+        update_stats_rollups()
+
+        response = self.client.get('/api/campaign/%d/target_calls.json?api_key=test-key' % self.campaign.id)
+        self.assert200(response)
+        target = json.loads(response.data)['objects']['custom:T1']
+        self.assertEqual(target['completed'], 1)
+        self.assertEqual(target['busy'], 1)
@@ -0,0 +1,51 @@
+from twilio.twiml.voice_response import VoiceResponse
+
+from run import BaseTestCase
+
+from call_server.extensions import db
+from call_server.campaign.models import Campaign, AudioRecording, CampaignAudioRecording
+from call_server.campaign.snapshot import get_campaign_snapshot, invalidate_campaign_snapshot, _snapshots
+from call_server.call.twiml import campaign_messages, tts_language, _compiled
+
+
+class TestCampaignMessages(BaseTestCase):
+
+    def setUp(self, **kwargs):
+        super(TestCampaignMessages, self).setUp(**kwargs)
+
+        self.campaign = Campaign(name='Test TwiML', country_code='us',
+            campaign_type='custom', campaign_language='en', segment_by='custom')
+        db.session.add(self.campaign)
+        recording = AudioRecording(key='msg_target_intro', version=1,
+            text_to_speech='Connecting you to {{title}} {{name}}')
+        db.session.add(CampaignAudioRecording(campaign=self.campaign, recording=recording, selected=True))
+        db.session.commit()
+
+        _snapshots.clear()
+        _compiled.clear()
+        invalidate_campaign_snapshot(self.campaign.id)
+        self.snapshot = get_campaign_snapshot(self.campaign.id)
+
+    def test_tts_language(self):
+        self.assertEqual(tts_language('en-US'), 'en-US')
+        self.assertEqual(tts_language('xx-YY'), 'xx')
+        self.assertEqual(tts_language(None), 'en')
+
+    def test_template_rendered(self):
+        resp = VoiceResponse()
+        campaign_messages(self.snapshot).append(resp, 'msg_target_intro', title='Senator', name='Test')
+        self.assertIn('<Say language="en-US" voice="alice">Connecting you to Senator Test</Say>', str(resp))
+
+    def test_static_message_prerendered(self):
+        message = campaign_messages(self.snapshot).get('msg_goodbye')
+        self.assertIsNone(message.template)
+        self.assertEqual(message.render(), self.snapshot.audio('msg_goodbye'))
+
+    def test_compiled_once_per_version(self):
+        messages = campaign_messages(self.snapshot)
+        message = messages.get('msg_target_intro')
+        self.assertIs(campaign_messages(self.snapshot).get('msg_target_intro'), message)
+
+        invalidate_campaign_snapshot(self.campaign.id)
+        updated = campaign_messages(get_campaign_snapshot(self.campaign.id))
+        self.assertIsNot(updated, messages)
@@ -102,6 +102,59 @@ class TestUSData(BaseTestCase):
         self.assertEqual(rep['district'], '0')
         self.assertGreater(len(rep['offices']), 1)
 
+    def test_congress_members(self):
+        senators, representatives = self.us_data.get_congress_members('42223')
+        self.assertEqual(set(s['state'] for s in senators), set(['KY', 'TN']))
+        self.assertEqual(len(senators), 4)
+        self.assertEqual(len(representatives), 2)
+
+    def test_congress_members_single_read(self):
+        reads = []
+        class CountingCache(dict):
+            def get_many(self, *keys):
+                reads.append(keys)
+                return [self.get(k) for k in keys]
+
+        us_data = USDataProvider(CountingCache(self.mock_cache), 'localmem')
+        senators, representatives = us_data.get_congress_members('53811')
+        self.assertEqual(len(reads), 1)
+        self.assertEqual(len(senators), 2)
+        self.assertEqual(len(representatives), 2)
+
+    def test_search_key(self):
+        results = self.us_data.cache_search('us:senate:CA')
+        self.assertEqual(len(results), 2)
+        self.assertTrue(all(r['state'] == 'CA' for r in results))
+
+        results = self.us_data.cache_search('us:house:CA:13')
+        self.assertEqual(len(results), 1)
+
+    def test_search_filter(self):
+        results = self.us_data.cache_search('us:senate:', [('state', 'ma')])
+        self.assertEqual(len(results), 2)
+        self.assertTrue(all(r['state'] == 'MA' for r in results))
+
+        results = self.us_data.cache_search('us:house:', [('last_name', 'Pelosi')])
+        self.assertEqual(len(results), 1)
+        self.assertEqual(results[0]['state'], 'CA')
+
+    def test_search_filter_ignores_accents(self):
+        results = self.us_data.cache_search('us:house:', [('last_name', u'Vel\xe1zquez')])
+        self.assertEqual(len(results), 1)
+        self.assertEqual(results[0]['last_name'], u'Vel\xe1zquez')
+
+        results = self.us_data.cache_search('us:house:', [('last_name', 'velaz')])
+        self.assertEqual(len(results), 1)
+
+    def test_search_governor(self):
+        results = self.us_data.cache_search('us_state:governor:CA')
+        self.assertEqual(len(results), 1)
+        self.assertEqual(results[0]['title'], 'Governor')
+
+    def test_search_no_results(self):
+        self.assertEqual(self.us_data.cache_search('us:house:ZZ'), [])
+        self.assertEqual(self.us_data.cache_search('us:house:', [('last_name', 'zzzz')]), [])
+
     def test_locate_targets(self):
         uids = locate_targets(self.mock_location, self.CONGRESS_CAMPAIGN, cache=self.mock_cache)
         # returns a list of target uids
@@ -1,4 +1,8 @@
+import json
 import logging
+import os
+import shutil
+import tempfile
 
 from run import BaseTestCase
 
@@ -142,3 +146,86 @@ class TestUSStateData(BaseTestCase):
         self.assertEqual(gov[0]['state_name'], 'California')
         self.assertEqual(gov[0]['title'], 'Governor')
 
+
+
+def square(x, y, size):
+    return [[[x, y], [x + size, y], [x + size, y + size], [x, y + size], [x, y]]]
+
+
+def openstates_person(person_id, chamber, district):
+    return {
+        'id': person_id,
+        'name': 'Test Legislator',
+        'givenName': 'Test',
+        'familyName': 'Legislator',
+        'chamber': [{
+            'post': {'label': district, 'role': 'Senator' if chamber == 'upper' else 'Assembly Member',
+                     'division': {'id': 'ocd-division/country:us/state:ca/%s:%s' % (
+                        'sldu' if chamber == 'upper' else 'sldl', district)}},
+            'organization': {'name': 'California Legislature', 'classification': chamber},
+        }],
+        'contactDetails': [],
+    }
+
+
+class UnavailableOpenStates(object):
+    def __getattr__(self, name):
+        raise AssertionError('OpenStates should not be called')
+
+
+class TestUSStateDistricts(BaseTestCase):
+
+    def setUp(self, **kwargs):
+        super(TestUSStateDistricts, self).setUp(**kwargs)
+        self.tmp_dir = tempfile.mkdtemp()
+        for (chamber, field, district) in (('sldu', 'SLDUST', '009'), ('sldl', 'SLDLST', '018')):
+            with open(os.path.join(self.tmp_dir, 'us_%s.json' % chamber), 'w') as f:
+                json.dump({'type': 'FeatureCollection', 'features': [{
+                    'type': 'Feature',
+                    'properties': {'STATEFP': '06', field: district, 'NAMELSAD': 'District %s' % district},
+                    'geometry': {'type': 'Polygon', 'coordinates': square(-122.3, 37.75, 0.1)},
+                }]}, f)
+        with open(os.path.join(self.tmp_dir, 'us_zcta_centroids.txt'), 'w') as f:
+            f.write('GEOID\tALAND\tAWATER\tALAND_SQMI\tAWATER_SQMI\tINTPTLAT\tINTPTLONG        \n')
+            f.write('94612\t1838489\t0\t0.71\t0\t37.811\t-122.268\n')
+            f.write('02111\t1083744\t0\t0.418\t0\t42.351\t-71.061\n')
+
+        self.mock_cache = {}
+        self.us_data = USDataProvider(self.mock_cache)
+        self.us_data.STATE_DISTRICTS_FILE = os.path.join(self.tmp_dir, 'us_{chamber}.json')
+        self.us_data.ZCTA_CENTROIDS_FILE = os.path.join(self.tmp_dir, 'us_zcta_centroids.txt')
+        self.us_data.cache_set_many(self.us_data._load_state_districts())
+        self.us_data.cache_state_legislators([
+            openstates_person('ocd-person/upper', 'upper', '9'),
+            openstates_person('ocd-person/lower', 'lower', '18'),
+        ])
+        self.us_data._openstates = UnavailableOpenStates()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+        super(TestUSStateDistricts, self).tearDown()
+
+    def test_zipcode_table(self):
+        self.assertEqual(self.us_data.cache_get('us_state:zipcode:94612'), [
+            'ocd-division/country:us/state:ca/sldu:9', 'ocd-division/country:us/state:ca/sldl:18'])
+        self.assertEqual(self.us_data.cache_get('us_state:zipcode:02111'), [])
+
+    def test_latlon_offline(self):
+        location = Location('Oakland, CA', (37.804417, -122.267747), {'state': 'CA', 'zipcode': '94612'})
+        legislators = self.us_data.get_state_legislators(location)
+        self.assertEqual([l['chamber'] for l in legislators], ['upper', 'lower'])
+        self.assertEqual(legislators[0]['cache_key'], 'us_state:openstates:ocd-person/upper')
+        self.assertEqual(self.us_data.get_uid(legislators[1]['cache_key'])['district'], '18')
+
+    def test_vacant_seat_removed(self):
+        self.us_data.cache_state_legislators([openstates_person('ocd-person/upper', 'upper', '9')])
+        self.assertEqual(self.us_data.cache_get('us_state:division:ocd-division/country:us/state:ca/sldl:18'), [])
+        self.assertEqual(len(self.us_data.cache_get('us_state:division:ocd-division/country:us/state:ca/sldu:9')), 1)
+        self.assertEqual(self.us_data.cache_get('us_state:divisions:CA'),
+                         ['us_state:division:ocd-division/country:us/state:ca/sldu:9'])
+
+    def test_postal_offline(self):
+        location = Location('94612', (None, None), {'state': 'CA', 'zipcode': '94612'})
+        location.service = 'LocalUSDataProvider'
+        legislators = self.us_data.get_state_legislators(location)
+        self.assertEqual([l['id'] for l in legislators], ['ocd-person/upper', 'ocd-person/lower'])